@@ -0,0 +1,318 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from API.Backend.config import (
+    BATCH_SIZE,
+    BATCH_MAX_FILES,
+    BATCH_MAX_FILE_BYTES,
+    BATCH_MAX_TOTAL_BYTES,
+    BATCH_JOB_WORKERS,
+    BATCH_JOB_TTL,
+    BATCH_SPOOL_DIR,
+)
+from API.Backend.file_utils import SUPPORTED_EXTENSIONS, UploadTooLarge, iter_file_pages, restore_images, spool_to_disk
+from API.Backend.image_store import get_image_store
+from API.Backend.image_processing import process_images, describe_regions
+from API.Backend.result_cache import cache_key_from_digest
+
+class BatchJob:
+    """
+    The state of one batch upload: its spooled files, progress and per-invoice results.
+    """
+
+    def __init__(self, job_id, directory):
+        self.id = job_id
+        self.directory = directory
+        self.items = []  # (name, path, SHA-256 of the contents)
+        self.spooled_bytes = 0
+        self.results = []
+        self.status = "spooling"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.processed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def add_result(self, result):
+        with self.lock:
+            self.results.append(result)
+            self.processed += 1
+            if "error" in result:
+                self.failed += 1
+
+    def progress(self):
+        """
+        Return the job status and throughput so far.
+
+        Returns:
+            dict: Status, counts, elapsed seconds and invoices per second.
+        """
+        with self.lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "error": self.error,
+                "total": len(self.items),
+                "processed": self.processed,
+                "failed": self.failed,
+                "elapsed_seconds": elapsed,
+                "invoices_per_second": self.processed / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def results_since(self, index):
+        with self.lock:
+            return self.results[index:], self.status in ("done", "failed")
+
+class BatchItem:
+    """
+    One file of a running job, collecting its page results across YOLO batches.
+    """
+
+    def __init__(self, name, digest):
+        self.name = name
+        self.digest = digest
+        self.page_results = []
+        self.images = {}
+        self.queued = 0  # pages handed to a batch
+        self.complete = False  # every page has been queued
+        self.error = None
+
+    def result(self):
+        if self.error is not None:
+            return {"file": self.name, "error": self.error}
+        if not self.page_results:
+            return {"file": self.name, "error": "Failed to decode file"}
+        return {"file": self.name, "pages": self.page_results}
+
+class BatchJobManager:
+    """
+    Spool batch uploads to disk and run them through the batched pipeline in the background.
+
+    Uploads are written to BATCH_SPOOL_DIR as they arrive (ZIP archives are
+    unpacked member by member, within `max_file_bytes` per file and
+    `max_total_bytes` per job), so a batch never has to fit in memory. Jobs
+    run on a small dedicated thread pool; each one decodes pages lazily into
+    batches of `batch_size` for `process_images`, so at most one batch of
+    pages is held at a time, and results become visible per invoice as soon
+    as its last page is processed. With a `pipeline`, batches run on its
+    workers so batch jobs and API requests share one concurrency limit.
+    """
+
+    def __init__(self, yolo_model, donut_model, result_cache=None, batch_size=BATCH_SIZE,
+                 max_files=BATCH_MAX_FILES, workers=BATCH_JOB_WORKERS, spool_dir=BATCH_SPOOL_DIR,
+                 max_file_bytes=BATCH_MAX_FILE_BYTES, max_total_bytes=BATCH_MAX_TOTAL_BYTES, pipeline=None):
+        self.yolo_model = yolo_model
+        self.donut_model = donut_model
+        self.result_cache = result_cache
+        self.batch_size = batch_size
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.pipeline = pipeline
+        self.spool_dir = spool_dir
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create_job(self):
+        """
+        Create an empty job with its own spool directory.
+
+        Returns:
+            BatchJob: The new job.
+        """
+        self._evict_finished()
+        job_id = uuid.uuid4().hex
+        directory = os.path.join(self.spool_dir, job_id)
+        os.makedirs(directory, exist_ok=True)
+        job = BatchJob(job_id, directory)
+        with self._lock:
+            self._jobs[job_id] = job
+        return job
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def add_upload(self, job, source, filename):
+        """
+        Spool one uploaded file, or every supported member of a ZIP archive, into the job.
+
+        Args:
+            job (BatchJob): The job being filled.
+            source: A readable binary file object.
+            filename (str): The uploaded filename.
+
+        Raises:
+            UploadTooLarge: If a file or the job exceeds its size limit once extracted.
+            ValueError: If the file type is unsupported or the job has too many files.
+        """
+        extension = os.path.splitext(filename)[1].lower()
+        if extension == ".zip":
+            archive_path = os.path.join(job.directory, f"upload-{len(job.items)}.zip")
+            spool_to_disk(source, archive_path, max_bytes=self._remaining_bytes(job))
+            try:
+                archive = zipfile.ZipFile(archive_path)
+            except zipfile.BadZipFile:
+                os.remove(archive_path)
+                raise ValueError(f"Invalid ZIP archive: {filename}")
+            try:
+                with archive:
+                    for info in archive.infolist():
+                        member_extension = os.path.splitext(info.filename)[1].lower()
+                        if info.is_dir() or member_extension not in SUPPORTED_EXTENSIONS:
+                            continue
+                        # Reject on the declared size before extracting anything;
+                        # spool_to_disk still caps the bytes actually inflated.
+                        if info.file_size > min(self.max_file_bytes, self._remaining_bytes(job)):
+                            raise UploadTooLarge(f"{info.filename} in {filename} exceeds the size limit")
+                        with archive.open(info) as member:
+                            self._add_file(job, member, info.filename, member_extension)
+            finally:
+                os.remove(archive_path)
+        elif extension in SUPPORTED_EXTENSIONS:
+            self._add_file(job, source, filename, extension)
+        else:
+            raise ValueError(f"Unsupported file format: {filename}")
+
+    def _add_file(self, job, source, name, extension):
+        if len(job.items) >= self.max_files:
+            raise ValueError(f"Batch exceeds the limit of {self.max_files} files")
+        # Files are stored under their index so archive paths never escape the job directory.
+        path = os.path.join(job.directory, f"{len(job.items)}{extension}")
+        digest = spool_to_disk(source, path, max_bytes=min(self.max_file_bytes, self._remaining_bytes(job)))
+        job.spooled_bytes += os.path.getsize(path)
+        job.items.append((name, path, digest))
+
+    def _remaining_bytes(self, job):
+        remaining = self.max_total_bytes - job.spooled_bytes
+        if remaining <= 0:
+            raise UploadTooLarge(f"Batch exceeds the limit of {self.max_total_bytes} bytes")
+        return remaining
+
+    def discard(self, job):
+        """
+        Drop a job that could not be spooled, along with its files.
+
+        Args:
+            job (BatchJob): The job to drop.
+        """
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+    def start(self, job):
+        """
+        Queue a fully spooled job for processing.
+
+        Args:
+            job (BatchJob): The job to run.
+        """
+        with job.lock:
+            job.status = "queued"
+        self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        with job.lock:
+            job.status = "running"
+            job.started_at = time.time()
+        try:
+            open_items, batch = [], []  # items awaiting results, in upload order; (item, page) pairs
+            for name, path, digest in job.items:
+                cached = self.result_cache.get(cache_key_from_digest(digest)) if self.result_cache else None
+                if cached is not None:
+                    os.remove(path)
+                    restore_images(cached["images"])
+                    item = BatchItem(name, digest)
+                    item.page_results = cached["pages"]
+                    item.complete = True
+                    open_items.append(item)
+                    self._flush(job, open_items)
+                    continue
+                item = BatchItem(name, digest)
+                open_items.append(item)
+                try:
+                    # Pages are decoded one at a time and handed to the batch as they come.
+                    for page in iter_file_pages(path):
+                        batch.append((item, page))
+                        item.queued += 1
+                        if len(batch) >= self.batch_size:
+                            self._process_batch(batch)
+                            batch = []
+                            self._flush(job, open_items)
+                except Exception as e:
+                    item.error = getattr(e, "detail", str(e))
+                finally:
+                    os.remove(path)
+                item.complete = True
+                self._flush(job, open_items)
+            self._process_batch(batch)
+            self._flush(job, open_items)
+            status, error = "done", None
+        except Exception as e:
+            print(f"Batch job {job.id} failed: {str(e)}")
+            status, error = "failed", str(e)
+        finally:
+            shutil.rmtree(job.directory, ignore_errors=True)
+        with job.lock:
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+
+    def _flush(self, job, open_items):
+        # Publish finished items in upload order; an item is finished once all its pages are queued and processed.
+        while open_items and open_items[0].complete and len(open_items[0].page_results) >= open_items[0].queued:
+            item = open_items.pop(0)
+            if item.error is None and item.queued and self.result_cache is not None:
+                # Keyed after the run, by the backends that produced the results.
+                self.result_cache.put(cache_key_from_digest(item.digest), {"pages": item.page_results, "images": item.images})
+            job.add_result(item.result())
+
+    def _process_batch(self, batch):
+        if not batch:
+            return
+        images = [page.image for _, page in batch]
+        detections = []
+        try:
+            if self.pipeline is not None:
+                outputs = self.pipeline.run_blocking(process_images, images, self.yolo_model, self.donut_model, detections)
+            else:
+                outputs = process_images(images, self.yolo_model, self.donut_model, detections)
+        except Exception as e:
+            for item, _ in batch:
+                item.error = str(e)
+                item.page_results.append(None)  # count the page as processed
+            return
+
+        # Encode and write every annotated page in parallel on the image store's writers.
+        store = get_image_store()
+        image_urls = [store.save_async(output[0], item.images) for (item, _), output in zip(batch, outputs)]
+        for (item, page), output, image_url, (paragraph_boxes, table_boxes) in zip(batch, outputs, image_urls, detections):
+            _, paragraph_texts, table_texts, donut_results, table_grids = output
+            item.page_results.append({
+                "page": len(item.page_results) + 1,
+                "paragraphs": paragraph_texts,
+                "tables": table_texts,
+                "table_grids": table_grids,
+                "image_url": image_url.result(),
+                "donut_extraction": donut_results,
+                "regions": describe_regions(paragraph_boxes, table_boxes, page.to_original),
+            })
+
+    def _evict_finished(self):
+        cutoff = time.time() - BATCH_JOB_TTL
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,604 @@
+"""
+Benchmark the extraction pipeline on a fixed image corpus.
+
+The corpus is the sorted list of images in Yolov9/test/images, so two runs on
+the same commit see exactly the same inputs. Reports are JSON and can be
+diffed with the compare mode to show the effect of a performance change.
+
+Modes:
+    pipeline  Run the pipeline in process: per-stage and end-to-end latency
+              percentiles, throughput, scaling across worker counts and
+              batch sizes, PDF rasterisation and peak RSS.
+    http      Load-test a running API, or one started with --serve, with
+              concurrent /upload_invoice requests. With --serve-workers the
+              server runs under gunicorn and the report includes the RSS and
+              PSS of every worker after the load.
+    compare   Print the relative change of every metric between two reports.
+
+Usage:
+    python -m API.Backend.benchmark pipeline --workers 1,2,4 --batch-sizes 1,4 --output before.json
+    python -m API.Backend.benchmark http --serve --concurrency 4 --requests 40 --output http.json
+    python -m API.Backend.benchmark http --serve --serve-workers 8 --concurrency 16 --output workers8.json
+    python -m API.Backend.benchmark compare before.json after.json
+"""
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from API.Backend.config import YOLO_BACKEND, DONUT_BACKEND
+from API.Backend.serving import memory_report
+
+DEFAULT_IMAGES = "Yolov9/test/images"
+DEFAULT_URL = "http://127.0.0.1:8000"
+# Report keys where a higher value is better; everything else is a latency or size.
+HIGHER_IS_BETTER = ("throughput",)
+# Report keys that describe the run rather than measure it; they are compared but never better or worse.
+COUNT_KEYS = ("count", "pages", "images", "requests", "concurrency", "workers")
+
+def load_corpus(directory=DEFAULT_IMAGES, limit=None):
+    """
+    Load the benchmark images in a stable order.
+
+    Args:
+        directory (str, optional): The image directory.
+        limit (int, optional): The maximum number of images.
+
+    Returns:
+        list: (filename, bytes) tuples sorted by filename.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, "*.jpg")) + glob.glob(os.path.join(directory, "*.png")))
+    corpus = []
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+def corpus_digest(corpus):
+    """
+    Hash the corpus so reports can show that they were run on the same inputs.
+
+    Args:
+        corpus (list): The list returned by `load_corpus`.
+
+    Returns:
+        str: A hex SHA-256 over every filename and file.
+    """
+    digest = hashlib.sha256()
+    for filename, contents in corpus:
+        digest.update(filename.encode())
+        digest.update(contents)
+    return digest.hexdigest()
+
+def summarize(values):
+    """
+    Summarize latencies in seconds.
+
+    Args:
+        values (list): Observed latencies.
+
+    Returns:
+        dict: The count, mean, p50, p95, p99 and max, rounded to 0.1 ms.
+    """
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(p50), 4),
+        "p95": round(float(p95), 4),
+        "p99": round(float(p99), 4),
+        "max": round(float(values.max()), 4),
+    }
+
+def peak_rss_mb(pid=None):
+    """
+    Return the peak resident set size of this process or of another local process.
+
+    Args:
+        pid (int, optional): A process id. Defaults to the current process.
+
+    Returns:
+        float or None: The peak RSS in MiB, or None if it cannot be read.
+    """
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in KiB elsewhere.
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def environment():
+    """
+    Describe where a report was produced.
+
+    Returns:
+        dict: Python and platform versions, CPU count, backends and git commit.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "yolo_backend": YOLO_BACKEND,
+        "donut_backend": DONUT_BACKEND,
+        "commit": commit,
+    }
+
+def decode_corpus(corpus):
+    from API.Backend.file_utils import iter_upload_pages
+
+    # Decode and preprocess once, as the API does, so every run measures the models on the same pages.
+    return [page.image for filename, contents in corpus for page in iter_upload_pages(contents, filename)]
+
+def run_sequential(images, yolo_model, donut_model):
+    """
+    Process the images one at a time and record per-stage and end-to-end latency.
+
+    Args:
+        images (list): Decoded images in OpenCV format.
+        yolo_model: The YOLO model.
+        donut_model: The Donut (processor, model) tuple or a DonutBatcher.
+
+    Returns:
+        dict: Throughput, end-to-end latency and the latency of every traced stage.
+    """
+    from API.Backend.invoice_pipeline import process_page
+    from API.Backend.metrics import trace
+
+    end_to_end = []
+    stages = {}
+    start = time.perf_counter()
+    for image in images:
+        page_start = time.perf_counter()
+        with trace() as timings:
+            process_page(image, yolo_model, donut_model)
+        end_to_end.append(time.perf_counter() - page_start)
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput": round(len(images) / elapsed, 3),
+        "end_to_end": summarize(end_to_end),
+        "stages": {stage: summarize(values) for stage, values in sorted(stages.items())},
+    }
+
+def run_workers(images, yolo_model, donut_model, workers):
+    """
+    Process the images on several threads at once, like concurrent API requests.
+
+    Args:
+        images (list): Decoded images in OpenCV format.
+        yolo_model: The YOLO model.
+        donut_model: The Donut (processor, model) tuple or a DonutBatcher.
+        workers (int): The number of threads.
+
+    Returns:
+        dict: Throughput and per-image latency.
+    """
+    from API.Backend.invoice_pipeline import process_page
+
+    def process(image):
+        page_start = time.perf_counter()
+        process_page(image, yolo_model, donut_model)
+        return time.perf_counter() - page_start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        latencies = list(executor.map(process, images))
+    elapsed = time.perf_counter() - start
+    return {"throughput": round(len(images) / elapsed, 3), "end_to_end": summarize(latencies)}
+
+def run_batches(images, yolo_model, donut_model, batch_size):
+    """
+    Process the images in batches with `process_images`, batching YOLO and Donut across them.
+
+    Args:
+        images (list): Decoded images in OpenCV format.
+        yolo_model: The YOLO model.
+        donut_model (tuple): The Donut (processor, model) tuple.
+        batch_size (int): Images per batch, also the Donut batcher's maximum batch size.
+
+    Returns:
+        dict: Throughput and per-batch latency.
+    """
+    from API.Backend.donut_batching import DonutBatcher
+    from API.Backend.image_processing import process_images
+
+    batcher = DonutBatcher(donut_model, max_batch_size=batch_size)
+    batcher.start()
+    latencies = []
+    start = time.perf_counter()
+    try:
+        for offset in range(0, len(images), batch_size):
+            batch_start = time.perf_counter()
+            process_images(images[offset:offset + batch_size], yolo_model, batcher)
+            latencies.append(time.perf_counter() - batch_start)
+    finally:
+        batcher.stop()
+    elapsed = time.perf_counter() - start
+    return {"throughput": round(len(images) / elapsed, 3), "batch_latency": summarize(latencies)}
+
+def build_pdf(corpus, pages):
+    """
+    Assemble corpus images into a multi-page PDF.
+
+    Args:
+        corpus (list): The list returned by `load_corpus`.
+        pages (int): The number of pages.
+
+    Returns:
+        bytes: The PDF file.
+    """
+    from PIL import Image
+
+    images = [Image.open(io.BytesIO(contents)).convert("RGB") for _, contents in corpus[:pages]]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PDF", save_all=True, append_images=images[1:])
+    return buffer.getvalue()
+
+def run_pdf(corpus, pages, repeats=3):
+    """
+    Time PDF rasterisation of the first page and of a whole document.
+
+    Args:
+        corpus (list): The list returned by `load_corpus`.
+        pages (int): The number of pages in the generated PDF.
+        repeats (int, optional): How many times each measurement is taken.
+
+    Returns:
+        dict: Latency of `convert_pdf_to_image` and of rendering every page with `iter_pdf_pages`.
+    """
+    from API.Backend.file_utils import convert_pdf_to_image, iter_pdf_pages
+
+    contents = build_pdf(corpus, pages)
+    first_page, all_pages = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        convert_pdf_to_image(contents)
+        first_page.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in iter_pdf_pages(contents):
+            pass
+        all_pages.append(time.perf_counter() - start)
+    return {"pages": pages, "first_page": summarize(first_page), "all_pages": summarize(all_pages)}
+
+def run_pipeline_benchmark(corpus, workers=(1,), batch_sizes=(), pdf_pages=0, warmup=2):
+    """
+    Run the in-process benchmark.
+
+    Args:
+        corpus (list): The list returned by `load_corpus`.
+        workers (iterable, optional): Thread counts to measure.
+        batch_sizes (iterable, optional): Batch sizes to measure with `process_images`.
+        pdf_pages (int, optional): Pages in the generated PDF, or 0 to skip the PDF benchmark.
+        warmup (int, optional): Images processed before measuring.
+
+    Returns:
+        dict: The benchmark report.
+    """
+    from API.Backend.model import get_model
+    from API.Backend.donut_extraction import load_donut_model
+    from API.Backend.donut_batching import DonutBatcher
+    from API.Backend.invoice_pipeline import process_page
+
+    report = {
+        "mode": "pipeline",
+        "environment": environment(),
+        "corpus": {"images": len(corpus), "sha256": corpus_digest(corpus)},
+    }
+
+    start = time.perf_counter()
+    yolo_model = get_model()
+    donut_model = load_donut_model()
+    report["model_load_seconds"] = round(time.perf_counter() - start, 2)
+
+    images = decode_corpus(corpus)
+    # The API shares one Donut batcher between requests, so measure through one too.
+    batcher = DonutBatcher(donut_model)
+    batcher.start()
+    try:
+        for image in images[:warmup]:
+            process_page(image, yolo_model, batcher)
+        print(f"Sequential run over {len(images)} images")
+        report["sequential"] = run_sequential(images, yolo_model, batcher)
+        report["workers"] = {}
+        for count in workers:
+            print(f"Worker scaling: {count} workers")
+            report["workers"][str(count)] = run_workers(images, yolo_model, batcher, count)
+    finally:
+        batcher.stop()
+
+    report["batch_sizes"] = {}
+    for batch_size in batch_sizes:
+        print(f"Batch scaling: batch size {batch_size}")
+        report["batch_sizes"][str(batch_size)] = run_batches(images, yolo_model, donut_model, batch_size)
+
+    if pdf_pages:
+        print(f"PDF rasterisation: {pdf_pages} pages")
+        report["pdf"] = run_pdf(corpus, pdf_pages)
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+def encode_multipart(filename, contents):
+    """
+    Encode a single file as a multipart/form-data body for the `file` field.
+
+    Args:
+        filename (str): The filename sent with the upload.
+        contents (bytes): The file contents.
+
+    Returns:
+        tuple: The body bytes and the Content-Type header value.
+    """
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + contents + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def post_upload(url, filename, contents, timeout=300):
+    """
+    Send one upload to /upload_invoice.
+
+    Args:
+        url (str): The API base URL.
+        filename (str): The filename sent with the upload.
+        contents (bytes): The file contents.
+        timeout (float, optional): Seconds to wait for the response.
+
+    Returns:
+        tuple: The HTTP status code (0 for connection errors) and the latency in seconds.
+    """
+    body, content_type = encode_multipart(filename, contents)
+    request = urllib.request.Request(f"{url}/upload_invoice", data=body, headers={"Content-Type": content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return status, time.perf_counter() - start
+
+def start_server(port, workers=0):
+    """
+    Start the API in a child process, under uvicorn or, with `workers`, pre-forked under gunicorn.
+
+    Args:
+        port (int): The port to listen on.
+        workers (int, optional): The number of gunicorn workers sharing preloaded models, 0 for plain uvicorn.
+
+    Returns:
+        subprocess.Popen: The server process, the gunicorn master when `workers` is set.
+    """
+    if workers:
+        env = {**os.environ, "WEB_WORKERS": str(workers), "PORT": str(port)}
+        return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "API.Backend.fast_api.api:app"], env=env)
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "API.Backend.fast_api.api:app", "--port", str(port)])
+
+def wait_until_ready(url, timeout=600):
+    """
+    Poll /readyz until every model is loaded.
+
+    Args:
+        url (str): The API base URL.
+        timeout (float, optional): Seconds to wait.
+
+    Raises:
+        TimeoutError: If the server is not ready in time.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/readyz", timeout=5) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"{url} did not become ready within {timeout}s")
+
+def run_http_benchmark(url, corpus, concurrency=4, requests=40, unique=True, server_pid=None):
+    """
+    Load-test /upload_invoice with concurrent requests cycling through the corpus.
+
+    Args:
+        url (str): The API base URL.
+        corpus (list): The list returned by `load_corpus`.
+        concurrency (int, optional): Requests in flight at once.
+        requests (int, optional): The total number of requests.
+        unique (bool, optional): Append a random trailer to every upload so the
+            server's result cache never answers; images decode unchanged.
+        server_pid (int, optional): The server process id, to report its peak RSS and, measured
+            after the load so every worker is warm, the RSS and PSS of the process and its workers.
+
+    Returns:
+        dict: Throughput, latency of successful requests and counts per status code.
+    """
+    def send(i):
+        filename, contents = corpus[i % len(corpus)]
+        if unique:
+            contents = contents + uuid.uuid4().bytes
+        return post_upload(url, filename, contents)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    report = {
+        "mode": "http",
+        "environment": environment(),
+        "corpus": {"images": len(corpus), "sha256": corpus_digest(corpus)},
+        "url": url,
+        "concurrency": concurrency,
+        "requests": requests,
+        "throughput": round(requests / elapsed, 3),
+        "latency": summarize([seconds for status, seconds in results if status == 200]),
+        "statuses": statuses,
+    }
+    if server_pid is not None:
+        report["server_peak_rss_mb"] = peak_rss_mb(server_pid)
+        memory = memory_report(server_pid)
+        report["server_memory_mb"] = {
+            "workers": len(memory["processes"]) - 1,
+            "total_rss": round(memory["total_rss"] / (1024 * 1024), 1),
+            "total_pss": round(memory["total_pss"] / (1024 * 1024), 1),
+            "processes": {
+                name: {kind: round(value / (1024 * 1024), 1) for kind, value in usage.items()}
+                for name, usage in memory["processes"].items()
+            },
+        }
+    return report
+
+def flatten(report, prefix=""):
+    """
+    Flatten the numeric values of a report into dotted paths.
+
+    Args:
+        report (dict): A benchmark report.
+        prefix (str, optional): Prepended to every path.
+
+    Returns:
+        dict: Maps paths such as "sequential.stages.yolo.p95" to numbers.
+    """
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if key == "environment":
+            continue
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def compare_reports(baseline, current):
+    """
+    Compare two reports metric by metric.
+
+    Args:
+        baseline (dict): The reference report.
+        current (dict): The report being evaluated.
+
+    Returns:
+        list: (path, baseline value, current value, relative change, improved) tuples for
+              every metric present in both reports. `improved` is None when unchanged
+              and for counts such as the number of pages or requests.
+    """
+    before, after = flatten(baseline), flatten(current)
+    rows = []
+    for path in sorted(before.keys() & after.keys()):
+        old, new = before[path], after[path]
+        change = (new - old) / old if old else 0.0
+        keys = path.split(".")
+        higher_is_better = keys[-1] in HIGHER_IS_BETTER
+        if new == old or keys[-1] in COUNT_KEYS or keys[0] == "statuses":
+            improved = None
+        else:
+            improved = (new > old) == higher_is_better
+        rows.append((path, old, new, change, improved))
+    return rows
+
+def parse_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Benchmark the pipeline in process")
+    pipeline_parser.add_argument("--workers", type=parse_list, default=[1, 2, 4], help="Comma-separated thread counts")
+    pipeline_parser.add_argument("--batch-sizes", type=parse_list, default=[1, 4, 8], help="Comma-separated batch sizes")
+    pipeline_parser.add_argument("--pdf-pages", type=int, default=5, help="Pages in the generated PDF, 0 to skip")
+    pipeline_parser.add_argument("--warmup", type=int, default=2, help="Images processed before measuring")
+
+    http_parser = subparsers.add_parser("http", help="Load-test a running API")
+    http_parser.add_argument("--url", default=DEFAULT_URL)
+    http_parser.add_argument("--serve", action="store_true", help="Start uvicorn on the URL's port first")
+    http_parser.add_argument("--serve-workers", type=int, default=0, help="With --serve, start gunicorn with this many workers instead")
+    http_parser.add_argument("--server-pid", type=int, help="Report the memory of an already running server, e.g. a gunicorn master")
+    http_parser.add_argument("--concurrency", type=int, default=4)
+    http_parser.add_argument("--requests", type=int, default=40)
+    http_parser.add_argument("--allow-cache", action="store_true", help="Send the corpus unchanged so repeated uploads hit the result cache")
+
+    for subparser in (pipeline_parser, http_parser):
+        subparser.add_argument("--images", default=DEFAULT_IMAGES, help="Directory of benchmark images")
+        subparser.add_argument("--limit", type=int, default=None, help="Maximum number of images")
+        subparser.add_argument("--output", help="Write the JSON report to this file")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    args = parser.parse_args()
+
+    if args.mode == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        for path, old, new, change, improved in compare_reports(baseline, current):
+            marker = "" if improved is None else (" better" if improved else " worse")
+            print(f"{path}: {old} -> {new} ({change:+.1%}){marker}")
+        return
+
+    corpus = load_corpus(args.images, args.limit)
+    if not corpus:
+        sys.exit(f"No images found in {args.images}")
+
+    if args.mode == "pipeline":
+        report = run_pipeline_benchmark(corpus, args.workers, args.batch_sizes, args.pdf_pages, args.warmup)
+    else:
+        server = None
+        if args.serve:
+            server = start_server(urllib.parse.urlparse(args.url).port or 8000, args.serve_workers)
+        try:
+            wait_until_ready(args.url)
+            report = run_http_benchmark(
+                args.url, corpus, args.concurrency, args.requests,
+                unique=not args.allow_cache, server_pid=server.pid if server else args.server_pid,
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,96 @@
+import os
+import tempfile
+
 TEMP_IMAGE_DIR = "temp_images"
+TEMP_IMAGE_MAX_AGE = float(os.getenv("TEMP_IMAGE_MAX_AGE", "3600"))  # seconds
+TEMP_IMAGE_MAX_BYTES = int(os.getenv("TEMP_IMAGE_MAX_BYTES", str(1024 * 1024 * 1024)))
+TEMP_IMAGE_SWEEP_INTERVAL = float(os.getenv("TEMP_IMAGE_SWEEP_INTERVAL", "60"))  # seconds
+TEMP_IMAGE_FORMAT = os.getenv("TEMP_IMAGE_FORMAT", "png")  # png, jpg or webp
+TEMP_IMAGE_QUALITY = int(os.getenv("TEMP_IMAGE_QUALITY", "90"))  # jpg/webp only
+TEMP_IMAGE_WRITE_WORKERS = int(os.getenv("TEMP_IMAGE_WRITE_WORKERS", "2"))
+
+# Model weights
+YOLO_WEIGHTS = "API/Backend/best.pt"
+YOLO_ONNX_WEIGHTS = "API/Backend/best.onnx"
+DONUT_MODEL_NAME = "to-be/donut-base-finetuned-invoices"
+DONUT_ONNX_DIR = "API/Backend/donut_onnx"
+DONUT_LOCAL_DIR = os.getenv("DONUT_LOCAL_DIR")  # optional local copy of the Donut weights for fast restarts
+
+# Inference backends: YOLO "torch" or "onnx", Donut "torch", "int8" or "onnx".
+# Backends that cannot be loaded fall back to "torch".
+YOLO_BACKEND = os.getenv("YOLO_BACKEND", "torch")
+DONUT_BACKEND = os.getenv("DONUT_BACKEND", "torch")
+
+# EasyOCR reader pool
+OCR_LANGUAGES = ("fr", "es", "en")
+OCR_READER_POOL_SIZE = 2
+OCR_DETECTION_BATCH_SIZE = 8
+OCR_RECOGNITION_BATCH_SIZE = 32
+
+# Donut generation and micro-batching
+DONUT_MAX_LENGTH = None  # None uses the decoder's max_position_embeddings
+DONUT_MAX_BATCH_SIZE = 4
+DONUT_BATCH_WINDOW = 0.02  # seconds to wait for more requests before running a batch
+
+# Request pipeline executor
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+PIPELINE_MAX_PENDING = int(os.getenv("PIPELINE_MAX_PENDING", "8"))  # requests allowed to wait for a worker
+PIPELINE_TIMEOUT = float(os.getenv("PIPELINE_TIMEOUT", "120"))  # seconds per page
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", str(2 * PIPELINE_WORKERS)))  # threads running independent pipeline stages
+
+# PDF rasterisation
+PDF_DPI = int(os.getenv("PDF_DPI", "200"))
+PDF_THREAD_COUNT = int(os.getenv("PDF_THREAD_COUNT", "2"))  # poppler threads, also the pages rendered per chunk
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+
+# Result cache for repeated uploads
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_MAX_MEMORY_BYTES = int(os.getenv("RESULT_CACHE_MAX_MEMORY_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")  # unset disables the on-disk tier
+RESULT_CACHE_MAX_DISK_BYTES = int(os.getenv("RESULT_CACHE_MAX_DISK_BYTES", str(2 * 1024 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(24 * 3600)))  # seconds
+RESULT_CACHE_RESCAN_INTERVAL = float(os.getenv("RESULT_CACHE_RESCAN_INTERVAL", "60"))  # seconds between disk size rescans
+
+# Batch upload jobs
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))  # pages per batched YOLO call
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "5000"))
+BATCH_JOB_WORKERS = int(os.getenv("BATCH_JOB_WORKERS", "1"))
+BATCH_JOB_TTL = float(os.getenv("BATCH_JOB_TTL", "3600"))  # seconds a finished job stays queryable
+BATCH_SPOOL_DIR = os.getenv("BATCH_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "invoice_batches"))
+BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_BYTES", str(50 * 1024 * 1024)))  # per file, including ZIP members once extracted
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_BYTES", str(2 * 1024 * 1024 * 1024)))  # per job, once extracted
+
+# Durable background job queue
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "invoice_jobs"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))  # seconds, doubled on every retry
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "900"))  # running jobs older than this are requeued
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "1"))
+JOB_IN_PROCESS_WORKER = os.getenv("JOB_IN_PROCESS_WORKER", "1") == "1"
+
+# Model lifecycle
+MODEL_LOAD_TIMEOUT = float(os.getenv("MODEL_LOAD_TIMEOUT", "600"))  # seconds a caller waits for a model
+MODEL_RETRY_INTERVAL = float(os.getenv("MODEL_RETRY_INTERVAL", "30"))  # seconds before a failed model is loaded again on use
+
+# Preprocessing
+PREPROCESS_MAX_EDGE = int(os.getenv("PREPROCESS_MAX_EDGE", "2200"))  # long edge in pixels pages are scaled down to, 0 keeps full size
+PREPROCESS_DESKEW = os.getenv("PREPROCESS_DESKEW", "0") == "1"
+PREPROCESS_MAX_SKEW = float(os.getenv("PREPROCESS_MAX_SKEW", "5"))  # degrees searched in either direction
+PREPROCESS_CONTRAST = os.getenv("PREPROCESS_CONTRAST", "0") == "1"
+
+# Table structure, in multiples of the median text height of the table
+TABLE_ROW_TOLERANCE = float(os.getenv("TABLE_ROW_TOLERANCE", "0.5"))  # center distance that still counts as the same row
+TABLE_COLUMN_GAP = float(os.getenv("TABLE_COLUMN_GAP", "0.8"))  # horizontal gap that separates two columns
+
+# Upload ingest
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024  # request body allowance over the file limit for multipart framing
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR")  # unset uses the system temp directory
+
+# Multi-worker serving (gunicorn.conf.py)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+WEB_PRELOAD = os.getenv("WEB_PRELOAD", "1") == "1"  # load shared models once in the master and fork the workers
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))  # torch/OpenMP threads per worker, 0 splits the usable CPUs by WEB_WORKERS x PIPELINE_WORKERS
@@ -0,0 +1,185 @@
+import contextvars
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from API.Backend.metrics import STAGE_SECONDS, trace, add_timings
+from API.Backend.config import DONUT_MAX_BATCH_SIZE, DONUT_BATCH_WINDOW
+from API.Backend.donut_extraction import prepare_pixel_values, generate_sequences, sequence_to_json
+
+_STOP = object()
+
+class DonutBatcher:
+    """
+    Group Donut requests from concurrent callers into batched `generate` calls.
+
+    Callers preprocess their own image (in their own thread) and enqueue the
+    pixel values. A single background thread collects requests for up to
+    `max_wait` seconds or until `max_batch_size` is reached, runs one batched
+    generation and resolves each caller's future with its own parsed result.
+
+    The caller's context is captured with each request, so the queue wait,
+    the batch's generation time and its own token2json parsing all land in
+    the caller's `trace`.
+
+    Example:
+        >>> batcher = DonutBatcher(load_donut_model())
+        >>> result = batcher.extract(cv2_img)
+    """
+
+    def __init__(self, donut_model, max_batch_size=DONUT_MAX_BATCH_SIZE, max_wait=DONUT_BATCH_WINDOW):
+        self.donut_model = donut_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batch_sizes = Counter()
+        self.stage_seconds = {}
+
+    def start(self):
+        """
+        Start the batching thread if it is not already running.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="donut-batcher", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the batching thread after the requests already queued have been served.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the thread to finish.
+        """
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, image):
+        """
+        Queue an image for extraction.
+
+        Args:
+            image (str, os.PathLike, numpy.ndarray or PIL.Image.Image): The image to process.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the extraction result dict, or None on failure.
+        """
+        self.start()
+        future = Future()
+        start = time.perf_counter()
+        try:
+            pixel_values = prepare_pixel_values(image, self.donut_model[0])
+        except Exception as e:
+            print(f"Error preparing image for Donut: {str(e)}")
+            pixel_values = None
+        self._record("preprocess", time.perf_counter() - start)
+
+        if pixel_values is None:
+            future.set_result(None)
+        else:
+            self._queue.put((pixel_values, future, time.perf_counter(), contextvars.copy_context()))
+        return future
+
+    def extract(self, image, timeout=None):
+        """
+        Extract text from an image, blocking until its batch has run.
+
+        Args:
+            image (str, os.PathLike, numpy.ndarray or PIL.Image.Image): The image to process.
+            timeout (float, optional): Seconds to wait for the result.
+
+        Returns:
+            dict or None: The same result `donut_extraction` would return.
+        """
+        return self.submit(image).result(timeout)
+
+    def stats(self):
+        """
+        Return queue depth, batch-size histogram and per-stage timings.
+
+        Returns:
+            dict: Counters suitable for a JSON response.
+        """
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait": self.max_wait,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "stages": {name: dict(values) for name, values in self.stage_seconds.items()},
+            }
+
+    def _record(self, stage, seconds):
+        with self._lock:
+            values = self.stage_seconds.setdefault(stage, {"count": 0, "total": 0.0, "max": 0.0})
+            values["count"] += 1
+            values["total"] += seconds
+            values["max"] = max(values["max"], seconds)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.max_wait
+            stopping = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._process(batch)
+            if stopping:
+                return
+
+    def _process(self, batch):
+        import torch
+
+        processor = self.donut_model[0]
+        started = time.perf_counter()
+        for _, _, enqueued_at, context in batch:
+            self._record("queue_wait", started - enqueued_at)
+            STAGE_SECONDS.observe(started - enqueued_at, "donut_queue_wait")
+            context.run(add_timings, {"donut_queue_wait": started - enqueued_at})
+        with self._lock:
+            self.batch_sizes[len(batch)] += 1
+
+        # Generation runs once for the whole batch; its time is credited to every member.
+        with trace() as batch_timings:
+            try:
+                pixel_values = torch.cat([pixel_values for pixel_values, _, _, _ in batch])
+                sequences = generate_sequences(pixel_values, self.donut_model)
+            except Exception as e:
+                print(f"Error during batched Donut generation: {str(e)}")
+                sequences = None
+        for _, _, _, context in batch:
+            context.run(add_timings, batch_timings)
+        if sequences is None:
+            for _, future, _, _ in batch:
+                future.set_result(None)
+            return
+        self._record("generate", time.perf_counter() - started)
+
+        for sequence, (_, future, _, context) in zip(sequences, batch):
+            start = time.perf_counter()
+            try:
+                result = context.run(sequence_to_json, sequence, processor)
+            except Exception as e:
+                print(f"Error parsing Donut output: {str(e)}")
+                result = None
+            self._record("token2json", time.perf_counter() - start)
+            future.set_result(result)
@@ -1,66 +1,210 @@
+import os
 import re
-from transformers import DonutProcessor, VisionEncoderDecoderModel
-import torch
+import numpy as np
 from PIL import Image
+from API.Backend.metrics import timed
+from API.Backend.config import DONUT_MODEL_NAME, DONUT_LOCAL_DIR, DONUT_ONNX_DIR, DONUT_BACKEND, DONUT_MAX_LENGTH
 
-def load_donut_model():
+TASK_PROMPT = "<s_text_extraction>"
+
+_loaded_backend = None
+
+def loaded_donut_backend():
+    """
+    Report the backend of the most recent Donut load.
+
+    Returns:
+        str or None: "torch", "int8" or "onnx" after `load_donut_model`, None before any load.
+    """
+    return _loaded_backend
+
+def load_donut_model(backend=DONUT_BACKEND):
     """
     Load and initialize the Donut model for text extraction.
 
+    Args:
+        backend (str, optional): "torch" for the fp32 model, "int8" for dynamic int8 quantization
+                                 of its Linear layers, or "onnx" for ONNX Runtime via optimum.
+
     Returns:
         tuple: A tuple containing the Donut processor and model.
+
+    Note:
+        "int8" and "onnx" target CPU inference. A backend that cannot be loaded falls back to "torch",
+        and so does "int8" on a GPU; `loaded_donut_backend` reports what was used.
+        When DONUT_LOCAL_DIR is set, the weights are saved there on first load and read back
+        from it afterwards, skipping the model hub entirely.
     """
-    processor = DonutProcessor.from_pretrained("to-be/donut-base-finetuned-invoices")
-    model = VisionEncoderDecoderModel.from_pretrained("to-be/donut-base-finetuned-invoices")
+    global _loaded_backend
+    # Deferred so importing this module does not pull in torch and transformers.
+    import torch
+    from transformers import DonutProcessor, VisionEncoderDecoderModel
+
+    source = DONUT_MODEL_NAME
+    if DONUT_LOCAL_DIR and os.path.isdir(DONUT_LOCAL_DIR):
+        source = DONUT_LOCAL_DIR
+    processor = DonutProcessor.from_pretrained(source)
+
+    if backend == "onnx":
+        try:
+            model = load_donut_onnx_model()
+            _loaded_backend = "onnx"
+            return processor, model
+        except Exception as e:
+            print(f"ONNX Runtime backend unavailable for Donut, falling back to PyTorch: {str(e)}")
+    elif backend not in ("torch", "int8"):
+        print(f"Unknown Donut backend {backend}, using PyTorch")
+
+    model = VisionEncoderDecoderModel.from_pretrained(source)
+    if DONUT_LOCAL_DIR and source != DONUT_LOCAL_DIR:
+        processor.save_pretrained(DONUT_LOCAL_DIR)
+        model.save_pretrained(DONUT_LOCAL_DIR)
     device = "cuda" if torch.cuda.is_available() else "cpu"
+    if backend == "int8" and device == "cpu":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
     model.to(device)
+    _loaded_backend = "int8" if backend == "int8" and device == "cpu" else "torch"
     return processor, model
 
-def donut_extraction(image_filename, donut_model):
+def load_donut_onnx_model(export_dir=DONUT_ONNX_DIR):
     """
-    Perform text extraction on an image using the Donut model.
+    Load the Donut encoder/decoder as ONNX Runtime sessions, exporting them on first use.
 
     Args:
-        image_filename (str): The filename of the image to process.
-        donut_model (tuple): A tuple containing the Donut processor and model.
+        export_dir (str, optional): Where the exported ONNX model is saved and reused from.
 
     Returns:
-        dict or None: A dictionary containing the extracted text information,
-                      or None if an error occurs during processing.
+        optimum.onnxruntime.ORTModelForVision2Seq: A model exposing the same `generate` API.
     """
-    processor, model = donut_model
+    from optimum.onnxruntime import ORTModelForVision2Seq
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
+    if os.path.isdir(export_dir):
+        return ORTModelForVision2Seq.from_pretrained(export_dir)
+    model = ORTModelForVision2Seq.from_pretrained(DONUT_MODEL_NAME, export=True)
+    model.save_pretrained(export_dir)
+    return model
 
-    try:
-        image = Image.open(image_filename).convert("RGB")
-    except IOError:
-        print(f"Error: Unable to open image file {image_filename}")
+def load_image(image):
+    """
+    Normalize the accepted image inputs into something the Donut processor can consume.
+
+    Args:
+        image (str, os.PathLike, numpy.ndarray or PIL.Image.Image): A path to an image file,
+            an image in OpenCV (BGR) format, or a PIL image.
+
+    Returns:
+        numpy.ndarray or PIL.Image.Image or None: An RGB image, or None if a file cannot be opened.
+
+    Note:
+        OpenCV arrays are converted with a reversed channel view instead of a copy;
+        the processor copies the pixels once when it resizes the image.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        try:
+            return Image.open(image).convert("RGB")
+        except IOError:
+            print(f"Error: Unable to open image file {image}")
+            return None
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return np.stack((image,) * 3, axis=-1)
+        return image[..., 2::-1]
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+@timed("donut_preprocess")
+def prepare_pixel_values(image, processor):
+    """
+    Turn an image into the pixel values expected by the Donut encoder.
+
+    Args:
+        image (str, os.PathLike, numpy.ndarray or PIL.Image.Image): The image to process.
+        processor (DonutProcessor): The Donut processor.
+
+    Returns:
+        torch.Tensor or None: A (1, C, H, W) tensor, or None if the image cannot be loaded.
+    """
+    image = load_image(image)
+    if image is None:
         return None
+    return processor(image, return_tensors="pt").pixel_values
 
-    task_prompt = "<s_text_extraction>"
-    decoder_input_ids = processor.tokenizer(task_prompt, add_special_tokens=False, return_tensors="pt").input_ids
+@timed("donut_generate")
+def generate_sequences(pixel_values, donut_model, max_length=DONUT_MAX_LENGTH):
+    """
+    Run Donut generation on a batch of images.
 
-    pixel_values = processor(image, return_tensors="pt").pixel_values
+    Every image in the batch uses the same task prompt, so the decoder inputs
+    are the prompt repeated once per image; sequences that finish early are
+    padded by `generate`.
 
-    try:
+    Args:
+        pixel_values (torch.Tensor): A (N, C, H, W) batch from `prepare_pixel_values`.
+        donut_model (tuple): A tuple containing the Donut processor and model.
+        max_length (int, optional): The maximum decoded length. Defaults to the decoder position limit.
+
+    Returns:
+        list: The decoded, still tokenized, output sequence of each image.
+    """
+    import torch
+
+    processor, model = donut_model
+    device = model.device
+
+    decoder_input_ids = processor.tokenizer(TASK_PROMPT, add_special_tokens=False, return_tensors="pt").input_ids
+    decoder_input_ids = decoder_input_ids.repeat(pixel_values.shape[0], 1)
+
+    with torch.inference_mode():
         outputs = model.generate(
             pixel_values.to(device),
             decoder_input_ids=decoder_input_ids.to(device),
-            max_length=model.decoder.config.max_position_embeddings,
+            max_length=max_length or model.config.decoder.max_position_embeddings,
             pad_token_id=processor.tokenizer.pad_token_id,
             eos_token_id=processor.tokenizer.eos_token_id,
             use_cache=True,
             bad_words_ids=[[processor.tokenizer.unk_token_id]],
             return_dict_in_generate=True,
         )
+    return processor.batch_decode(outputs.sequences)
+
+@timed("donut_token2json")
+def sequence_to_json(sequence, processor):
+    """
+    Convert a generated Donut sequence into structured data.
+
+    Args:
+        sequence (str): One entry returned by `generate_sequences`.
+        processor (DonutProcessor): The Donut processor.
 
-        sequence = processor.batch_decode(outputs.sequences)[0]
-        sequence = sequence.replace(processor.tokenizer.eos_token, "").replace(processor.tokenizer.pad_token, "")
-        sequence = re.sub(r"<.*?>", "", sequence, count=1).strip()
-        result = processor.token2json(sequence)
-        return result
+    Returns:
+        dict: The extracted text information.
+    """
+    sequence = sequence.replace(processor.tokenizer.eos_token, "").replace(processor.tokenizer.pad_token, "")
+    sequence = re.sub(r"<.*?>", "", sequence, count=1).strip()
+    return processor.token2json(sequence)
+
+def donut_extraction(image, donut_model):
+    """
+    Perform text extraction on an image using the Donut model.
+
+    Args:
+        image (str, os.PathLike, numpy.ndarray or PIL.Image.Image): The image to process, either
+            as a filename, an image in OpenCV (BGR) format or a PIL image.
+        donut_model (tuple): A tuple containing the Donut processor and model.
+
+    Returns:
+        dict or None: A dictionary containing the extracted text information,
+                      or None if an error occurs during processing.
+    """
+    processor, _ = donut_model
+
+    pixel_values = prepare_pixel_values(image, processor)
+    if pixel_values is None:
+        return None
+
+    try:
+        sequence = generate_sequences(pixel_values, donut_model)[0]
+        return sequence_to_json(sequence, processor)
     except Exception as e:
         print(f"Error during model inference or processing: {str(e)}")
         return None
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from API.Backend.metrics import run_in_context
+from API.Backend.config import PIPELINE_WORKERS, PIPELINE_MAX_PENDING, PIPELINE_TIMEOUT
+
+class PipelineBusy(Exception):
+    """Raised when the pipeline already holds as many requests as it admits."""
+
+class PipelineExecutor:
+    """
+    Run blocking pipeline work on a dedicated thread pool with bounded admission.
+
+    At most `max_workers` jobs run at once and at most `max_pending` more may
+    wait for a worker. Anything beyond that is rejected immediately with
+    `PipelineBusy`, so the event loop never queues unbounded work. Threads are
+    used rather than processes because the models live in this process and
+    torch, OpenCV and EasyOCR release the GIL during inference.
+    """
+
+    def __init__(self, max_workers=PIPELINE_WORKERS, max_pending=PIPELINE_MAX_PENDING, timeout=PIPELINE_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._in_flight = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pipeline")
+            return self._executor
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, timeout=None):
+        """
+        Run `fn(*args)` on the pool and await its result.
+
+        Args:
+            fn (callable): The blocking function to run.
+            *args: Positional arguments for `fn`.
+            timeout (float, optional): Seconds to wait; defaults to the executor timeout.
+
+        Returns:
+            The return value of `fn`.
+
+        Raises:
+            PipelineBusy: If the admission queue is full.
+            asyncio.TimeoutError: If the job does not finish in time. A job that
+                already started keeps its worker until it completes.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PipelineBusy()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            # Carry the caller's trace into the worker thread.
+            future = self._get_executor().submit(run_in_context(fn), *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise
+
+    def run_blocking(self, fn, *args):
+        """
+        Run `fn(*args)` on the pool from a background thread, waiting for admission instead of failing.
+
+        Background work such as batch jobs shares the pipeline's workers with
+        the API requests, so the total number of concurrent model calls stays
+        at `max_workers`. Each background caller holds at most one slot.
+
+        Args:
+            fn (callable): The blocking function to run.
+            *args: Positional arguments for `fn`.
+
+        Returns:
+            The return value of `fn`.
+        """
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._get_executor().submit(run_in_context(fn), *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future.result()
+
+    def shutdown(self):
+        """
+        Stop accepting work and wait for running jobs to finish.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        """
+        Return pool sizing and admission counters.
+
+        Returns:
+            dict: Worker and queue limits, jobs in flight, and rejected/timed out counts.
+        """
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "in_flight": self._in_flight,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
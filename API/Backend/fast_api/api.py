@@ -1,21 +1,60 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-import os
+import asyncio
+from typing import List
 from API.Backend.model import get_model
 from API.Backend.donut_extraction import load_donut_model
-from API.Backend.image_processing import process_image
-from API.Backend.file_utils import handle_file_upload, setup_temp_directory, cleanup_old_images
-from API.Backend.config import TEMP_IMAGE_DIR
-import uuid
-import cv2
+from API.Backend.donut_batching import DonutBatcher
+from API.Backend.invoice_pipeline import next_page, build_response, process_upload
+from API.Backend.ocr import get_reader_pool, reader_stats
+from API.Backend.lifecycle import ModelManager
+from API.Backend.metrics import trace, round_timings, render_metrics, PROCESS_MEMORY
+from API.Backend.executor import PipelineExecutor, PipelineBusy
+from API.Backend.result_cache import ResultCache, cache_key_from_digest
+from API.Backend.batch_jobs import BatchJobManager
+from API.Backend.job_queue import JobQueue, JobWorker
+from API.Backend.config import JOB_IN_PROCESS_WORKER, YOLO_BACKEND, DONUT_BACKEND, BATCH_MAX_TOTAL_BYTES, UPLOAD_MULTIPART_OVERHEAD
+from API.Backend.file_utils import UploadTooLarge, restore_images, setup_temp_directory
+from API.Backend.ingest import read_upload, UploadSizeLimit
+from API.Backend.serialization import FastJSONResponse, dumps
+from API.Backend.image_store import get_image_store
+from API.Backend.serving import worker_status, process_memory
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 
-app.state.yolo_model = get_model()
-app.state.donut_model = load_donut_model()
+def warm_up_ocr():
+    # Load the whole pool up front so preloaded readers are shared by every worker.
+    pool = get_reader_pool()
+    pool.warm_up(pool.size)
+    return pool
+
+
+# Models load in parallel in the background after startup; the proxies
+# wait for them on first use. Under gunicorn (gunicorn.conf.py) the shared
+# models are preloaded in the master and inherited by every worker.
+# ONNX Runtime sessions own thread pools that do not survive a fork, so
+# those backends are loaded in each worker instead.
+app.state.models = ModelManager()
+app.state.models.register("yolo", get_model, shared=YOLO_BACKEND != "onnx")
+app.state.models.register("donut", load_donut_model, shared=DONUT_BACKEND != "onnx")
+app.state.models.register("ocr", warm_up_ocr)
+app.state.yolo_model = app.state.models.proxy("yolo")
+app.state.donut_model = app.state.models.proxy("donut")
+app.state.donut_batcher = DonutBatcher(app.state.donut_model)
+app.state.pipeline = PipelineExecutor()
+app.state.result_cache = ResultCache()
+app.state.batch_jobs = BatchJobManager(app.state.yolo_model, app.state.donut_batcher, app.state.result_cache, pipeline=app.state.pipeline)
+app.state.job_queue = JobQueue()
+app.state.job_worker = JobWorker(
+    app.state.job_queue,
+    lambda contents, filename: app.state.pipeline.run_blocking(
+        process_upload, contents, filename, app.state.yolo_model, app.state.donut_batcher, app.state.result_cache),
+)
+# Reject oversized request bodies before the multipart form is parsed and spooled.
+app.add_middleware(UploadSizeLimit, limits={"/upload_invoices": BATCH_MAX_TOTAL_BYTES + UPLOAD_MULTIPART_OVERHEAD})
 # # Allow all requests (optional, good for development purposes)
 app.add_middleware(
     CORSMiddleware,
@@ -33,25 +72,236 @@ def index():
     return {"status": "ok"}
 
 
-@app.post('/upload_invoice')
-async def receive_file(file: UploadFile = File(...)):
-    cv2_img = await handle_file_upload(file)
-    image_with_boxes, paragraph_texts, table_texts, donut_results = process_image(cv2_img, app.state.yolo_model, app.state.donut_model)
-    # Save the image with bounding boxes
-    unique_filename = f"{uuid.uuid4()}.png"
-    image_path = os.path.join(TEMP_IMAGE_DIR, unique_filename)
-    cv2.imwrite(image_path, image_with_boxes)
-
-    # Prepare the response
-    response = {
-        "paragraphs": paragraph_texts,
-        "tables": table_texts,
-        "image_url": f"/temp_images/{unique_filename}",
-        "donut_extraction": donut_results
+@app.get("/healthz")
+def liveness():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readiness():
+    models = app.state.models
+    models.retry_failed()
+    content = {"ready": models.ready(), "models": models.status()}
+    return FastJSONResponse(status_code=200 if content["ready"] else 503, content=content)
+
+
+@app.get("/stats")
+def stats():
+    return {
+        "models": app.state.models.status(),
+        "worker": worker_status(),
+        "ocr": reader_stats(),
+        "donut": app.state.donut_batcher.stats(),
+        "pipeline": app.state.pipeline.stats(),
+        "result_cache": app.state.result_cache.stats(),
+        "jobs": app.state.job_queue.counts(),
+        "temp_images": get_image_store().stats(),
     }
 
-    return JSONResponse(content=response)
 
-# Cleanup task
-app.on_event("startup")(cleanup_old_images)
-app.on_event("shutdown")(cleanup_old_images)
+@app.get("/metrics")
+def metrics():
+    for kind, value in process_memory().items():
+        PROCESS_MEMORY.set(value, kind)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+def require_ready():
+    # Work that needs the models is refused until they are loaded, rather than queued behind the load.
+    if not app.state.models.ready():
+        app.state.models.retry_failed()
+        raise HTTPException(status_code=503, detail="Models are still loading", headers={"Retry-After": "5"})
+
+
+async def run_in_pipeline(fn, *args):
+    # Translate executor admission and timeout failures into HTTP errors.
+    require_ready()
+    try:
+        return await app.state.pipeline.run(fn, *args)
+    except PipelineBusy:
+        raise HTTPException(status_code=503, detail="Server is busy, retry later", headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Invoice processing timed out")
+
+
+@app.post('/upload_invoice')
+async def receive_file(file: UploadFile = File(...), stream: bool = False, timings: bool = False):
+    # Stage timings are collected for every request; `timings=true` adds them to the response.
+    with trace() as request_timings:
+        upload = await read_upload(file)
+        key = cache_key_from_digest(upload.digest)
+        cached = app.state.result_cache.get(key)
+        if cached is not None:
+            upload.close()
+            await asyncio.to_thread(restore_images, cached["images"])
+            if not stream:
+                return FastJSONResponse(content=with_timings(build_response(cached["pages"]), request_timings, timings))
+
+            async def cached_pages():
+                for page in cached["pages"]:
+                    yield dumps(page) + b"\n"
+
+            return StreamingResponse(cached_pages(), media_type="application/x-ndjson")
+
+        images = {}
+        if not stream:
+            # One pipeline job per page, like the stream path, so PIPELINE_TIMEOUT applies to each page.
+            page_iterator = upload.pages()
+            pages = []
+            try:
+                while True:
+                    page = await run_in_pipeline(next_page, page_iterator, len(pages) + 1,
+                                                 app.state.yolo_model, app.state.donut_batcher, images)
+                    if page is None:
+                        break
+                    pages.append(page)
+            finally:
+                upload.close()
+            if not pages:
+                raise HTTPException(status_code=400, detail="No pages found in upload")
+            # Keyed again now that the models are loaded, by the backends that produced the results.
+            app.state.result_cache.put(cache_key_from_digest(upload.digest), {"pages": pages, "images": images})
+            return FastJSONResponse(content=with_timings(build_response(pages), request_timings, timings))
+
+    async def traced_page(number):
+        with trace() as page_timings:
+            page = await run_in_pipeline(next_page, pages, number, app.state.yolo_model, app.state.donut_batcher, images)
+        return page, page_timings
+
+    # Process the first page before answering so that format errors and
+    # admission failures still produce a proper status code.
+    pages = upload.pages()
+    try:
+        first, first_timings = await traced_page(1)
+    except BaseException:
+        upload.close()
+        raise
+    if first is None:
+        upload.close()
+        raise HTTPException(status_code=400, detail="No pages found in upload")
+    first_timings.update(request_timings)
+
+    async def ndjson_pages():
+        results = []
+        page, page_timings = first, first_timings
+        try:
+            while page is not None:
+                results.append(page)
+                yield dumps(with_timings(page, page_timings, timings)) + b"\n"
+                try:
+                    page, page_timings = await traced_page(page["page"] + 1)
+                except Exception as e:
+                    yield dumps({"page": page["page"] + 1, "error": getattr(e, "detail", str(e))}) + b"\n"
+                    return
+        finally:
+            upload.close()
+        # Only complete documents are cached.
+        app.state.result_cache.put(cache_key_from_digest(upload.digest), {"pages": results, "images": images})
+
+    return StreamingResponse(ndjson_pages(), media_type="application/x-ndjson")
+
+
+def with_timings(content, request_timings, include):
+    # Attach a copy of the trace without touching the cached page dictionaries.
+    if not include:
+        return content
+    return {**content, "timings": round_timings(request_timings)}
+
+@app.post('/upload_invoices')
+async def receive_files(files: List[UploadFile] = File(...)):
+    require_ready()
+    batch_jobs = app.state.batch_jobs
+    job = batch_jobs.create_job()
+    try:
+        for file in files:
+            await asyncio.to_thread(batch_jobs.add_upload, job, file.file, file.filename)
+    except UploadTooLarge as e:
+        batch_jobs.discard(job)
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        batch_jobs.discard(job)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        batch_jobs.discard(job)
+        raise
+
+    batch_jobs.start(job)
+    return job.progress()
+
+
+def get_batch_job(job_id):
+    job = app.state.batch_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+
+@app.get('/batch_jobs/{job_id}')
+def batch_job_status(job_id: str):
+    return get_batch_job(job_id).progress()
+
+
+@app.get('/batch_jobs/{job_id}/results')
+async def batch_job_results(job_id: str):
+    job = get_batch_job(job_id)
+
+    async def ndjson_results():
+        index = 0
+        while True:
+            results, finished = job.results_since(index)
+            for result in results:
+                yield dumps(result) + b"\n"
+            index += len(results)
+            if finished and not results:
+                return
+            if not results:
+                await asyncio.sleep(0.2)
+
+    return StreamingResponse(ndjson_results(), media_type="application/x-ndjson")
+
+@app.post('/jobs')
+async def submit_job(file: UploadFile = File(...)):
+    require_ready()
+    try:
+        job_id = await asyncio.to_thread(app.state.job_queue.submit, file.file, file.filename)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return FastJSONResponse(status_code=202, content=app.state.job_queue.get(job_id))
+
+
+def get_job(job_id, with_result=False):
+    job = app.state.job_queue.get(job_id, with_result)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get('/jobs/{job_id}')
+def job_status(job_id: str):
+    return get_job(job_id)
+
+
+@app.get('/jobs/{job_id}/result')
+def job_result(job_id: str):
+    job = get_job(job_id, with_result=True)
+    if job["status"] == "done":
+        return job["result"]
+    if job["status"] == "failed":
+        raise HTTPException(status_code=422, detail=job["error"])
+    return FastJSONResponse(status_code=202, content=job)
+
+# Model loading
+app.on_event("startup")(app.state.models.start)
+
+# Temp image sweeper
+app.on_event("startup")(get_image_store().start)
+app.on_event("shutdown")(get_image_store().stop)
+
+# Background workers
+app.on_event("startup")(app.state.donut_batcher.start)
+app.on_event("shutdown")(app.state.donut_batcher.stop)
+app.on_event("shutdown")(app.state.pipeline.shutdown)
+app.on_event("shutdown")(app.state.batch_jobs.shutdown)
+if JOB_IN_PROCESS_WORKER:
+    app.on_event("startup")(app.state.job_worker.start)
+    app.on_event("shutdown")(app.state.job_worker.stop)
@@ -1,13 +1,31 @@
 import os
-import time
-import uuid
+import hashlib
 import cv2
 import numpy as np
 from fastapi import HTTPException
 from fastapi.staticfiles import StaticFiles
-from pdf2image import convert_from_bytes
-import io
-from API.Backend.config import TEMP_IMAGE_DIR
+from pdf2image import convert_from_bytes, convert_from_path, pdfinfo_from_bytes, pdfinfo_from_path
+from API.Backend.config import TEMP_IMAGE_DIR, PDF_DPI, PDF_THREAD_COUNT, PDF_MAX_PAGES
+from API.Backend.image_store import get_image_store
+from API.Backend.metrics import timed
+from API.Backend.preprocessing import decode_image, prepare_page
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+SUPPORTED_EXTENSIONS = IMAGE_EXTENSIONS + ('.pdf',)
+SPOOL_CHUNK_SIZE = 1024 * 1024
+# Leading bytes of each supported format, checked before the filename is trusted.
+MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"%PDF-", "pdf"),
+)
+# Readers accept a PDF header anywhere in the first KiB, after junk such as a mail header.
+PDF_HEADER_WINDOW = 1024
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload, or a member of an uploaded archive, is larger than allowed."""
 
 def setup_temp_directory(app):
     """
@@ -22,35 +40,165 @@ def setup_temp_directory(app):
     os.makedirs(TEMP_IMAGE_DIR, exist_ok=True)
     app.mount("/temp_images", StaticFiles(directory=TEMP_IMAGE_DIR), name="temp_images")
 
-async def handle_file_upload(file):
+def detect_format(head):
     """
-    Handle file upload for images and PDFs.
+    Detect the format of an upload from its leading bytes.
 
     Args:
-        file: The uploaded file object.
+        head (bytes): At least the first `PDF_HEADER_WINDOW` bytes of the file, or all of it if shorter.
 
     Returns:
-        numpy.ndarray: The image as a NumPy array in OpenCV format.
+        str or None: "jpeg", "png", "tiff" or "pdf", None if the format is not supported.
+    """
+    for magic, file_format in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return file_format
+    if b"%PDF-" in head[:PDF_HEADER_WINDOW]:
+        return "pdf"
+    return None
 
-    Raises:
-        HTTPException: If the file format is unsupported.
+def iter_upload_pages(contents, filename=None):
     """
-    contents = await file.read()
-    file_extension = os.path.splitext(file.filename)[1].lower()
+    Decode uploaded image or PDF bytes one page at a time, prepared for the models.
+
+    The format is detected from the magic bytes, so a misnamed file is still
+    decoded correctly. Large JPEGs are downscaled while decoding and every
+    page goes through `prepare_page`, so the models never see more pixels
+    than they need.
+
+    Args:
+        contents (bytes): The uploaded file contents.
+        filename (str, optional): The original filename, only kept for callers that pass it.
+
+    Yields:
+        PreparedPage: Each normalized page and its transform back to the upload. Images have a single page.
 
-    if file_extension in ['.jpg', '.jpeg', '.png']:
-        return cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
-    elif file_extension == '.pdf':
-        return convert_pdf_to_image(contents)
+    Raises:
+        HTTPException: If the file format is unsupported or the file cannot be decoded.
+    """
+    file_format = detect_format(contents[:PDF_HEADER_WINDOW])
+    if file_format == "pdf":
+        yield from iter_prepared_pdf_pages(contents)
+    elif file_format is not None:
+        yield from iter_image_pages(contents)
     else:
         raise HTTPException(status_code=400, detail="Unsupported file format")
 
-def convert_pdf_to_image(contents):
+def iter_file_pages(path):
+    """
+    Decode a spooled upload one page at a time, without reading a PDF into memory.
+
+    Args:
+        path (str): The spooled file.
+
+    Yields:
+        PreparedPage: Each normalized page and its transform back to the upload.
+
+    Raises:
+        HTTPException: If the file format is unsupported or the file cannot be decoded.
+    """
+    with open(path, "rb") as f:
+        head = f.read(PDF_HEADER_WINDOW)
+        file_format = detect_format(head)
+        if file_format is None:
+            raise HTTPException(status_code=400, detail="Unsupported file format")
+        contents = None if file_format == "pdf" else head + f.read()
+    if contents is None:
+        yield from iter_prepared_pdf_pages(path)
+    else:
+        yield from iter_image_pages(contents)
+
+def iter_image_pages(contents):
+    """
+    Decode a JPEG, PNG or TIFF buffer and prepare it for the models.
+
+    Args:
+        contents (bytes, bytearray or memoryview): The encoded image, decoded in place without a copy.
+
+    Yields:
+        PreparedPage: The single page of the image.
+
+    Raises:
+        HTTPException: If the image cannot be decoded.
+    """
+    with timed("image_decode"):
+        image, scale = decode_image(contents)
+    if image is None:
+        raise HTTPException(status_code=400, detail="Failed to decode image")
+    yield prepare_page(image, scale)
+
+def iter_prepared_pdf_pages(source):
+    """
+    Render a PDF lazily and prepare every page for the models.
+
+    Args:
+        source (bytes or str): The PDF contents or the path of a file holding them.
+
+    Yields:
+        PreparedPage: Each normalized page and its transform back to the rendered page.
+    """
+    for page in iter_pdf_pages(source):
+        yield prepare_page(page)
+
+def iter_pdf_pages(source, dpi=PDF_DPI, thread_count=PDF_THREAD_COUNT, max_pages=PDF_MAX_PAGES):
+    """
+    Render the pages of a PDF lazily, a few pages at a time.
+
+    Only `thread_count` pages are rendered per poppler call, so memory stays
+    bounded by that chunk regardless of the document length. Given a path,
+    poppler reads the file directly instead of receiving the bytes on stdin
+    for every chunk.
+
+    Args:
+        source (bytes or str): The PDF file contents or the path of a PDF file.
+        dpi (int, optional): The rendering resolution.
+        thread_count (int, optional): Poppler threads, and the number of pages rendered per chunk.
+        max_pages (int, optional): The maximum number of pages rendered.
+
+    Yields:
+        numpy.ndarray: Each page as a NumPy array in OpenCV format.
+
+    Raises:
+        HTTPException: If the PDF cannot be read.
+    """
+    from_path = isinstance(source, str)
+    try:
+        info = pdfinfo_from_path(source) if from_path else pdfinfo_from_bytes(source)
+        page_count = min(int(info["Pages"]), max_pages)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to read PDF: {str(e)}")
+    if page_count < 1:
+        raise HTTPException(status_code=400, detail="Failed to convert PDF to image")
+
+    for first_page in range(1, page_count + 1, thread_count):
+        last_page = min(first_page + thread_count - 1, page_count)
+        with timed("pdf_rasterize"):
+            convert = convert_from_path if from_path else convert_from_bytes
+            pages = convert(source, dpi=dpi, first_page=first_page, last_page=last_page, thread_count=thread_count)
+        while pages:
+            yield pil_to_cv2(pages.pop(0))
+
+def pil_to_cv2(image):
+    """
+    Convert a PIL image to an OpenCV BGR array without an encode/decode round trip.
+
+    Args:
+        image (PIL.Image.Image): The image to convert.
+
+    Returns:
+        numpy.ndarray: The image as a NumPy array in OpenCV format.
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+def convert_pdf_to_image(contents, dpi=PDF_DPI):
     """
     Convert the first page of a PDF to an image.
 
     Args:
         contents (bytes): The PDF file contents.
+        dpi (int, optional): The rendering resolution.
 
     Returns:
         numpy.ndarray: The image as a NumPy array in OpenCV format.
@@ -58,30 +206,61 @@ def convert_pdf_to_image(contents):
     Raises:
         HTTPException: If the PDF conversion fails.
     """
-    images = convert_from_bytes(contents, first_page=1, last_page=1)
+    images = convert_from_bytes(contents, dpi=dpi, first_page=1, last_page=1)
     if not images:
         raise HTTPException(status_code=400, detail="Failed to convert PDF to image")
-    img_byte_arr = io.BytesIO()
-    images[0].save(img_byte_arr, format='PNG')
-    img_byte_arr = img_byte_arr.getvalue()
-    return cv2.imdecode(np.frombuffer(img_byte_arr, np.uint8), cv2.IMREAD_COLOR)
+    return pil_to_cv2(images[0])
 
-async def cleanup_old_images():
+def save_annotated_image(image, images=None):
     """
-    Clean up old temporary images that are more than an hour old.
+    Save an annotated image to the temp image store under a unique name.
 
-    This function is intended to be run periodically to remove old temporary files.
+    Args:
+        image (numpy.ndarray): The image in OpenCV format.
+        images (dict, optional): If given, the encoded image is stored in it under its filename.
 
     Returns:
-        None
+        str: The URL of the image under the /temp_images mount.
+    """
+    return get_image_store().save(image, images)
+
+def restore_images(images):
+    """
+    Re-create annotated images of a cached result that were evicted from the temp image store.
+
+    Args:
+        images (dict): Encoded images keyed by their filename in TEMP_IMAGE_DIR.
+    """
+    get_image_store().restore(images)
+
+def spool_to_disk(source, path, chunk_size=SPOOL_CHUNK_SIZE, max_bytes=None):
+    """
+    Copy a file object to disk in chunks while hashing it.
+
+    Args:
+        source: A readable binary file object.
+        path (str): The destination path.
+        chunk_size (int, optional): Bytes read per chunk.
+        max_bytes (int, optional): The most bytes copied; the count is of bytes actually read,
+            so it also holds for archive members whose declared size is wrong.
+
+    Returns:
+        hashlib._Hash: The SHA-256 of the copied bytes, still open for further updates.
+
+    Raises:
+        UploadTooLarge: If the source is longer than `max_bytes`. The partial file is removed.
     """
-    current_time = time.time()
-    for filename in os.listdir(TEMP_IMAGE_DIR):
-        file_path = os.path.join(TEMP_IMAGE_DIR, filename)
-        try:
-            if os.path.isfile(file_path) and os.path.getmtime(file_path) < current_time - 3600:
-                os.remove(file_path)
-                print(f"Removed old temporary file: {filename}")
-        except Exception as e:
-            print(f"Error removing file {filename}: {str(e)}")
-    print("Cleanup of old temporary images completed")
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as f:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return digest
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                f.close()
+                os.remove(path)
+                raise UploadTooLarge(f"File exceeds the limit of {max_bytes} bytes")
+            digest.update(chunk)
+            f.write(chunk)
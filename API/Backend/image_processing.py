@@ -2,16 +2,27 @@ import cv2
 from API.Backend.ocr import extract_text
 from API.Backend.model import get_model
 from API.Backend.donut_extraction import donut_extraction
-import tempfile
+from API.Backend.donut_batching import DonutBatcher
+from API.Backend.stages import run_stages, get_stage_executor
+from API.Backend.metrics import timed, run_in_context, REGIONS, IMAGE_MEGAPIXELS
+from API.Backend.preprocessing import map_boxes
+from API.Backend.table_structure import build_table_grid, strip_boxes
 
-def process_image(cv2_img, yolo_model, donut_model):
+def process_image(cv2_img, yolo_model, donut_model, timings=None, detections=None):
     """
     Process an image using YOLO and Donut models for object detection and text extraction.
 
+    The work is run as a small stage graph: Donut does not depend on the YOLO
+    boxes, so it runs concurrently with the YOLO -> draw/OCR branch and the
+    results are joined at the end.
+
     Args:
         cv2_img (numpy.ndarray): The input image in OpenCV format.
         yolo_model: The YOLO model for object detection.
-        donut_model: The Donut model for text extraction.
+        donut_model: The Donut model for text extraction, either the (processor, model) tuple
+            or a DonutBatcher shared with concurrent requests.
+        timings (dict, optional): If given, filled with the wall time in seconds of each stage.
+        detections (list, optional): If given, the (paragraph_boxes, table_boxes) of `split_boxes` is appended to it.
 
     Returns:
         tuple: A tuple containing:
@@ -19,14 +30,131 @@ def process_image(cv2_img, yolo_model, donut_model):
             - paragraph_texts (dict): Extracted text from paragraph regions.
             - table_texts (dict): Extracted text from table regions.
             - donut_results: Results from the Donut model extraction.
+            - table_grids (dict): The row/column grid of each table region, see `build_table_grid`.
+    """
+    def run_yolo():
+        # Perform inference with YOLO model
+        with timed("yolo"):
+            result = yolo_model(cv2_img)[0]
+        return split_boxes(result)
+
+    def draw(boxes):
+        paragraph_boxes, table_boxes = boxes
+        return draw_boxes(cv2_img, paragraph_boxes, table_boxes)
+
+    def ocr(boxes):
+        # Extract text for paragraphs and tables in a single batched OCR pass
+        paragraph_boxes, table_boxes = boxes
+        region_texts = extract_text(cv2_img, paragraph_boxes + table_boxes, return_boxes=bool(table_boxes))
+        return split_region_texts(region_texts, paragraph_boxes, table_boxes)
+
+    def donut():
+        # Donut works on the decoded image and does not need the YOLO boxes
+        if isinstance(donut_model, DonutBatcher):
+            return donut_model.extract(cv2_img)
+        return donut_extraction(cv2_img, donut_model)
+
+    IMAGE_MEGAPIXELS.observe(cv2_img.shape[0] * cv2_img.shape[1] / 1e6)
+    results = run_stages({
+        "detect": ((), run_yolo),
+        "draw": (("detect",), draw),
+        "ocr": (("detect",), ocr),
+        "donut": ((), donut),
+    }, timings=timings)
+
+    if detections is not None:
+        detections.append(results["detect"])
+    paragraph_texts, table_texts, table_grids = results["ocr"]
+    return results["draw"], paragraph_texts, table_texts, results["donut"], table_grids
+
+def process_images(cv2_imgs, yolo_model, donut_model, detections=None):
+    """
+    Process several images at once, batching the model calls across them.
+
+    YOLO runs once on the whole list, Donut requests are submitted for every
+    image before detection starts so the batcher can group them, and OCR for
+    each image runs on the shared stage executor.
+
+    Args:
+        cv2_imgs (list): Input images in OpenCV format.
+        yolo_model: The YOLO model for object detection.
+        donut_model: The Donut model for text extraction, either the (processor, model) tuple
+            or a DonutBatcher.
+        detections (list, optional): If given, extended with the (paragraph_boxes, table_boxes) of every image.
+
+    Returns:
+        list: One `process_image`-style tuple per input image, in input order.
+    """
+    if not cv2_imgs:
+        return []
+    executor = get_stage_executor()
+
+    if isinstance(donut_model, DonutBatcher):
+        donut_futures = [donut_model.submit(cv2_img) for cv2_img in cv2_imgs]
+    else:
+        donut_futures = [executor.submit(donut_extraction, cv2_img, donut_model) for cv2_img in cv2_imgs]
+
+    for cv2_img in cv2_imgs:
+        IMAGE_MEGAPIXELS.observe(cv2_img.shape[0] * cv2_img.shape[1] / 1e6)
+    with timed("yolo"):
+        detected = [split_boxes(result) for result in yolo_model(list(cv2_imgs))]
+    if detections is not None:
+        detections.extend(detected)
+    ocr_futures = [
+        executor.submit(run_in_context(extract_text), cv2_img, paragraph_boxes + table_boxes, return_boxes=bool(table_boxes))
+        for cv2_img, (paragraph_boxes, table_boxes) in zip(cv2_imgs, detected)
+    ]
+
+    outputs = []
+    for cv2_img, (paragraph_boxes, table_boxes), ocr_future, donut_future in zip(cv2_imgs, detected, ocr_futures, donut_futures):
+        paragraph_texts, table_texts, table_grids = split_region_texts(ocr_future.result(), paragraph_boxes, table_boxes)
+        outputs.append((
+            draw_boxes(cv2_img, paragraph_boxes, table_boxes),
+            paragraph_texts,
+            table_texts,
+            donut_future.result(),
+            table_grids,
+        ))
+    return outputs
+
+@timed("table_structure")
+def split_region_texts(region_texts, paragraph_boxes, table_boxes):
+    """
+    Split OCR results into paragraph and table texts and rebuild the grid of every table.
+
+    Args:
+        region_texts (dict): The output of `extract_text`, with boxes if there are tables.
+        paragraph_boxes (list): (number, box) tuples for paragraphs.
+        table_boxes (list): (number, box) tuples for tables.
+
+    Returns:
+        tuple: Paragraph texts, table texts (both without boxes) and table grids, each keyed by region number.
     """
-    # Perform inference with YOLO model
-    results = yolo_model(cv2_img)
+    table_grids = {number: build_table_grid(region_texts[number]) for number, _ in table_boxes}
+    region_texts = strip_boxes(region_texts) if table_boxes else region_texts
+    paragraph_texts = {number: region_texts[number] for number, _ in paragraph_boxes}
+    table_texts = {number: region_texts[number] for number, _ in table_boxes}
+    return paragraph_texts, table_texts, table_grids
 
+def split_boxes(result):
+    """
+    Split a YOLO result into numbered paragraph and table boxes.
+
+    Args:
+        result: A single ultralytics result, i.e. one element of `yolo_model(image)`.
+
+    Returns:
+        tuple: A tuple containing:
+            - paragraph_boxes (list): (number, box) tuples for 'Paragraph' detections.
+            - table_boxes (list): (number, box) tuples for 'Table' detections.
+
+    Note:
+        Numbers follow the detection order across both classes, so they are unique per image.
+    """
     # Extract bounding boxes, classes, and labels
-    boxes = results[0].boxes.xyxy.numpy()
-    classes = results[0].boxes.cls.numpy()
-    names = results[0].names
+    boxes = result.boxes.xyxy.numpy()
+    classes = result.boxes.cls.numpy()
+    names = result.names
 
     # Convert class indices to class names
     labels = [names[int(cls)] for cls in classes]
@@ -34,21 +162,36 @@ def process_image(cv2_img, yolo_model, donut_model):
     # Filter and enumerate bounding boxes for 'Paragraph' and 'Table'
     paragraph_boxes = [(i+1, box) for i, (box, label) in enumerate(zip(boxes, labels)) if label == 'Paragraph']
     table_boxes = [(i+1, box) for i, (box, label) in enumerate(zip(boxes, labels)) if label == 'Table']
+    REGIONS.inc(len(paragraph_boxes), "paragraph")
+    REGIONS.inc(len(table_boxes), "table")
+    return paragraph_boxes, table_boxes
 
-    # Draw boxes on the image
-    image_with_boxes = draw_boxes(cv2_img, paragraph_boxes, table_boxes)
-
-    # Extract text for paragraphs and tables
-    paragraph_texts = extract_text(cv2_img, paragraph_boxes)
-    table_texts = extract_text(cv2_img, table_boxes)
-
-    # Add Donut extraction
-    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-        cv2.imwrite(temp_file.name, cv2_img)
-        donut_results = donut_extraction(temp_file.name, donut_model)
+def describe_regions(paragraph_boxes, table_boxes, to_original=None):
+    """
+    Describe detected regions for a response, in the coordinates of the uploaded page.
 
-    return image_with_boxes, paragraph_texts, table_texts, donut_results
+    Args:
+        paragraph_boxes (list): (number, box) tuples for paragraphs, as returned by `split_boxes`.
+        table_boxes (list): (number, box) tuples for tables.
+        to_original (numpy.ndarray, optional): The 2x3 transform of the `PreparedPage` the boxes were
+            detected on. Boxes are returned unchanged when omitted.
 
+    Returns:
+        list: {"number", "label", "box"} dictionaries sorted by number, with integer (x1, y1, x2, y2) boxes.
+    """
+    numbered = sorted([(number, "Paragraph", box) for number, box in paragraph_boxes] +
+                      [(number, "Table", box) for number, box in table_boxes], key=lambda region: region[0])
+    if not numbered:
+        return []
+    boxes = [box for _, _, box in numbered]
+    if to_original is not None:
+        boxes = map_boxes(boxes, to_original)
+    return [
+        {"number": number, "label": label, "box": [int(round(float(value))) for value in box]}
+        for (number, label, _), box in zip(numbered, boxes)
+    ]
+
+@timed("draw_boxes")
 def draw_boxes(cv2_img, paragraph_boxes, table_boxes):
     """
     Draw bounding boxes and labels on the input image for paragraphs and tables.
@@ -0,0 +1,266 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from API.Backend.metrics import timed
+from API.Backend.config import (
+    TEMP_IMAGE_DIR,
+    TEMP_IMAGE_MAX_AGE,
+    TEMP_IMAGE_MAX_BYTES,
+    TEMP_IMAGE_SWEEP_INTERVAL,
+    TEMP_IMAGE_FORMAT,
+    TEMP_IMAGE_QUALITY,
+    TEMP_IMAGE_WRITE_WORKERS,
+)
+
+_ENCODE_PARAMS = {
+    "png": (".png", lambda quality: [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+    "jpg": (".jpg", lambda quality: [cv2.IMWRITE_JPEG_QUALITY, quality]),
+    "webp": (".webp", lambda quality: [cv2.IMWRITE_WEBP_QUALITY, quality]),
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+class ImageStore:
+    """
+    A size- and age-bounded directory of annotated images served under /temp_images.
+
+    The store keeps an in-memory index of its files ordered from least to
+    most recently used. New files evict the oldest ones past `max_bytes`, and
+    a background sweeper removes files older than `max_age`.
+
+    Several processes write to the same directory (gunicorn workers and
+    standalone job workers), so the directory is the source of truth: every
+    sweep rebuilds the index from a scan before enforcing the age and size
+    limits, which makes files written by other processes count towards the
+    cap, and uses are recorded as file mtimes.
+    """
+
+    def __init__(self, directory=TEMP_IMAGE_DIR, max_bytes=TEMP_IMAGE_MAX_BYTES, max_age=TEMP_IMAGE_MAX_AGE,
+                 sweep_interval=TEMP_IMAGE_SWEEP_INTERVAL, image_format=TEMP_IMAGE_FORMAT,
+                 quality=TEMP_IMAGE_QUALITY, write_workers=TEMP_IMAGE_WRITE_WORKERS):
+        if image_format not in _ENCODE_PARAMS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.extension, params = _ENCODE_PARAMS[image_format]
+        self.encode_params = params(quality)
+        self.write_workers = write_workers
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # filename -> (written_at, size)
+        self._total_bytes = 0
+        self._writer = None
+        self._sweeper = None
+        self._stop = threading.Event()
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        # Scan outside the lock, then swap the index in.
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file() and not entry.name.startswith("."):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name, stat.st_size))
+                except FileNotFoundError:
+                    pass  # removed by another process during the scan
+        index = OrderedDict((name, (mtime, size)) for mtime, name, size in sorted(entries))
+        with self._lock:
+            self._index = index
+            self._total_bytes = sum(size for _, size in index.values())
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def encode(self, image):
+        """
+        Encode an image in the store's format.
+
+        Args:
+            image (numpy.ndarray): The image in OpenCV format.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        with timed("image_encode"):
+            return cv2.imencode(self.extension, image, self.encode_params)[1].tobytes()
+
+    def save(self, image, images=None):
+        """
+        Encode and write an image under a new unique name.
+
+        Args:
+            image (numpy.ndarray): The image in OpenCV format.
+            images (dict, optional): If given, the encoded image is stored in it under its filename.
+
+        Returns:
+            str: The URL of the image under the /temp_images mount.
+        """
+        filename = f"{uuid.uuid4()}{self.extension}"
+        encoded = self.encode(image)
+        self.write(filename, encoded)
+        if images is not None:
+            images[filename] = encoded
+        return f"/temp_images/{filename}"
+
+    def save_async(self, image, images=None):
+        """
+        Like `save`, but encode and write on the store's writer threads.
+
+        Args:
+            image (numpy.ndarray): The image in OpenCV format. It must not be modified until the future is done.
+            images (dict, optional): See `save`.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the image URL once the file is written.
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=self.write_workers, thread_name_prefix="image-writer")
+            writer = self._writer
+        return writer.submit(self.save, image, images)
+
+    def write(self, filename, encoded):
+        """
+        Write already encoded bytes and add them to the index, evicting old files past the size cap.
+
+        Args:
+            filename (str): The filename inside the store directory.
+            encoded (bytes): The file contents.
+        """
+        path = self._path(filename)
+        with timed("image_write"), open(path, "wb") as f:
+            f.write(encoded)
+        with self._lock:
+            if filename in self._index:
+                self._total_bytes -= self._index.pop(filename)[1]
+            self._index[filename] = (time.time(), len(encoded))
+            self._total_bytes += len(encoded)
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                evicted.append(self._pop_oldest())
+        self._remove(evicted)
+
+    def restore(self, images):
+        """
+        Make sure the images of a cached result exist, re-writing any that were evicted.
+
+        Args:
+            images (dict): Encoded images keyed by their filename.
+        """
+        for filename, encoded in images.items():
+            try:
+                # Treat a cache hit as a use so it is evicted last, in every process's next scan too.
+                os.utime(self._path(filename))
+            except FileNotFoundError:
+                self.write(filename, encoded)
+                continue
+            with self._lock:
+                entry = self._index.pop(filename, None)
+                if entry is None:
+                    # Written by another process since the last scan.
+                    entry = (None, len(encoded))
+                    self._total_bytes += len(encoded)
+                self._index[filename] = (time.time(), entry[1])
+
+    def sweep(self):
+        """
+        Rescan the directory, then remove files older than `max_age` and the oldest files past `max_bytes`.
+
+        Returns:
+            int: The number of files removed.
+        """
+        self._load_index()
+        cutoff = time.time() - self.max_age
+        evicted = []
+        with self._lock:
+            while self._index:
+                filename, (written_at, _) = next(iter(self._index.items()))
+                if written_at >= cutoff:
+                    break
+                evicted.append(self._pop_oldest())
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                evicted.append(self._pop_oldest())
+        self._remove(evicted)
+        return len(evicted)
+
+    def _pop_oldest(self):
+        filename, (_, size) = self._index.popitem(last=False)
+        self._total_bytes -= size
+        self.evicted += 1
+        return filename
+
+    def _remove(self, filenames):
+        for filename in filenames:
+            try:
+                os.remove(self._path(filename))
+            except OSError:
+                pass
+
+    def start(self):
+        """
+        Run a sweep now and start the periodic background sweeper.
+        """
+        removed = self.sweep()
+        if removed:
+            print(f"Removed {removed} old temporary images")
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="image-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop(self):
+        """
+        Stop the sweeper and wait for pending writes.
+        """
+        self._stop.set()
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.shutdown(wait=True)
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping temporary images: {str(e)}")
+
+    def stats(self):
+        """
+        Return the number of files and bytes held, and how many were evicted.
+
+        Returns:
+            dict: Store counters.
+        """
+        with self._lock:
+            return {
+                "files": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "evicted": self.evicted,
+            }
+
+def get_image_store():
+    """
+    Get or create the process-wide image store for TEMP_IMAGE_DIR.
+
+    Returns:
+        ImageStore: The shared store.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore()
+    return _store
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import tempfile
+import threading
+from fastapi import HTTPException
+from API.Backend.config import UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_SPOOL_DIR, UPLOAD_MULTIPART_OVERHEAD
+from API.Backend.file_utils import PDF_HEADER_WINDOW, detect_format, iter_image_pages, iter_prepared_pdf_pages
+from API.Backend.metrics import timed, UPLOAD_BYTES
+from API.Backend.serialization import FastJSONResponse
+
+class Upload:
+    """
+    A streamed upload, held in memory for images and spooled to disk for PDFs.
+
+    Attributes:
+        filename (str): The original filename.
+        format (str): "jpeg", "png", "tiff" or "pdf", detected from the magic bytes.
+        size (int): The number of bytes received.
+        digest: The SHA-256 hash object of the contents, see `cache_key_from_digest`.
+        buffer (bytearray or None): The image bytes, None for PDFs.
+        path (str or None): The spooled PDF, None for images.
+
+    A page still rendering on a pipeline worker when its request timed out
+    keeps reading the spooled PDF, so `close` only deletes the file once no
+    page is being rendered from it.
+    """
+
+    def __init__(self, filename, file_format, size, digest, buffer=None, path=None):
+        self.filename = filename
+        self.format = file_format
+        self.size = size
+        self.digest = digest
+        self.buffer = buffer
+        self.path = path
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._closing = False
+
+    def pages(self):
+        """
+        Decode the upload one page at a time, prepared for the models.
+
+        Returns:
+            iterator: `PreparedPage` items. Images are decoded straight from the
+            buffer and PDFs are rendered by poppler from the spooled file.
+        """
+        if self.path is not None:
+            return self._read_pages(iter_prepared_pdf_pages(self.path))
+        return iter_image_pages(self.buffer)
+
+    def _read_pages(self, pages):
+        # Count the threads rendering from the spooled file, see `close`.
+        while True:
+            with self._lock:
+                if self._closing:
+                    return
+                self._readers += 1
+            try:
+                page = next(pages, None)
+            finally:
+                with self._lock:
+                    self._readers -= 1
+                    remove = self._closing and self._readers == 0
+                if remove:
+                    self._remove()
+            if page is None:
+                return
+            yield page
+
+    def close(self):
+        """
+        Release the buffer and delete the spooled file, if any, once no page is being rendered from it.
+        """
+        self.buffer = None
+        with self._lock:
+            self._closing = True
+            remove = self._readers == 0
+        if remove:
+            self._remove()
+
+    def _remove(self):
+        path, self.path = self.path, None
+        if path is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class UploadSizeLimit:
+    """
+    ASGI middleware rejecting request bodies larger than a limit before the form is parsed.
+
+    A declared Content-Length over the limit is answered with 413 without
+    reading the body. Bodies without one (chunked transfer) are counted as
+    they arrive and the request fails with 413 as soon as the limit is
+    passed, so Starlette never spools more than the limit to disk.
+
+    Args:
+        app: The ASGI application.
+        max_bytes (int, optional): The body limit of every POST and PUT request.
+        limits (dict, optional): Body limits for specific paths, e.g. larger ones for batch uploads.
+    """
+
+    def __init__(self, app, max_bytes=UPLOAD_MAX_BYTES + UPLOAD_MULTIPART_OVERHEAD, limits=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return await self.app(scope, receive, send)
+        limit = self.limits.get(scope["path"], self.max_bytes)
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            response = FastJSONResponse(status_code=413, content={"detail": f"Request body exceeds the limit of {limit} bytes"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside form parsing, which FastAPI re-raises unchanged as the response.
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds the limit of {limit} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def too_large(max_bytes):
+    return HTTPException(status_code=413, detail=f"Upload exceeds the limit of {max_bytes} bytes")
+
+async def read_upload(file, max_bytes=UPLOAD_MAX_BYTES, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Read an uploaded file in chunks, enforcing the size limit as the bytes are read.
+
+    Starlette has already buffered the multipart body by the time the
+    handler runs, so oversized requests are rejected earlier by
+    `UploadSizeLimit`; this limit applies to the file itself. The format is
+    detected from the first chunk, before the rest is read. Images are
+    collected into a single buffer that the decoder reads in place; PDFs go
+    to a temporary file that poppler opens itself, so a large PDF is never
+    held in memory. The SHA-256 digest used by the result cache is computed
+    on the way.
+
+    Args:
+        file (UploadFile): The uploaded file.
+        max_bytes (int, optional): The largest accepted upload.
+        chunk_size (int, optional): The number of bytes read at a time.
+
+    Returns:
+        Upload: The received upload. The caller must `close` it.
+
+    Raises:
+        HTTPException: 413 if the upload is larger than `max_bytes`, 400 if its format is unsupported.
+    """
+    with timed("upload_read"):
+        chunk = await file.read(max(chunk_size, PDF_HEADER_WINDOW))
+        file_format = detect_format(chunk[:PDF_HEADER_WINDOW])
+        if file_format is None:
+            raise HTTPException(status_code=400, detail="Unsupported file format")
+
+        digest = hashlib.sha256()
+        size = 0
+        spool = None
+        buffer = None
+        if file_format == "pdf":
+            spool = tempfile.NamedTemporaryFile(dir=UPLOAD_SPOOL_DIR, suffix=".pdf", delete=False)
+        else:
+            buffer = bytearray()
+        try:
+            while chunk:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large(max_bytes)
+                digest.update(chunk)
+                if spool is not None:
+                    spool.write(chunk)
+                else:
+                    buffer += chunk
+                chunk = await file.read(chunk_size)
+        except BaseException:
+            if spool is not None:
+                spool.close()
+                os.remove(spool.name)
+            raise
+        if spool is not None:
+            spool.close()
+
+    UPLOAD_BYTES.observe(size)
+    return Upload(file.filename, file_format, size, digest, buffer, spool.name if spool is not None else None)
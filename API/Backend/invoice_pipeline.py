@@ -0,0 +1,146 @@
+from fastapi import HTTPException
+from API.Backend.file_utils import iter_upload_pages, save_annotated_image, restore_images
+from API.Backend.image_processing import process_image, describe_regions
+from API.Backend.result_cache import cache_key
+from API.Backend.metrics import timed, PAGES
+
+def process_page(cv2_img, yolo_model, donut_model, images=None, to_original=None):
+    """
+    Run the extraction pipeline on one page and save its annotated image.
+
+    This is blocking work; the API runs it on a pipeline worker thread, never on the event loop.
+
+    Args:
+        cv2_img (numpy.ndarray): The page in OpenCV format.
+        yolo_model: The YOLO model for object detection.
+        donut_model: The Donut (processor, model) tuple or a DonutBatcher.
+        images (dict, optional): If given, the encoded annotated image is stored in it under its filename.
+        to_original (numpy.ndarray, optional): The transform of the `PreparedPage` being processed, used
+            to report region boxes in the coordinates of the uploaded page.
+
+    Returns:
+        dict: The paragraphs, tables, table grids, annotated image URL, Donut extraction and regions of the page.
+    """
+    detections = []
+    with timed("page"):
+        image_with_boxes, paragraph_texts, table_texts, donut_results, table_grids = process_image(cv2_img, yolo_model, donut_model, detections=detections)
+        # Save the image with bounding boxes
+        image_url = save_annotated_image(image_with_boxes, images)
+    PAGES.inc()
+
+    return {
+        "paragraphs": paragraph_texts,
+        "tables": table_texts,
+        "table_grids": table_grids,
+        "image_url": image_url,
+        "donut_extraction": donut_results,
+        "regions": describe_regions(*detections[0], to_original),
+    }
+
+def next_page(pages, number, yolo_model, donut_model, images=None):
+    """
+    Render the next page of an upload and process it.
+
+    Args:
+        pages (iterator): The iterator returned by `iter_upload_pages`.
+        number (int): The 1-based number of the page being rendered.
+        yolo_model: The YOLO model for object detection.
+        donut_model: The Donut (processor, model) tuple or a DonutBatcher.
+        images (dict, optional): Collects the encoded annotated image, see `process_page`.
+
+    Returns:
+        dict or None: The page result with its "page" number, or None when there are no pages left.
+    """
+    page = next(pages, None)
+    if page is None:
+        return None
+    return {"page": number, **process_page(page.image, yolo_model, donut_model, images, page.to_original)}
+
+def run_pipeline(contents, filename, yolo_model, donut_model, images=None):
+    """
+    Process every page of an upload, one page at a time.
+
+    Args:
+        contents (bytes): The uploaded file contents.
+        filename (str): The original filename.
+        yolo_model: The YOLO model for object detection.
+        donut_model: The Donut (processor, model) tuple or a DonutBatcher.
+        images (dict, optional): Collects the encoded annotated images, see `process_page`.
+
+    Returns:
+        list: One `next_page` result per page.
+    """
+    return run_pages(iter_upload_pages(contents, filename), yolo_model, donut_model, images)
+
+def run_pages(pages, yolo_model, donut_model, images=None):
+    """
+    Process already decoded pages, one page at a time.
+
+    Args:
+        pages (iterator): `PreparedPage` items, e.g. from `iter_upload_pages` or `Upload.pages`.
+        yolo_model: The YOLO model for object detection.
+        donut_model: The Donut (processor, model) tuple or a DonutBatcher.
+        images (dict, optional): Collects the encoded annotated images, see `process_page`.
+
+    Returns:
+        list: One `next_page` result per page.
+    """
+    results = []
+    while True:
+        page = next_page(pages, len(results) + 1, yolo_model, donut_model, images)
+        if page is None:
+            return results
+        results.append(page)
+
+def build_response(pages):
+    """
+    Build the /upload_invoice body: the first page at the top level, every page under "pages".
+
+    Args:
+        pages (list): Page results from `next_page`.
+
+    Returns:
+        dict: The response body.
+    """
+    first = pages[0]
+    return {
+        "paragraphs": first["paragraphs"],
+        "tables": first["tables"],
+        "table_grids": first["table_grids"],
+        "image_url": first["image_url"],
+        "donut_extraction": first["donut_extraction"],
+        "page_count": len(pages),
+        "pages": pages,
+    }
+
+def process_upload(contents, filename, yolo_model, donut_model, result_cache=None):
+    """
+    Produce the /upload_invoice body for an upload, going through the result cache when given.
+
+    Args:
+        contents (bytes): The uploaded file contents.
+        filename (str): The original filename.
+        yolo_model: The YOLO model for object detection.
+        donut_model: The Donut (processor, model) tuple or a DonutBatcher.
+        result_cache (ResultCache, optional): Where results are looked up and stored.
+
+    Returns:
+        dict: The response body from `build_response`.
+
+    Raises:
+        HTTPException: 400 if the upload contains no pages or cannot be decoded.
+    """
+    key = cache_key(contents) if result_cache is not None else None
+    cached = result_cache.get(key) if key else None
+    if cached is not None:
+        restore_images(cached["images"])
+        return build_response(cached["pages"])
+
+    images = {}
+    pages = run_pipeline(contents, filename, yolo_model, donut_model, images)
+    if not pages:
+        raise HTTPException(status_code=400, detail="No pages found in upload")
+    if key:
+        # Keyed again now that the models are loaded, by the backends that produced the results.
+        result_cache.put(cache_key(contents), {"pages": pages, "images": images})
+    return build_response(pages)
@@ -0,0 +1,399 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from API.Backend.config import (
+    JOB_DB_PATH,
+    JOB_SPOOL_DIR,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_DELAY,
+    JOB_LEASE_SECONDS,
+    JOB_POLL_INTERVAL,
+    JOB_WORKER_CONCURRENCY,
+    UPLOAD_MAX_BYTES,
+)
+from fastapi import HTTPException
+from API.Backend.file_utils import spool_to_disk
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    payload_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    worker TEXT,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, available_at);
+"""
+
+class JobQueue:
+    """
+    A persistent job queue stored in SQLite.
+
+    Uploaded files are spooled to `spool_dir` and only their path is stored,
+    so the database stays small. Every operation opens its own connection,
+    which makes the queue safe to share between threads and between the API
+    process and standalone worker processes.
+
+    Job statuses move through queued -> running -> done, or back to queued
+    with a growing delay on failure until `max_attempts` is reached, after
+    which the job is marked failed. A running job is leased to the attempt
+    that claimed it: the worker renews the lease with `heartbeat`, and
+    `complete` and `fail` only apply while that attempt still holds it.
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, spool_dir=JOB_SPOOL_DIR, max_attempts=JOB_MAX_ATTEMPTS,
+                 retry_delay=JOB_RETRY_DELAY, lease_seconds=JOB_LEASE_SECONDS):
+        self.db_path = db_path
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        os.makedirs(spool_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, source, filename, max_bytes=UPLOAD_MAX_BYTES):
+        """
+        Spool an upload to disk and queue it.
+
+        Args:
+            source: A readable binary file object with the upload contents.
+            filename (str): The original filename.
+            max_bytes (int, optional): The largest accepted upload.
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            UploadTooLarge: If the upload is larger than `max_bytes`. Nothing is queued.
+        """
+        job_id = uuid.uuid4().hex
+        payload_path = os.path.join(self.spool_dir, job_id + os.path.splitext(filename)[1].lower())
+        spool_to_disk(source, payload_path, max_bytes=max_bytes)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, filename, payload_path, status, max_attempts, available_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, filename, payload_path, self.max_attempts, now, now, now),
+            )
+        return job_id
+
+    def claim(self, worker):
+        """
+        Atomically take the oldest job that is ready to run.
+
+        Args:
+            worker (str): An identifier of the claiming worker, stored for debugging.
+
+        Returns:
+            dict or None: The claimed job row, or None if nothing is ready.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND available_at <= ? ORDER BY created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, updated_at = ? WHERE id = ?",
+                    (worker, now, row["id"]),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        job = dict(row)
+        job["attempts"] += 1
+        job["worker"] = worker
+        return job
+
+    # Updates by a worker only apply while it still holds the lease of the
+    # attempt it claimed: once a job is requeued, the old attempt is stale.
+    _LEASE_HELD = "id = ? AND status = 'running' AND worker = ? AND attempts = ?"
+
+    def heartbeat(self, job):
+        """
+        Renew the lease of a running job so `requeue_stale` leaves it alone.
+
+        Args:
+            job (dict): The job returned by `claim`.
+
+        Returns:
+            bool: Whether the lease is still held by this attempt.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE {self._LEASE_HELD}",
+                (time.time(), job["id"], job["worker"], job["attempts"]),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job, result):
+        """
+        Store the result of a job and remove its spooled upload.
+
+        Args:
+            job (dict): The job returned by `claim`.
+            result (dict): A JSON-serializable result.
+
+        Returns:
+            bool: Whether the result was stored; False if the attempt lost its lease.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = 'done', result = ?, error = NULL, updated_at = ? WHERE {self._LEASE_HELD}",
+                (json.dumps(result), time.time(), job["id"], job["worker"], job["attempts"]),
+            )
+        if cursor.rowcount != 1:
+            return False
+        self._remove_payload(job["payload_path"])
+        return True
+
+    def fail(self, job, error, permanent=False):
+        """
+        Record a failed attempt, requeueing the job with exponential backoff while attempts remain.
+
+        Args:
+            job (dict): The job returned by `claim`.
+            error (str): A description of the failure.
+            permanent (bool, optional): Fail the job without retrying, e.g. for an unsupported upload.
+
+        Returns:
+            str or None: The new status, "queued" or "failed", or None if the attempt lost its lease.
+        """
+        now = time.time()
+        if permanent or job["attempts"] >= job["max_attempts"]:
+            status = "failed"
+            available_at = now
+        else:
+            status = "queued"
+            available_at = now + self.retry_delay * 2 ** (job["attempts"] - 1)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = ?, error = ?, available_at = ?, updated_at = ? WHERE {self._LEASE_HELD}",
+                (status, error, available_at, now, job["id"], job["worker"], job["attempts"]),
+            )
+        if cursor.rowcount != 1:
+            return None
+        if status == "failed":
+            self._remove_payload(job["payload_path"])
+        return status
+
+    def requeue_stale(self):
+        """
+        Put back jobs whose worker stopped renewing their lease, e.g. after a crash.
+
+        Returns:
+            int: The number of jobs requeued.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, updated_at = ?, error = 'worker lease expired'"
+                " WHERE status = 'running' AND updated_at < ?",
+                (now, now, now - self.lease_seconds),
+            )
+            return cursor.rowcount
+
+    def get(self, job_id, with_result=False):
+        """
+        Look up a job.
+
+        Args:
+            job_id (str): The job id.
+            with_result (bool, optional): Whether to include the decoded result.
+
+        Returns:
+            dict or None: The job status fields, or None if the id is unknown.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row["id"],
+            "filename": row["filename"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"],
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+        if with_result:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        return job
+
+    def counts(self):
+        """
+        Return the number of jobs in each status.
+
+        Returns:
+            dict: Job counts keyed by status.
+        """
+        with self._connect() as conn:
+            return {row["status"]: row["count"] for row in conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")}
+
+    def _remove_payload(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class JobWorker:
+    """
+    Drain a JobQueue with a fixed number of threads.
+
+    Args:
+        job_queue (JobQueue): The queue to drain.
+        handler (callable): Called as `handler(contents, filename)` and returns a JSON-serializable result.
+        concurrency (int, optional): The number of jobs this worker runs at once.
+        poll_interval (float, optional): Seconds to sleep when the queue is empty.
+    """
+
+    def __init__(self, job_queue, handler, concurrency=JOB_WORKER_CONCURRENCY, poll_interval=JOB_POLL_INTERVAL):
+        self.job_queue = job_queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Requeue jobs abandoned by crashed workers and start the worker threads.
+        """
+        # Named here rather than at construction: under a pre-forking server the
+        # worker is built in the master and started in each forked process.
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        requeued = self.job_queue.requeue_stale()
+        if requeued:
+            print(f"Requeued {requeued} stale jobs")
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Ask the worker threads to stop after their current job and wait for them.
+
+        Args:
+            timeout (float, optional): Seconds to wait for each thread.
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        last_requeue = time.time()
+        while not self._stop.is_set():
+            if time.time() - last_requeue > self.job_queue.lease_seconds:
+                self.job_queue.requeue_stale()
+                last_requeue = time.time()
+            try:
+                job = self.job_queue.claim(self.name)
+            except sqlite3.Error as e:
+                print(f"Error claiming job: {str(e)}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), name=f"job-heartbeat-{job['id']}", daemon=True)
+        heartbeat.start()
+        try:
+            with open(job["payload_path"], "rb") as f:
+                contents = f.read()
+            result = self.handler(contents, job["filename"])
+        except Exception as e:
+            # Client errors such as an unsupported format or an empty PDF fail the same way every time.
+            permanent = isinstance(e, HTTPException) and 400 <= e.status_code < 500
+            status = self.job_queue.fail(job, getattr(e, "detail", None) or str(e), permanent)
+            print(f"Job {job['id']} attempt {job['attempts']} failed ({status or 'lease lost'}): {str(e)}")
+            return
+        finally:
+            done.set()
+            heartbeat.join()
+        if not self.job_queue.complete(job, result):
+            print(f"Job {job['id']} attempt {job['attempts']} finished after losing its lease, result discarded")
+
+    def _heartbeat(self, job, done):
+        # Renew well within the lease so one missed beat does not requeue a running job.
+        while not done.wait(self.job_queue.lease_seconds / 3):
+            try:
+                if not self.job_queue.heartbeat(job):
+                    print(f"Job {job['id']} attempt {job['attempts']} lost its lease")
+                    return
+            except sqlite3.Error as e:
+                print(f"Error renewing the lease of job {job['id']}: {str(e)}")
+
+def main():
+    """
+    Run a standalone worker process that drains the job queue shared with the API.
+    """
+    from API.Backend.model import get_model
+    from API.Backend.donut_extraction import load_donut_model
+    from API.Backend.donut_batching import DonutBatcher
+    from API.Backend.invoice_pipeline import process_upload
+    from API.Backend.result_cache import ResultCache
+    from API.Backend.image_store import get_image_store
+
+    # The sweeper counts every file in TEMP_IMAGE_DIR, including the API's, so
+    # the size cap holds even when no API process is running.
+    get_image_store().start()
+    yolo_model = get_model()
+    donut_batcher = DonutBatcher(load_donut_model())
+    result_cache = ResultCache()
+
+    def handler(contents, filename):
+        return process_upload(contents, filename, yolo_model, donut_batcher, result_cache)
+
+    worker = JobWorker(JobQueue(), handler)
+    worker.start()
+    print(f"Job worker {worker.name} started with concurrency {worker.concurrency}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        worker.stop()
+        donut_batcher.stop()
+        get_image_store().stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import threading
+import time
+from API.Backend.config import MODEL_LOAD_TIMEOUT, MODEL_RETRY_INTERVAL
+
+class ModelNotReady(Exception):
+    """Raised when a model failed to load or is still loading after the allowed wait."""
+
+class ModelSlot:
+    """
+    The load state of one registered model.
+    """
+
+    def __init__(self, name, loader, shared=True):
+        self.name = name
+        self.loader = loader
+        self.shared = shared
+        self.started = False
+        self.state = "pending"
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.failed_at = None
+        self.loaded = threading.Event()
+
+    def reset(self):
+        # Forget a failed load so the slot can be started again.
+        self.started = False
+        self.state = "pending"
+        self.error = None
+        self.failed_at = None
+        self.loaded.clear()
+
+    def load(self):
+        self.state = "loading"
+        start = time.perf_counter()
+        try:
+            self.value = self.loader()
+            self.state = "ready"
+        except Exception as e:
+            self.error = str(e)
+            self.failed_at = time.monotonic()
+            self.state = "failed"
+            print(f"Failed to load model {self.name}: {str(e)}")
+        self.load_seconds = time.perf_counter() - start
+        if self.state == "ready":
+            print(f"Loaded model {self.name} in {self.load_seconds:.2f}s")
+        self.loaded.set()
+
+    def status(self):
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error, "shared": self.shared}
+
+class ModelProxy:
+    """
+    A stand-in for a managed model that resolves it on first use.
+
+    Calls, indexing, unpacking and attribute access are forwarded to the
+    loaded model, so code written against the model itself (for example
+    `yolo_model(image)` or `processor, model = donut_model`) works unchanged
+    and simply waits if the model is still loading.
+    """
+
+    def __init__(self, manager, name):
+        self._manager = manager
+        self._name = name
+
+    def _resolve(self):
+        return self._manager.get(self._name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+class ModelManager:
+    """
+    Load models in parallel in the background and report their status.
+
+    Models are registered with a loader function and loaded on their own
+    threads once `start` is called, so the server can answer liveness checks
+    immediately and report readiness per model while weights are loading.
+
+    Under a pre-forking server, `preload` loads the models that are safe to
+    share in the master process; the forked workers inherit them
+    copy-on-write and `start` then only loads the remaining ones, and those
+    that failed in the master.
+
+    A model that failed to load is loaded again by the next `start`, and by
+    `get` and `retry_failed` once it has been failed for `retry_interval`
+    seconds, so a transient error does not need a restart.
+
+    Example:
+        >>> models = ModelManager()
+        >>> models.register("yolo", get_model)
+        >>> models.start()
+        >>> yolo_model = models.proxy("yolo")
+    """
+
+    def __init__(self, timeout=MODEL_LOAD_TIMEOUT, retry_interval=MODEL_RETRY_INTERVAL):
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, shared=True):
+        """
+        Register a model loader.
+
+        Args:
+            name (str): The model name used by `get`, `proxy` and the status report.
+            loader (callable): A function with no arguments that returns the loaded model.
+            shared (bool, optional): Whether the loaded model survives a fork and may be loaded
+                                     by `preload` in a master process. Runtimes that own native
+                                     thread pools, such as ONNX Runtime sessions, do not.
+        """
+        self._slots[name] = ModelSlot(name, loader, shared)
+
+    def start(self, names=None, retry_after=0):
+        """
+        Start loading registered models on their own threads.
+
+        Models loading or loaded are skipped. Models that failed are loaded again.
+
+        Args:
+            names (iterable, optional): The models to load; defaults to all of them.
+            retry_after (float, optional): Only reload failed models that failed at least this many seconds ago.
+        """
+        slots = [self._slots[name] for name in names] if names is not None else list(self._slots.values())
+        now = time.monotonic()
+        with self._lock:
+            for slot in slots:
+                if slot.state == "failed" and slot.loaded.is_set() and now - slot.failed_at >= retry_after:
+                    slot.reset()
+            slots = [slot for slot in slots if not slot.started]
+            for slot in slots:
+                slot.started = True
+        for slot in slots:
+            threading.Thread(target=slot.load, name=f"load-{slot.name}", daemon=True).start()
+
+    def load_all(self):
+        """
+        Load every registered model in parallel and wait for all of them.
+
+        Returns:
+            bool: Whether every model loaded successfully.
+        """
+        self.start()
+        for slot in self._slots.values():
+            slot.loaded.wait()
+        return self.ready()
+
+    def preload(self):
+        """
+        Load the shared models in parallel and wait for them, before a server forks its workers.
+
+        Returns:
+            bool: Whether every shared model loaded successfully.
+        """
+        shared = [name for name, slot in self._slots.items() if slot.shared]
+        self.start(shared)
+        for name in shared:
+            self._slots[name].loaded.wait()
+        return all(self._slots[name].state == "ready" for name in shared)
+
+    def get(self, name, timeout=None):
+        """
+        Return a loaded model, starting the loaders and waiting for it if needed.
+
+        Args:
+            name (str): The registered model name.
+            timeout (float, optional): Seconds to wait; defaults to the manager timeout.
+
+        Returns:
+            The loaded model.
+
+        Raises:
+            ModelNotReady: If the model failed to load or is not loaded in time.
+        """
+        slot = self._slots[name]
+        if slot.state != "ready":
+            self.start(retry_after=self.retry_interval)
+            if not slot.loaded.wait(timeout or self.timeout):
+                raise ModelNotReady(f"Model {name} is still loading")
+            if slot.state != "ready":
+                raise ModelNotReady(f"Model {name} failed to load: {slot.error}")
+        return slot.value
+
+    def proxy(self, name):
+        """
+        Return a ModelProxy that resolves the named model on first use.
+
+        Args:
+            name (str): The registered model name.
+
+        Returns:
+            ModelProxy: The proxy.
+        """
+        return ModelProxy(self, name)
+
+    def retry_failed(self):
+        """
+        Reload the models that failed at least `retry_interval` seconds ago.
+        """
+        self.start(retry_after=self.retry_interval)
+
+    def ready(self):
+        """
+        Check whether every registered model is loaded.
+
+        Returns:
+            bool: True once all models are ready.
+        """
+        return all(slot.state == "ready" for slot in self._slots.values())
+
+    def status(self):
+        """
+        Return the load state and time of every model.
+
+        Returns:
+            dict: Per-model status keyed by name.
+        """
+        return {name: slot.status() for name, slot in self._slots.items()}
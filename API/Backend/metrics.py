@@ -0,0 +1,235 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MEGAPIXEL_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+BYTE_BUCKETS = (1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+_registry = []
+_trace = contextvars.ContextVar("trace", default=None)
+_trace_lock = threading.Lock()
+
+def _format_labels(label, value, extra=""):
+    labels = [f'{label}="{value}"'] if label else []
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class Histogram:
+    """
+    A Prometheus-style histogram with fixed buckets and an optional single label.
+
+    Observations only take a lock and increment a few counters, so they are
+    cheap enough to record on every request.
+    """
+
+    def __init__(self, name, documentation, buckets, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, label_value=""):
+        """
+        Record one observation.
+
+        Args:
+            value (float): The observed value.
+            label_value (str, optional): The value of the histogram label.
+        """
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["count"] += 1
+            series["sum"] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, series["buckets"] + [series["count"]]):
+                    le = 'le="' + bound + '"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label, label_value, le)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label, label_value)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(self.label, label_value)} {series['count']}")
+        return lines
+
+class Counter:
+    """
+    A Prometheus-style counter with an optional single label.
+    """
+
+    def __init__(self, name, documentation, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, label_value=""):
+        """
+        Increase the counter.
+
+        Args:
+            amount (float, optional): The increment.
+            label_value (str, optional): The value of the counter label.
+        """
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_value, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label, label_value)} {value}")
+        return lines
+
+class Gauge:
+    """
+    A Prometheus-style gauge with an optional single label.
+    """
+
+    def __init__(self, name, documentation, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def set(self, value, label_value=""):
+        """
+        Set the gauge.
+
+        Args:
+            value (float): The current value.
+            label_value (str, optional): The value of the gauge label.
+        """
+        with self._lock:
+            self._values[label_value] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for label_value, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label, label_value)} {value}")
+        return lines
+
+STAGE_SECONDS = Histogram("invoice_genie_stage_seconds", "Wall time of each pipeline stage.", LATENCY_BUCKETS, "stage")
+REGIONS = Counter("invoice_genie_regions_total", "Regions detected by YOLO, by kind.", "kind")
+PAGES = Counter("invoice_genie_pages_total", "Pages processed by the pipeline.")
+IMAGE_MEGAPIXELS = Histogram("invoice_genie_image_megapixels", "Size of the processed page images.", MEGAPIXEL_BUCKETS)
+UPLOAD_BYTES = Histogram("invoice_genie_upload_bytes", "Size of uploaded files.", BYTE_BUCKETS)
+PROCESS_MEMORY = Gauge("invoice_genie_process_memory_bytes", "Memory of the worker process serving the scrape, by kind.", "kind")
+
+@contextmanager
+def timed(stage):
+    """
+    Time a block or function, record it in the stage histogram and in the current trace.
+
+    Works both as a context manager and as a decorator. Repeated stages within
+    one trace, such as `extract_text` on every page, are summed.
+
+    Args:
+        stage (str): The stage name, used as the histogram label and trace key.
+
+    Example:
+        >>> with timed("yolo"):
+        ...     results = yolo_model(image)
+        >>> @timed("draw_boxes")
+        ... def draw_boxes(...): ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage)
+        timings = _trace.get()
+        if timings is not None:
+            with _trace_lock:
+                timings[stage] = timings.get(stage, 0.0) + seconds
+
+def add_timings(timings):
+    """
+    Add stage timings measured elsewhere to the current trace, without observing them again.
+
+    Used to credit work done once for several requests, such as a batched
+    Donut generation, to the trace of every request that took part.
+
+    Args:
+        timings (dict): Seconds per stage.
+    """
+    current = _trace.get()
+    if current is not None:
+        with _trace_lock:
+            for stage, seconds in timings.items():
+                current[stage] = current.get(stage, 0.0) + seconds
+
+@contextmanager
+def trace():
+    """
+    Collect the stage timings of everything run inside the block.
+
+    The trace lives in a context variable, so it follows work into threads
+    started with `run_in_context`, such as pipeline workers and stage graphs.
+
+    Yields:
+        dict: Seconds spent per stage, filled in as stages finish.
+    """
+    timings = {}
+    token = _trace.set(timings)
+    try:
+        yield timings
+    finally:
+        _trace.reset(token)
+
+def run_in_context(fn):
+    """
+    Bind a function to a copy of the current context, so the caller's trace follows it into another thread.
+
+    Args:
+        fn (callable): The function to bind.
+
+    Returns:
+        callable: A function with the same arguments that runs `fn` in the copied context.
+    """
+    return partial(contextvars.copy_context().run, fn)
+
+def round_timings(timings, digits=4):
+    """
+    Copy a trace for a JSON response, rounded to a readable precision.
+
+    Args:
+        timings (dict): A trace from `trace`.
+        digits (int, optional): Decimal places kept.
+
+    Returns:
+        dict: The rounded timings.
+    """
+    with _trace_lock:
+        return {stage: round(seconds, digits) for stage, seconds in timings.items()}
+
+def render_metrics():
+    """
+    Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The /metrics body.
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,34 @@
-from ultralytics import YOLO
+import os
+import threading
+from API.Backend.config import YOLO_WEIGHTS, YOLO_ONNX_WEIGHTS, YOLO_BACKEND
 
 _model = None
+_loaded_backend = None
+
+class SerializedModel:
+    """
+    Serialize calls to a model that must not be called from several threads at once.
+
+    Ultralytics models are not thread-safe: each call may create or
+    reconfigure the model's `predictor` and its backend (`setup_model`), and
+    pipeline, batch-job and job-worker threads all share one instance. Calls
+    take turns on a lock; batched calls such as `process_images` still cover
+    a whole batch in a single turn. Attribute access is forwarded unchanged.
+
+    Args:
+        model: The model to wrap.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            return self.model(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
 
 def get_model():
     """
@@ -10,12 +38,81 @@ def get_model():
     It ensures that only one instance of the model is created and reused.
 
     Returns:
-        YOLO: An instance of the YOLO model.
+        SerializedModel: The YOLO model, safe to call from concurrent threads.
 
     Note:
-        The model is loaded from the file "API/Backend/best.pt" when first called.
+        The model is loaded from the file YOLO_WEIGHTS ("API/Backend/best.pt") when first called,
+        or from its ONNX export when YOLO_BACKEND is "onnx".
     """
     global _model
     if _model is None:
-        _model = YOLO("API/Backend/best.pt")
+        _model = SerializedModel(load_yolo_model(YOLO_BACKEND))
     return _model
+
+def loaded_yolo_backend():
+    """
+    Report the backend the YOLO model was actually loaded with.
+
+    Returns:
+        str or None: "torch" or "onnx" after `load_yolo_model`, None before any load.
+    """
+    return _loaded_backend
+
+def load_yolo_model(backend="torch"):
+    """
+    Load the YOLO detector with the requested inference backend.
+
+    Args:
+        backend (str, optional): "torch" for the ultralytics PyTorch weights, or "onnx" to run
+                                 the exported model with ONNX Runtime.
+
+    Returns:
+        YOLO: A model with the same call interface for either backend.
+
+    Note:
+        If the ONNX backend cannot be exported or loaded, the PyTorch weights are used instead;
+        `loaded_yolo_backend` reports which one was used.
+        PyTorch weights are fused (Conv+BN) right away rather than on the first prediction, so
+        workers forked after a preload share the fused weights instead of each fusing a private copy.
+    """
+    global _loaded_backend
+    # Deferred so importing this module does not pull in ultralytics and torch.
+    from ultralytics import YOLO
+
+    if backend == "onnx":
+        try:
+            import onnxruntime  # noqa: F401
+            model = YOLO(export_yolo_onnx(), task="detect")
+            _loaded_backend = "onnx"
+            return model
+        except Exception as e:
+            print(f"ONNX Runtime backend unavailable for YOLO, falling back to PyTorch: {str(e)}")
+    elif backend != "torch":
+        print(f"Unknown YOLO backend {backend}, using PyTorch")
+    model = YOLO(YOLO_WEIGHTS)
+    model.fuse()
+    _loaded_backend = "torch"
+    return model
+
+def export_yolo_onnx(weights=YOLO_WEIGHTS, output=YOLO_ONNX_WEIGHTS):
+    """
+    Export the YOLO weights to ONNX, reusing an export that is newer than the weights.
+
+    The export uses a dynamic batch axis so batched calls such as
+    `process_images` work with ONNX Runtime as well.
+
+    Args:
+        weights (str, optional): The PyTorch weights file.
+        output (str, optional): Where the ONNX model is written.
+
+    Returns:
+        str: The path of the ONNX model.
+    """
+    from ultralytics import YOLO
+
+    if os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(weights):
+        return output
+    exported = YOLO(weights).export(format="onnx", dynamic=True, simplify=True)
+    if os.path.abspath(exported) != os.path.abspath(output):
+        os.replace(exported, output)
+    return output
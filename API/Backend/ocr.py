@@ -1,14 +1,176 @@
-import easyocr
+import math
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
 import cv2
+import numpy as np
+from API.Backend.metrics import timed
+from API.Backend.config import (
+    OCR_LANGUAGES,
+    OCR_READER_POOL_SIZE,
+    OCR_DETECTION_BATCH_SIZE,
+    OCR_RECOGNITION_BATCH_SIZE,
+)
 
-def extract_text(cv2_img, numbered_boxes):
+_pools = {}
+_pools_lock = threading.Lock()
+
+class ReaderPool:
+    """
+    A bounded pool of EasyOCR readers that share the same language set.
+
+    Readers are expensive to build (detector and recognizer weights are loaded
+    from disk), so they are created lazily up to `size` and then handed out to
+    concurrent callers. A reader is only ever used by one thread at a time.
+    """
+
+    def __init__(self, languages, size=OCR_READER_POOL_SIZE):
+        self.languages = tuple(languages)
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self.load_seconds = []
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def warm_up(self, count=1):
+        """
+        Load readers ahead of time so the first requests do not pay for it.
+
+        Args:
+            count (int): The number of readers to have loaded, capped at the pool size.
+        """
+        while True:
+            with self._lock:
+                if self._created >= min(count, self.size):
+                    return
+                self._created += 1
+            self._idle.put(self._load())
+
+    @contextmanager
+    def reader(self, timeout=None):
+        """
+        Borrow a reader from the pool for the duration of a `with` block.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a free reader when the pool is exhausted.
+
+        Yields:
+            easyocr.Reader: A reader that is not used by any other thread.
+        """
+        reader = self._acquire(timeout)
+        try:
+            yield reader
+        finally:
+            self._idle.put(reader)
+
+    def _acquire(self, timeout=None):
+        try:
+            reader = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return reader
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+                self.misses += 1
+            else:
+                self.waits += 1
+
+        if not create:
+            return self._idle.get(timeout=timeout)
+        return self._load()
+
+    def _load(self):
+        # The caller has already reserved a slot in `_created`.
+        start = time.perf_counter()
+        try:
+            import easyocr  # deferred so importing this module stays cheap
+            reader = easyocr.Reader(list(self.languages))
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.load_seconds.append(elapsed)
+        print(f"Loaded EasyOCR reader {self.languages} in {elapsed:.2f}s")
+        return reader
+
+    def stats(self):
+        """
+        Return load and usage counters for the pool.
+
+        Returns:
+            dict: Languages, pool size, loaded/idle reader counts, load times and hit counts.
+        """
+        with self._lock:
+            return {
+                "languages": list(self.languages),
+                "size": self.size,
+                "loaded": self._created,
+                "idle": self._idle.qsize(),
+                "load_seconds": list(self.load_seconds),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+            }
+
+def get_reader_pool(languages=OCR_LANGUAGES):
+    """
+    Get or create the process-wide reader pool for a language set.
+
+    Pools are keyed by the sorted language codes, so ['fr', 'en'] and
+    ['en', 'fr'] share the same readers.
+
+    Args:
+        languages (iterable): EasyOCR language codes.
+
+    Returns:
+        ReaderPool: The shared pool for these languages.
+    """
+    key = tuple(sorted(languages))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ReaderPool(languages)
+    return pool
+
+def reader_stats():
+    """
+    Return the statistics of every reader pool created in this process.
+
+    Returns:
+        list: One `ReaderPool.stats()` dictionary per pool.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+@timed("extract_text")
+def extract_text(cv2_img, numbered_boxes, languages=OCR_LANGUAGES, return_boxes=False):
     """
     Extract text from specified regions of an image using EasyOCR.
 
+    All regions of the page are processed together: text detection runs on
+    padded batches of crops, and recognition runs over the page in padded
+    batches of the detected text boxes, instead of a full `readtext` call per region.
+
     Args:
         cv2_img (numpy.ndarray): The input image in OpenCV format.
         numbered_boxes (list): A list of tuples, each containing a number and a bounding box.
                                The bounding box should be in the format (x_min, y_min, x_max, y_max).
+        languages (iterable, optional): EasyOCR language codes used to select the reader pool.
+        return_boxes (bool, optional): Also return the page coordinates (x1, y1, x2, y2) of every
+                                       text box under "box", e.g. to rebuild table structure.
 
     Returns:
         dict: A dictionary where keys are the numbers associated with each bounding box,
@@ -19,12 +181,140 @@ def extract_text(cv2_img, numbered_boxes):
         >>> boxes = [(1, (10, 10, 100, 50)), (2, (150, 150, 300, 200))]
         >>> result = extract_text(img, boxes)
     """
-    reader = easyocr.Reader(['fr', 'es', 'en'])
+    height, width = cv2_img.shape[:2]
     extracted_texts = {}
+    regions = []
     for number, bbox in numbered_boxes:
         x_min, y_min, x_max, y_max = map(int, bbox)
-        cropped_image = cv2_img[y_min:y_max, x_min:x_max]
-        ocr_results = reader.readtext(cropped_image)
-        box_text = [{"text": text, "confidence": prob} for (_, text, prob) in ocr_results]
-        extracted_texts[number] = box_text
+        x_min, y_min = max(x_min, 0), max(y_min, 0)
+        x_max, y_max = min(x_max, width), min(y_max, height)
+        extracted_texts[number] = []
+        if x_max > x_min and y_max > y_min:
+            regions.append((number, x_min, y_min, x_max, y_max))
+
+    if not regions:
+        return extracted_texts
+
+    with get_reader_pool(languages).reader() as reader:
+        with timed("ocr_detect"):
+            horizontal_list, free_list, owners = detect_regions(reader, cv2_img, regions)
+        if not horizontal_list and not free_list:
+            return extracted_texts
+        with timed("ocr_recognize"):
+            img_cv_grey = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2GRAY)
+            ocr_results = recognize_regions(reader, img_cv_grey, horizontal_list, free_list)
+
+    for box, text, prob in ocr_results:
+        number = owners[_box_key(box)].popleft()
+        entry = {"text": text, "confidence": prob}
+        if return_boxes:
+            xs, ys = [point[0] for point in box], [point[1] for point in box]
+            entry["box"] = [int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys))]
+        extracted_texts[number].append(entry)
     return extracted_texts
+
+def detect_regions(reader, cv2_img, regions, batch_size=OCR_DETECTION_BATCH_SIZE):
+    """
+    Run EasyOCR text detection on image regions in padded batches.
+
+    Crops are sorted by size so that each batch pads as little as possible.
+    Padding is added to the bottom and right with white pixels, so detected
+    boxes stay in crop coordinates and only need to be offset into the page.
+
+    Args:
+        reader (easyocr.Reader): The reader whose detector is used.
+        cv2_img (numpy.ndarray): The page image in OpenCV format.
+        regions (list): Tuples of (number, x_min, y_min, x_max, y_max) already clipped to the page.
+        batch_size (int, optional): The maximum number of crops per detector call.
+
+    Returns:
+        tuple: A tuple containing:
+            - horizontal_list (list): Axis-aligned text boxes in page coordinates.
+            - free_list (list): Rotated text boxes in page coordinates.
+            - owners (dict): Maps each box key to a deque of the region numbers it belongs to.
+    """
+    horizontal_list, free_list = [], []
+    owners = defaultdict(deque)
+    ordered = sorted(regions, key=lambda region: (region[4] - region[2], region[3] - region[1]))
+    detections = {}
+
+    for start in range(0, len(ordered), batch_size):
+        chunk = ordered[start:start + batch_size]
+        max_h = max(y_max - y_min for _, _, y_min, _, y_max in chunk)
+        max_w = max(x_max - x_min for _, x_min, _, x_max, _ in chunk)
+        batch = np.full((len(chunk), max_h, max_w, 3), 255, dtype=np.uint8)
+        for i, (_, x_min, y_min, x_max, y_max) in enumerate(chunk):
+            batch[i, :y_max - y_min, :x_max - x_min] = cv2_img[y_min:y_max, x_min:x_max]
+        horizontal_agg, free_agg = reader.detect(batch, reformat=False)
+        for region, horizontal, free in zip(chunk, horizontal_agg, free_agg):
+            detections[region[0]] = (horizontal, free)
+
+    # Emit boxes in the caller's region order so per-region results keep readtext's order.
+    for number, x_min, y_min, x_max, y_max in regions:
+        horizontal, free = detections[number]
+        crop_w, crop_h = x_max - x_min, y_max - y_min
+        for box in horizontal:
+            box_x_min = max(0, int(box[0])) + x_min
+            box_x_max = min(int(box[1]), crop_w) + x_min
+            box_y_min = max(0, int(box[2])) + y_min
+            box_y_max = min(int(box[3]), crop_h) + y_min
+            if box_x_max <= box_x_min or box_y_max <= box_y_min:
+                continue
+            page_box = [box_x_min, box_x_max, box_y_min, box_y_max]
+            horizontal_list.append(page_box)
+            owners[_box_key(_corners(page_box))].append(number)
+        for box in free:
+            page_box = [[point[0] + x_min, point[1] + y_min] for point in box]
+            free_list.append(page_box)
+            owners[_box_key(page_box)].append(number)
+
+    return horizontal_list, free_list, owners
+
+def recognize_regions(reader, img_cv_grey, horizontal_list, free_list, batch_size=OCR_RECOGNITION_BATCH_SIZE):
+    """
+    Run EasyOCR text recognition on detected boxes in padded batches.
+
+    `Reader.recognize` ignores `batch_size` when the reader runs on the CPU
+    and calls the recognizer once per box, so this drives EasyOCR's own
+    cropping and recognition functions directly. Crops are sorted by width
+    so that each batch pads as little as possible, which is what makes one
+    box at a time the faster choice on the CPU otherwise.
+
+    Args:
+        reader (easyocr.Reader): The reader whose recognizer is used.
+        img_cv_grey (numpy.ndarray): The page image in grayscale.
+        horizontal_list (list): Axis-aligned text boxes in page coordinates.
+        free_list (list): Rotated text boxes in page coordinates.
+        batch_size (int, optional): The maximum number of crops per recognizer call.
+
+    Returns:
+        list: (box, text, confidence) tuples from top to bottom, as `Reader.recognize` returns them.
+    """
+    from easyocr.config import imgH
+    from easyocr.recognition import get_text
+    from easyocr.utils import get_image_list
+
+    image_list, _ = get_image_list(horizontal_list, free_list, img_cv_grey, model_height=imgH)
+    ignore_char = "".join(set(reader.character) - set(reader.lang_char))
+    order = sorted(range(len(image_list)), key=lambda i: image_list[i][1].shape[1])
+    results = [None] * len(image_list)
+
+    for start in range(0, len(order), batch_size):
+        chunk = order[start:start + batch_size]
+        # Every crop is resized to imgH; the batch is padded to the widest one, rounded up like EasyOCR does.
+        max_width = max(imgH, math.ceil(max(image_list[i][1].shape[1] for i in chunk) / imgH) * imgH)
+        chunk_results = get_text(
+            reader.character, imgH, max_width, reader.recognizer, reader.converter,
+            [image_list[i] for i in chunk], ignore_char, batch_size=batch_size, workers=0, device=reader.device,
+        )
+        for i, result in zip(chunk, chunk_results):
+            results[i] = result
+    return results
+
+def _corners(horizontal_box):
+    # EasyOCR reports horizontal boxes back as their four corners.
+    x_min, x_max, y_min, y_max = horizontal_box
+    return [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+
+def _box_key(box):
+    return tuple((round(float(x)), round(float(y))) for x, y in box)
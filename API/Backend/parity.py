@@ -0,0 +1,193 @@
+"""
+Compare an alternative inference backend against the PyTorch reference.
+
+Runs both backends over the same images and reports detection agreement
+(boxes matched by class and IoU), Donut field agreement, and the time each
+backend spent, so a faster backend can be shown not to regress accuracy.
+
+Usage:
+    python -m API.Backend.parity --yolo-backend onnx --donut-backend int8 --limit 20
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from API.Backend.model import load_yolo_model
+from API.Backend.donut_extraction import load_donut_model, donut_extraction
+
+DEFAULT_IMAGES = "Yolov9/test/images"
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Compute the pairwise IoU of two sets of (x1, y1, x2, y2) boxes.
+
+    Args:
+        boxes_a (numpy.ndarray): An (N, 4) array.
+        boxes_b (numpy.ndarray): An (M, 4) array.
+
+    Returns:
+        numpy.ndarray: An (N, M) array of IoU values.
+    """
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+def match_boxes(reference, candidate, iou_threshold=0.5):
+    """
+    Greedily match candidate detections to reference detections of the same class.
+
+    Args:
+        reference (tuple): (boxes, classes) arrays from the reference backend.
+        candidate (tuple): (boxes, classes) arrays from the backend under test.
+        iou_threshold (float, optional): The minimum IoU for a match.
+
+    Returns:
+        tuple: (matched count, list of matched IoUs).
+    """
+    ref_boxes, ref_classes = reference
+    cand_boxes, cand_classes = candidate
+    if len(ref_boxes) == 0 or len(cand_boxes) == 0:
+        return 0, []
+    iou = box_iou(ref_boxes, cand_boxes)
+    iou[ref_classes[:, None] != cand_classes[None, :]] = 0
+    matched_ious = []
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        matched_ious.append(float(iou[i, j]))
+        iou[i, :] = 0
+        iou[:, j] = 0
+    return len(matched_ious), matched_ious
+
+def flatten_fields(value, prefix=""):
+    """
+    Flatten a nested Donut result into {"path": "text"} pairs.
+
+    Args:
+        value: A dict, list or scalar from `donut_extraction`.
+        prefix (str, optional): The path of `value` in the parent.
+
+    Returns:
+        dict: Leaf values keyed by their path.
+    """
+    if isinstance(value, dict):
+        fields = {}
+        for key, item in value.items():
+            fields.update(flatten_fields(item, f"{prefix}.{key}" if prefix else key))
+        return fields
+    if isinstance(value, list):
+        fields = {}
+        for i, item in enumerate(value):
+            fields.update(flatten_fields(item, f"{prefix}[{i}]"))
+        return fields
+    return {prefix: str(value).strip()}
+
+def detect(yolo_model, cv2_img):
+    result = yolo_model(cv2_img, verbose=False)[0]
+    return result.boxes.xyxy.cpu().numpy(), result.boxes.cls.cpu().numpy().astype(int)
+
+def run_parity(image_paths, yolo_backend, donut_backend, iou_threshold=0.5):
+    """
+    Run the reference and candidate backends over the images and summarize their agreement.
+
+    Args:
+        image_paths (list): Image files to compare on.
+        yolo_backend (str): The YOLO backend under test, or None to skip YOLO.
+        donut_backend (str): The Donut backend under test, or None to skip Donut.
+        iou_threshold (float, optional): The IoU needed for two boxes to match.
+
+    Returns:
+        dict: Agreement metrics and per-backend timings.
+    """
+    images = [cv2.imread(path) for path in image_paths]
+    report = {"images": len(images)}
+
+    if yolo_backend:
+        models = {"torch": load_yolo_model("torch"), yolo_backend: load_yolo_model(yolo_backend)}
+        for model in models.values():
+            detect(model, images[0])  # warm up
+        outputs, seconds = {}, {}
+        for name, model in models.items():
+            start = time.perf_counter()
+            outputs[name] = [detect(model, image) for image in images]
+            seconds[name] = time.perf_counter() - start
+        reference_total = candidate_total = matched_total = 0
+        all_ious = []
+        for reference, candidate in zip(outputs["torch"], outputs[yolo_backend]):
+            matched, ious = match_boxes(reference, candidate, iou_threshold)
+            reference_total += len(reference[0])
+            candidate_total += len(candidate[0])
+            matched_total += matched
+            all_ious.extend(ious)
+        report["yolo"] = {
+            "backend": yolo_backend,
+            "recall": matched_total / reference_total if reference_total else 1.0,
+            "precision": matched_total / candidate_total if candidate_total else 1.0,
+            "mean_iou": float(np.mean(all_ious)) if all_ious else None,
+            "seconds": seconds,
+            "speedup": seconds["torch"] / seconds[yolo_backend] if seconds[yolo_backend] else None,
+        }
+
+    if donut_backend:
+        models = {"torch": load_donut_model("torch"), donut_backend: load_donut_model(donut_backend)}
+        outputs, seconds = {}, {}
+        for name, model in models.items():
+            start = time.perf_counter()
+            outputs[name] = [flatten_fields(donut_extraction(image, model) or {}) for image in images]
+            seconds[name] = time.perf_counter() - start
+        reference_fields = matching_fields = 0
+        for reference, candidate in zip(outputs["torch"], outputs[donut_backend]):
+            reference_fields += len(reference)
+            matching_fields += sum(1 for key, value in reference.items() if candidate.get(key) == value)
+        report["donut"] = {
+            "backend": donut_backend,
+            "field_match": matching_fields / reference_fields if reference_fields else 1.0,
+            "seconds": seconds,
+            "speedup": seconds["torch"] / seconds[donut_backend] if seconds[donut_backend] else None,
+        }
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=DEFAULT_IMAGES, help="Directory of images to compare on")
+    parser.add_argument("--limit", type=int, default=20, help="Maximum number of images")
+    parser.add_argument("--yolo-backend", default="onnx", help="YOLO backend under test, or 'none'")
+    parser.add_argument("--donut-backend", default="int8", help="Donut backend under test, or 'none'")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU needed for two boxes to match")
+    parser.add_argument("--min-box-recall", type=float, default=0.95)
+    parser.add_argument("--min-field-match", type=float, default=0.9)
+    args = parser.parse_args()
+
+    image_paths = sorted(glob.glob(os.path.join(args.images, "*.jpg")) + glob.glob(os.path.join(args.images, "*.png")))
+    image_paths = image_paths[:args.limit]
+    if not image_paths:
+        sys.exit(f"No images found in {args.images}")
+
+    report = run_parity(
+        image_paths,
+        None if args.yolo_backend == "none" else args.yolo_backend,
+        None if args.donut_backend == "none" else args.donut_backend,
+        args.iou,
+    )
+    print(json.dumps(report, indent=2))
+
+    failed = False
+    if "yolo" in report and report["yolo"]["recall"] < args.min_box_recall:
+        print(f"YOLO recall {report['yolo']['recall']:.3f} is below {args.min_box_recall}")
+        failed = True
+    if "donut" in report and report["donut"]["field_match"] < args.min_field_match:
+        print(f"Donut field match {report['donut']['field_match']:.3f} is below {args.min_field_match}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import io
+from collections import namedtuple
+import cv2
+import numpy as np
+from PIL import Image
+from API.Backend.metrics import timed
+from API.Backend.config import PREPROCESS_MAX_EDGE, PREPROCESS_DESKEW, PREPROCESS_MAX_SKEW, PREPROCESS_CONTRAST
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+# The JPEG size is read from a prefix of this many bytes, enough for large EXIF and ICC segments.
+JPEG_HEADER_BYTES = 256 * 1024
+# libjpeg can scale while decoding, which skips most of the IDCT work for large photos.
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# Skew is estimated on a copy whose long edge is at most this many pixels.
+SKEW_ESTIMATE_EDGE = 1000
+
+PreparedPage = namedtuple("PreparedPage", ["image", "to_original"])
+PreparedPage.__doc__ = """
+A page ready for the models.
+
+Attributes:
+    image (numpy.ndarray): The normalized page in OpenCV format.
+    to_original (numpy.ndarray): A 2x3 affine matrix from `image` coordinates to the uploaded page.
+"""
+
+def decode_image(contents, max_edge=PREPROCESS_MAX_EDGE):
+    """
+    Decode image bytes, letting libjpeg downscale large JPEGs while decoding.
+
+    The reduction factor (2, 4 or 8) is the largest that keeps the long edge
+    at or above `max_edge`, so the result is never smaller than what
+    `normalize_resolution` would produce from the full image.
+
+    Args:
+        contents (bytes, bytearray or memoryview): The encoded image, decoded without copying it.
+        max_edge (int, optional): The target long edge in pixels, 0 to always decode at full size.
+
+    Returns:
+        tuple: A tuple containing:
+            - image (numpy.ndarray or None): The image in OpenCV format, None if it cannot be decoded.
+            - scale (float): The decoded size divided by the original size.
+    """
+    flag, factor = cv2.IMREAD_COLOR, 1
+    if max_edge and bytes(contents[:3]) == JPEG_MAGIC:
+        try:
+            # Only the header is parsed to read the size.
+            long_edge = max(Image.open(io.BytesIO(memoryview(contents)[:JPEG_HEADER_BYTES])).size)
+        except Exception:
+            long_edge = 0
+        for candidate, candidate_flag in REDUCED_DECODE_FLAGS:
+            if long_edge // candidate >= max_edge:
+                flag, factor = candidate_flag, candidate
+                break
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), flag)
+    return image, 1.0 / factor
+
+def normalize_resolution(cv2_img, max_edge=PREPROCESS_MAX_EDGE):
+    """
+    Scale an image down so that its long edge is at most `max_edge` pixels.
+
+    Args:
+        cv2_img (numpy.ndarray): The image in OpenCV format.
+        max_edge (int, optional): The maximum long edge, 0 to keep the image unchanged.
+
+    Returns:
+        tuple: The resized image and the scale applied. Images are never upscaled.
+    """
+    height, width = cv2_img.shape[:2]
+    if not max_edge or max(height, width) <= max_edge:
+        return cv2_img, 1.0
+    scale = max_edge / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(cv2_img, size, interpolation=cv2.INTER_AREA), scale
+
+def estimate_skew(cv2_img, max_angle=PREPROCESS_MAX_SKEW):
+    """
+    Estimate the rotation that makes the text lines of a page horizontal.
+
+    Uses the projection profile method: the ink mask is rotated by candidate
+    angles and the angle whose row sums vary the most, i.e. whose text lines
+    fall into the fewest rows, wins. The search runs in 0.5 degree steps and
+    is then refined in 0.1 degree steps around the best candidate.
+
+    Args:
+        cv2_img (numpy.ndarray): The page in OpenCV format.
+        max_angle (float, optional): The largest correction considered, in degrees.
+
+    Returns:
+        float: The angle in degrees to pass to `cv2.getRotationMatrix2D`, 0 for a straight page.
+    """
+    grey = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2GRAY) if cv2_img.ndim == 3 else cv2_img
+    grey, _ = normalize_resolution(grey, SKEW_ESTIMATE_EDGE)
+    _, mask = cv2.threshold(grey, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    height, width = mask.shape
+    center = (width / 2, height / 2)
+
+    def score(angle):
+        matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+        rotated = cv2.warpAffine(mask, matrix, (width, height), flags=cv2.INTER_NEAREST)
+        return np.var(rotated.sum(axis=1, dtype=np.float64))
+
+    best = max(np.arange(-max_angle, max_angle + 0.25, 0.5), key=score)
+    best = max(np.arange(best - 0.4, best + 0.45, 0.1), key=score)
+    return float(round(best, 1))
+
+def rotation_matrix(cv2_img, angle):
+    """
+    Build the 3x3 matrix rotating an image by `angle` degrees around its center.
+
+    Args:
+        cv2_img (numpy.ndarray): The image to rotate.
+        angle (float): The rotation in degrees, as returned by `estimate_skew`.
+
+    Returns:
+        numpy.ndarray: The homogeneous rotation matrix.
+    """
+    height, width = cv2_img.shape[:2]
+    return np.vstack([cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0), [0.0, 0.0, 1.0]])
+
+def normalize_contrast(cv2_img):
+    """
+    Even out lighting and faded print with CLAHE on the lightness channel.
+
+    Args:
+        cv2_img (numpy.ndarray): The image in OpenCV format.
+
+    Returns:
+        numpy.ndarray: The contrast-normalized image.
+    """
+    lab = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2LAB)
+    lab[..., 0] = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(lab[..., 0])
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+@timed("preprocess")
+def prepare_page(cv2_img, scale=1.0, max_edge=PREPROCESS_MAX_EDGE, deskew=PREPROCESS_DESKEW, contrast=PREPROCESS_CONTRAST):
+    """
+    Normalize a decoded page before detection and OCR.
+
+    Args:
+        cv2_img (numpy.ndarray): The decoded page in OpenCV format.
+        scale (float, optional): The scale already applied while decoding, see `decode_image`.
+        max_edge (int, optional): The maximum long edge, 0 to keep the resolution.
+        deskew (bool, optional): Whether to straighten skewed pages.
+        contrast (bool, optional): Whether to apply contrast normalization.
+
+    Returns:
+        PreparedPage: The normalized image and the transform back to the uploaded page.
+    """
+    image, resize_scale = normalize_resolution(cv2_img, max_edge)
+    scale *= resize_scale
+    forward = np.diag([scale, scale, 1.0])
+
+    if deskew:
+        angle = estimate_skew(image)
+        if angle:
+            rotation = rotation_matrix(image, angle)
+            height, width = image.shape[:2]
+            image = cv2.warpAffine(image, rotation[:2], (width, height), flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
+            forward = rotation @ forward
+
+    if contrast:
+        image = normalize_contrast(image)
+
+    return PreparedPage(image, np.linalg.inv(forward)[:2])
+
+def map_boxes(boxes, to_original):
+    """
+    Map (x1, y1, x2, y2) boxes from a prepared page back to the uploaded page.
+
+    Rotated boxes are replaced by the axis-aligned box around their corners.
+
+    Args:
+        boxes (numpy.ndarray): An (N, 4) array of boxes in prepared page coordinates.
+        to_original (numpy.ndarray): The 2x3 matrix of a `PreparedPage`.
+
+    Returns:
+        numpy.ndarray: An (N, 4) array of boxes in uploaded page coordinates.
+
+    Example:
+        >>> page = prepare_page(cv2_img)
+        >>> map_boxes(np.array([[10, 10, 50, 40]]), page.to_original)
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    # The four corners of every box, as (N, 4, 2).
+    corners = boxes[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+    mapped = corners @ to_original[:, :2].T + to_original[:, 2]
+    return np.concatenate([mapped.min(axis=1), mapped.max(axis=1)], axis=1)
@@ -0,0 +1,280 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from API.Backend.config import (
+    YOLO_WEIGHTS,
+    YOLO_BACKEND,
+    DONUT_MODEL_NAME,
+    DONUT_BACKEND,
+    OCR_LANGUAGES,
+    PREPROCESS_MAX_EDGE,
+    PREPROCESS_DESKEW,
+    PREPROCESS_CONTRAST,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_MAX_MEMORY_BYTES,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_DISK_BYTES,
+    RESULT_CACHE_TTL,
+    RESULT_CACHE_RESCAN_INTERVAL,
+)
+from API.Backend.model import loaded_yolo_backend
+from API.Backend.donut_extraction import loaded_donut_backend
+
+# Bump when the shape of cached results changes.
+CACHE_FORMAT_VERSION = 3
+
+def model_versions():
+    """
+    Describe the models whose output is cached, so new weights never serve stale results.
+
+    Returns:
+        str: A version string built from the YOLO weights file, the Donut model name, the inference
+             backends, the OCR languages and the preprocessing settings.
+
+    Note:
+        The backends are the ones the loaders report, since a backend that fails to load falls
+        back to PyTorch. Before the models are loaded the configured backends stand in, so results
+        must be stored under a key computed after the pipeline ran.
+    """
+    try:
+        stat = os.stat(YOLO_WEIGHTS)
+        yolo_version = f"{YOLO_WEIGHTS}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        yolo_version = YOLO_WEIGHTS
+    yolo_backend = loaded_yolo_backend() or YOLO_BACKEND
+    donut_backend = loaded_donut_backend() or DONUT_BACKEND
+    return (f"v{CACHE_FORMAT_VERSION}|{yolo_version}:{yolo_backend}|{DONUT_MODEL_NAME}:{donut_backend}"
+            f"|{','.join(OCR_LANGUAGES)}|{PREPROCESS_MAX_EDGE}:{PREPROCESS_DESKEW:d}:{PREPROCESS_CONTRAST:d}")
+
+def cache_key(contents, versions=None):
+    """
+    Compute the content address of an upload.
+
+    Args:
+        contents (bytes): The uploaded file contents.
+        versions (str, optional): The model version string. Defaults to `model_versions()`.
+
+    Returns:
+        str: The hex SHA-256 of the contents and the model versions.
+    """
+    return cache_key_from_digest(hashlib.sha256(contents), versions)
+
+def cache_key_from_digest(digest, versions=None):
+    """
+    Finish a cache key from a SHA-256 that was fed the upload incrementally.
+
+    Args:
+        digest (hashlib._Hash): A SHA-256 object updated with the whole upload.
+        versions (str, optional): The model version string. Defaults to `model_versions()`.
+
+    Returns:
+        str: The same key `cache_key` returns for those contents. The digest itself is left
+             untouched, so the key can be computed again once the models have loaded.
+    """
+    digest = digest.copy()
+    digest.update(b"\0")
+    digest.update((versions or model_versions()).encode())
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    A two-tier cache of pipeline results keyed by content hash.
+
+    The memory tier is an LRU bounded by entry count and total size. The
+    optional disk tier stores one pickle per key under `directory` and evicts
+    the least recently used files past `max_disk_bytes`. Entries older than
+    `ttl` seconds are treated as misses in both tiers.
+
+    The directory is shared by every process using it (gunicorn workers,
+    standalone job workers), so it is the source of truth: lookups go to the
+    file itself, a hit refreshes its mtime, and the in-memory index used for
+    size accounting is rebuilt from a directory scan every `rescan_interval`
+    seconds so files written by other processes count towards the cap.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, max_memory_bytes=RESULT_CACHE_MAX_MEMORY_BYTES,
+                 directory=RESULT_CACHE_DIR, max_disk_bytes=RESULT_CACHE_MAX_DISK_BYTES, ttl=RESULT_CACHE_TTL,
+                 rescan_interval=RESULT_CACHE_RESCAN_INTERVAL):
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.rescan_interval = rescan_interval
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (stored_at, size, value)
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> (stored_at, size), least recently used first
+        self._disk_bytes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        # Scan outside the lock, then swap the index in. Callers hold no lock.
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file() and entry.name.endswith(".pkl"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+                except FileNotFoundError:
+                    pass  # removed by another process during the scan
+        disk = OrderedDict((key, (mtime, size)) for mtime, key, size in sorted(entries))
+        with self._lock:
+            self._disk = disk
+            self._disk_bytes = sum(size for _, size in disk.values())
+            self._scanned_at = time.time()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key):
+        """
+        Look up a cached value.
+
+        Args:
+            key (str): The key from `cache_key`.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, size, value = entry
+                if now - stored_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                self._drop_memory(key)
+
+            if not self.directory:
+                self.counters["misses"] += 1
+                return None
+
+        # The file is checked even when the index does not know the key:
+        # another process may have written it since the last scan.
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                stored_at = os.fstat(f.fileno()).st_mtime
+                if now - stored_at > self.ttl:
+                    raise FileNotFoundError
+                data = f.read()
+            value = pickle.loads(data)
+        except FileNotFoundError:
+            with self._lock:
+                self._drop_disk(key)
+                self.counters["misses"] += 1
+            return None
+        except Exception as e:
+            print(f"Error reading cache entry {key}: {str(e)}")
+            with self._lock:
+                self._drop_disk(key)
+                self.counters["misses"] += 1
+            return None
+
+        try:
+            # Refresh the mtime so every process sees the hit as a recent use.
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.counters["disk_hits"] += 1
+            self._index_disk(key, now, len(data))
+            self._store_memory(key, stored_at, len(data), value)
+        return value
+
+    def put(self, key, value):
+        """
+        Store a value in the memory tier and, if enabled, the disk tier.
+
+        Args:
+            key (str): The key from `cache_key`.
+            value: Any picklable value.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            self.counters["stores"] += 1
+            self._store_memory(key, now, len(data), value)
+
+        if not self.directory or len(data) > self.max_disk_bytes:
+            return
+        if now - self._scanned_at > self.rescan_interval:
+            self._load_disk_index()
+        tmp_path = None
+        try:
+            # A unique temporary name per writer, across threads and forked processes alike.
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing cache entry {key}: {str(e)}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+        with self._lock:
+            self._index_disk(key, now, len(data))
+            while self._disk_bytes > self.max_disk_bytes and self._disk:
+                self._drop_disk(next(iter(self._disk)))
+                self.counters["evictions"] += 1
+
+    def _index_disk(self, key, stored_at, size):
+        if key in self._disk:
+            self._disk_bytes -= self._disk.pop(key)[1]
+        self._disk[key] = (stored_at, size)
+        self._disk_bytes += size
+
+    def _store_memory(self, key, stored_at, size, value):
+        if key in self._memory:
+            self._drop_memory(key)
+        if size > self.max_memory_bytes:
+            return
+        self._memory[key] = (stored_at, size, value)
+        self._memory_bytes += size
+        while len(self._memory) > self.max_entries or self._memory_bytes > self.max_memory_bytes:
+            self._drop_memory(next(iter(self._memory)))
+            self.counters["evictions"] += 1
+
+    def _drop_memory(self, key):
+        _, size, _ = self._memory.pop(key)
+        self._memory_bytes -= size
+
+    def _drop_disk(self, key):
+        if key in self._disk:
+            _, size = self._disk.pop(key)
+            self._disk_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        """
+        Return hit/miss counters and tier sizes.
+
+        Returns:
+            dict: Counters and the number of entries and bytes held by each tier.
+        """
+        with self._lock:
+            return {
+                **self.counters,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
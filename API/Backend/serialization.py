@@ -0,0 +1,55 @@
+import json
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is the fallback
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+def to_builtin(value):
+    """
+    Convert the values the encoders do not know natively, mainly NumPy scalars such as OCR confidences.
+
+    Args:
+        value: The value that failed to serialize.
+
+    Returns:
+        A JSON compatible equivalent.
+
+    Raises:
+        TypeError: If the value has no JSON representation.
+    """
+    # NumPy scalars and arrays both implement tolist(), returning Python builtins.
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content):
+    """
+    Serialize a response body to UTF-8 JSON.
+
+    Uses orjson when it is installed, which serializes NumPy arrays and
+    scalars natively and is several times faster than the standard library
+    on the large nested page results.
+
+    Args:
+        content: The value to serialize.
+
+    Returns:
+        bytes: The JSON document.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=to_builtin, option=ORJSON_OPTIONS)
+    return json.dumps(content, default=to_builtin, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSONResponse rendered with `dumps`.
+    """
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,231 @@
+import argparse
+import gc
+import json
+import os
+from API.Backend.config import WEB_WORKERS, WORKER_THREADS, PIPELINE_WORKERS
+
+# Fields of /proc/<pid>/smaps_rollup reported by `process_memory`, in kB there.
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+# Environment variables read by the native thread pools when torch, MKL and OpenBLAS load.
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# cgroup v2 and v1 files holding the CPU quota of a container.
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+_worker_threads = None
+
+def available_cpus():
+    """
+    Count the CPUs this process may actually use.
+
+    `os.cpu_count()` reports the host's cores. Inside a container the usable
+    share is bounded by the CPU affinity mask (`--cpuset-cpus`) and by the
+    cgroup CFS quota (`--cpus`), whichever is smaller.
+
+    Returns:
+        int: The usable CPUs, at least 1.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+def cgroup_cpu_quota():
+    """
+    Read the CFS CPU quota of the current cgroup, in CPUs.
+
+    Returns:
+        float or None: The quota, e.g. 2.0 for `--cpus=2`, or None if unlimited or unknown.
+    """
+    try:
+        with open(CGROUP_V2_CPU_MAX) as f:
+            quota, period = f.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(CGROUP_V1_CPU_QUOTA) as f:
+            quota = int(f.read())
+        with open(CGROUP_V1_CPU_PERIOD) as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return quota / period
+
+def worker_thread_budget(workers=WEB_WORKERS, threads=WORKER_THREADS, pipeline_workers=PIPELINE_WORKERS):
+    """
+    Return the number of torch/OpenMP threads each worker process may use.
+
+    A worker runs up to `pipeline_workers` requests at once, and each of them
+    enters torch's intra-op pool, so the usable CPUs are divided by both the
+    number of processes and the pipeline threads of each one:
+    workers x pipeline_workers x budget stays within the CPUs.
+
+    Args:
+        workers (int, optional): The number of worker processes.
+        threads (int, optional): An explicit per-worker budget, 0 to split the CPUs evenly.
+        pipeline_workers (int, optional): The concurrent pipeline threads of one worker.
+
+    Returns:
+        int: The thread budget, at least 1.
+    """
+    if threads > 0:
+        return threads
+    return max(1, available_cpus() // (max(1, workers) * max(1, pipeline_workers)))
+
+def limit_native_threads(threads):
+    """
+    Cap the native thread pools through the environment, before torch is imported.
+
+    Values already set in the environment win, so a deployment can still override them.
+
+    Args:
+        threads (int): The thread budget of one worker.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+
+def configure_worker_threads(threads):
+    """
+    Apply a thread budget to the libraries already loaded in this process.
+
+    Called in every worker right after the fork. torch only sizes its
+    intra-op pool on first use, so workers forked from a master that loaded
+    but never ran the models each start a pool of exactly `threads` threads.
+
+    Args:
+        threads (int): The thread budget of this worker.
+    """
+    global _worker_threads
+    _worker_threads = threads
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+
+def freeze_heap():
+    """
+    Move every object allocated so far out of the garbage collector's reach before forking.
+
+    A collection in a worker would otherwise write to the header of every
+    tracked object it visits, copying the pages that hold the preloaded
+    models into each worker.
+    """
+    gc.collect()
+    gc.freeze()
+
+def worker_status():
+    """
+    Describe this worker process for /stats.
+
+    Returns:
+        dict: The pid, the parent pid, the thread budget and the memory usage of the process.
+    """
+    return {
+        "pid": os.getpid(),
+        "parent_pid": os.getppid(),
+        "threads": _worker_threads,
+        "memory": process_memory(),
+    }
+
+def process_memory(pid="self"):
+    """
+    Read the memory usage of a process from /proc.
+
+    RSS counts the pages shared with the master and the other workers in
+    full; PSS divides each shared page among the processes mapping it, and
+    the private fields are what the process alone costs. Summing PSS over
+    the master and its workers gives the real footprint of the server.
+
+    Args:
+        pid (int or str, optional): The process id, "self" for this process.
+
+    Returns:
+        dict: Bytes keyed by lowercased smaps field, e.g. "rss", "pss" and "private_dirty".
+              Only "rss" is available on kernels without smaps_rollup, and nothing off Linux.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                resident_pages = int(f.read().split()[1])
+            return {"rss": resident_pages * os.sysconf("SC_PAGE_SIZE")}
+        except (OSError, ValueError):
+            return {}
+    memory = {}
+    for line in lines:
+        field, _, value = line.partition(":")
+        if field in SMAPS_FIELDS:
+            memory[field.lower()] = int(value.split()[0]) * 1024
+    return memory
+
+def child_pids(parent_pid):
+    """
+    List the direct children of a process, e.g. the workers of a gunicorn master.
+
+    Args:
+        parent_pid (int): The parent process id.
+
+    Returns:
+        list: The child process ids, sorted.
+    """
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name is in parentheses and may contain spaces; the ppid follows the state.
+        fields = stat.rsplit(")", 1)[1].split()
+        if int(fields[1]) == parent_pid:
+            children.append(int(entry))
+    return sorted(children)
+
+def memory_report(master_pid):
+    """
+    Measure the memory of a pre-forked server: the master and every worker.
+
+    Args:
+        master_pid (int): The gunicorn master process id.
+
+    Returns:
+        dict: Per-process memory keyed by role and pid, and the RSS and PSS totals.
+    """
+    processes = {f"master:{master_pid}": process_memory(master_pid)}
+    for pid in child_pids(master_pid):
+        processes[f"worker:{pid}"] = process_memory(pid)
+    return {
+        "processes": processes,
+        "total_rss": sum(memory.get("rss", 0) for memory in processes.values()),
+        "total_pss": sum(memory.get("pss", 0) for memory in processes.values()),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory of a gunicorn master and its workers.")
+    parser.add_argument("master_pid", type=int, help="The gunicorn master process id.")
+    args = parser.parse_args()
+    print(json.dumps(memory_report(args.master_pid), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from API.Backend.metrics import run_in_context
+from API.Backend.config import STAGE_WORKERS
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_stage_executor():
+    """
+    Get or create the thread pool shared by all stage graphs in this process.
+
+    Returns:
+        ThreadPoolExecutor: The stage executor.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+    return _executor
+
+def run_stages(stages, executor=None, timings=None):
+    """
+    Run a small graph of dependent stages, starting each one as soon as its inputs are ready.
+
+    Args:
+        stages (dict): Maps a stage name to a (dependencies, function) tuple. The function
+                       is called with the result of each dependency as a keyword argument
+                       named after that dependency.
+        executor (Executor, optional): Where stages run. Defaults to the shared stage executor.
+        timings (dict, optional): If given, filled with the wall time in seconds of each stage
+                                  and of the whole graph under "total".
+
+    Returns:
+        dict: The result of every stage, keyed by stage name.
+
+    Raises:
+        ValueError: If a dependency is unknown or the graph has a cycle.
+        Exception: The first exception raised by a stage, once running stages have finished.
+
+    Example:
+        >>> run_stages({"a": ((), lambda: 1), "b": (("a",), lambda a: a + 1)})
+        {'a': 1, 'b': 2}
+    """
+    for name, (dependencies, _) in stages.items():
+        unknown = set(dependencies) - set(stages)
+        if unknown:
+            raise ValueError(f"Stage {name} depends on unknown stages: {sorted(unknown)}")
+
+    executor = executor or get_stage_executor()
+    start = time.perf_counter()
+    results = {}
+    running = {}
+    pending = dict(stages)
+
+    def timed(name, fn, kwargs):
+        stage_start = time.perf_counter()
+        try:
+            return fn(**kwargs)
+        finally:
+            if timings is not None:
+                timings[name] = time.perf_counter() - stage_start
+
+    while pending or running:
+        for name, (dependencies, fn) in list(pending.items()):
+            if all(dependency in results for dependency in dependencies):
+                kwargs = {dependency: results[dependency] for dependency in dependencies}
+                running[executor.submit(run_in_context(timed), name, fn, kwargs)] = name
+                del pending[name]
+        if not running:
+            raise ValueError(f"Stages cannot be scheduled, check for cycles: {sorted(pending)}")
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            error = future.exception()
+            if error is not None:
+                wait(running)
+                raise error
+            results[name] = future.result()
+
+    if timings is not None:
+        timings["total"] = time.perf_counter() - start
+    return results
@@ -0,0 +1,248 @@
+import csv
+import io
+import re
+import numpy as np
+from API.Backend.config import TABLE_ROW_TOLERANCE, TABLE_COLUMN_GAP
+
+# Boxes wider than this fraction of the table (titles, merged cells) do not define columns.
+SPANNING_BOX_FRACTION = 0.5
+
+# Header keywords per line item field, for the OCR languages in use (fr, es, en).
+HEADER_KEYWORDS = {
+    "quantity": ("qty", "quantity", "qté", "qte", "quantité", "quantite", "cantidad", "cant."),
+    "unit_price": ("unit price", "price", "prix", "p.u", "pu ht", "precio", "rate"),
+    "total": ("total", "amount", "montant", "importe"),
+    "description": ("description", "désignation", "designation", "descripción", "descripcion", "article",
+                    "item", "libellé", "libelle", "concepto", "producto"),
+}
+NUMERIC_FIELDS = ("quantity", "unit_price", "total")
+# Labels of summary rows other than totals, which are recognized through the "total" header keywords.
+SUMMARY_KEYWORDS = ("tva", "vat", "tax", "iva", "impuesto")
+# Digits with at most one kind of thousands separator, grouped by three, and a decimal part after a different one.
+NUMBER_RE = re.compile(r"-?(?:\d{1,3}([.,])\d{3}(?:\1\d{3})*|\d+)(?:(?!\1)[.,]\d+)?")
+
+def build_table_grid(entries, row_tolerance=TABLE_ROW_TOLERANCE, column_gap=TABLE_COLUMN_GAP):
+    """
+    Rebuild the row/column grid of a table from its OCR boxes.
+
+    Rows are found by sorting the box centers vertically and starting a new
+    row wherever consecutive centers are further apart than `row_tolerance`
+    text heights. Columns are found by merging the horizontal extents of the
+    boxes: a new column starts wherever a box begins more than `column_gap`
+    text heights to the right of everything seen so far. Boxes spanning most
+    of the table are left out of the column search and placed in the column
+    where they start.
+
+    Args:
+        entries (list): OCR results of one region from `extract_text(..., return_boxes=True)`,
+                        i.e. dictionaries with "text", "confidence" and "box" (x1, y1, x2, y2).
+        row_tolerance (float, optional): Row separation in multiples of the median text height.
+        column_gap (float, optional): Column separation in multiples of the median text height.
+
+    Returns:
+        dict: "rows" and "columns" counts and "cells", a list of rows of cell strings.
+              Texts sharing a cell are joined with a space from left to right.
+
+    Example:
+        >>> build_table_grid([
+        ...     {"text": "Qty", "confidence": 0.9, "box": [10, 0, 40, 10]},
+        ...     {"text": "Price", "confidence": 0.9, "box": [80, 0, 120, 10]},
+        ...     {"text": "2", "confidence": 0.9, "box": [10, 20, 20, 30]},
+        ...     {"text": "9.50", "confidence": 0.9, "box": [80, 20, 110, 30]},
+        ... ])
+        {'rows': 2, 'columns': 2, 'cells': [['Qty', 'Price'], ['2', '9.50']]}
+    """
+    entries = [entry for entry in entries if entry.get("box") is not None and entry["text"].strip()]
+    if not entries:
+        return {"rows": 0, "columns": 0, "cells": []}
+
+    boxes = np.asarray([entry["box"] for entry in entries], dtype=np.float64)
+    text_height = max(float(np.median(boxes[:, 3] - boxes[:, 1])), 1.0)
+
+    # Rows: split the sorted vertical centers at large gaps.
+    centers = (boxes[:, 1] + boxes[:, 3]) / 2
+    order = np.argsort(centers, kind="stable")
+    new_row = np.diff(centers[order]) > row_tolerance * text_height
+    rows = np.empty(len(entries), dtype=np.intp)
+    rows[order] = np.concatenate([[0], np.cumsum(new_row)])
+
+    # Columns: merge overlapping horizontal extents of the narrow boxes.
+    table_width = boxes[:, 2].max() - boxes[:, 0].min()
+    narrow = boxes[(boxes[:, 2] - boxes[:, 0]) <= SPANNING_BOX_FRACTION * table_width]
+    if not len(narrow):
+        narrow = boxes
+    narrow = narrow[np.argsort(narrow[:, 0], kind="stable")]
+    reach = np.maximum.accumulate(narrow[:, 2])
+    starts_column = narrow[1:, 0] > reach[:-1] + column_gap * text_height
+    column_starts = np.concatenate([narrow[:1, 0], narrow[1:, 0][starts_column]])
+    columns = np.clip(np.searchsorted(column_starts, boxes[:, 0], side="right") - 1, 0, None)
+
+    row_count, column_count = int(rows.max()) + 1, len(column_starts)
+    cells = [[[] for _ in range(column_count)] for _ in range(row_count)]
+    for i in np.lexsort((boxes[:, 0], columns, rows)):
+        cells[rows[i]][columns[i]].append(entries[i]["text"].strip())
+    return {
+        "rows": row_count,
+        "columns": column_count,
+        "cells": [[" ".join(texts) for texts in row] for row in cells],
+    }
+
+def strip_boxes(region_texts):
+    """
+    Drop the OCR boxes from `extract_text(..., return_boxes=True)` output.
+
+    Args:
+        region_texts (dict): Region number to list of {"text", "confidence", "box"} dictionaries.
+
+    Returns:
+        dict: The same structure with only "text" and "confidence", as `extract_text` returns by default.
+    """
+    return {
+        number: [{"text": entry["text"], "confidence": entry["confidence"]} for entry in entries]
+        for number, entries in region_texts.items()
+    }
+
+def grid_to_csv(grid):
+    """
+    Serialize a table grid as CSV, the most compact form to put in a prompt.
+
+    Args:
+        grid (dict): A grid from `build_table_grid`.
+
+    Returns:
+        str: The CSV text, one line per row.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerows(grid["cells"])
+    return output.getvalue()
+
+def parse_number(text):
+    """
+    Parse an amount or quantity written with either decimal convention.
+
+    Args:
+        text (str): The cell text, e.g. "1.234,50 €", "$1,234.50" or "2".
+
+    Returns:
+        float or None: The number, or None if the text holds no well-formed number.
+    """
+    cleaned = re.sub(r"[^\d,.\-]", "", text)
+    if not NUMBER_RE.fullmatch(cleaned):
+        # No number, or a malformed one such as "1.5." or "1.2.3".
+        return None
+    if "," in cleaned and "." in cleaned:
+        # The separator used last is the decimal one.
+        thousands = "." if cleaned.rfind(",") > cleaned.rfind(".") else ","
+        cleaned = cleaned.replace(thousands, "").replace(",", ".")
+    elif "," in cleaned:
+        # "1,234" groups thousands, "12,50" is a decimal comma.
+        decimals = cleaned.rpartition(",")[2]
+        cleaned = cleaned.replace(",", "") if len(decimals) == 3 else cleaned.replace(",", ".")
+    elif cleaned.count(".") > 1:
+        cleaned = cleaned.replace(".", "")
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+def match_header(cell):
+    """
+    Map a header cell to a line item field.
+
+    Args:
+        cell (str): The header text.
+
+    Returns:
+        str or None: "description", "quantity", "unit_price", "total", or None.
+    """
+    text = cell.lower()
+    for field, keywords in HEADER_KEYWORDS.items():
+        if field == "unit_price" and any(keyword in text for keyword in HEADER_KEYWORDS["total"]):
+            continue
+        if any(keyword in text for keyword in keywords):
+            return field
+    return None
+
+def is_summary(description):
+    """
+    Tell whether a row description labels a total or a tax rather than an item.
+
+    Args:
+        description (str): The description cell text.
+
+    Returns:
+        bool: True for summary rows such as "Total HT" or "TVA 20%".
+    """
+    text = description.lower()
+    return bool(text) and (match_header(text) == "total" or any(re.search(rf"\b{keyword}\b", text) for keyword in SUMMARY_KEYWORDS))
+
+def parse_line_items(grid):
+    """
+    Read line items from a table grid without a language model.
+
+    The header is the first row in which at least two cells name a line item
+    field. Every following row with a description or a number becomes an item;
+    rows labelled as a total or a tax are summary lines and are skipped.
+
+    Args:
+        grid (dict): A grid from `build_table_grid`.
+
+    Returns:
+        list: Line items as dictionaries with "description", "quantity", "unit_price" and "total"
+              keys, for the columns the table has. Empty if no header is recognized.
+    """
+    return split_rows(grid)[0]
+
+def summary_rows(grid):
+    """
+    Return the rows of a table grid that are not line items: totals, taxes, dates and notes.
+
+    Args:
+        grid (dict): A grid from `build_table_grid`.
+
+    Returns:
+        list: The rows, as lists of cell texts, that `parse_line_items` skips apart from the header.
+              Every row if no header is recognized.
+    """
+    return split_rows(grid)[1]
+
+def split_rows(grid):
+    """
+    Split a table grid into line items and the other rows, see `parse_line_items` and `summary_rows`.
+
+    Args:
+        grid (dict): A grid from `build_table_grid`.
+
+    Returns:
+        tuple: A tuple containing:
+            - line_items (list): The parsed line items.
+            - other_rows (list): The rows before the header and the rows that are not items.
+    """
+    cells = grid["cells"]
+    for header_index, row in enumerate(cells):
+        fields = [match_header(cell) for cell in row]
+        if sum(field is not None for field in fields) >= 2:
+            break
+    else:
+        return [], [row for row in cells if any(row)]
+
+    line_items = []
+    other_rows = [row for row in cells[:header_index] if any(row)]
+    for row in cells[header_index + 1:]:
+        item = {}
+        for field, cell in zip(fields, row):
+            if field is None or not cell:
+                continue
+            if field in NUMERIC_FIELDS:
+                value = parse_number(cell)
+                if value is not None:
+                    item[field] = value
+            else:
+                item[field] = item[field] + " " + cell if field in item else cell
+        if not item or is_summary(item.get("description", "")):
+            if any(row):
+                other_rows.append(row)
+            continue
+        line_items.append(item)
+    return line_items, other_rows
@@ -0,0 +1,114 @@
+import os
+import random
+from typing import Iterable, List, Tuple
+import spacy
+from spacy.tokens import DocBin
+from spacy.util import filter_spans
+from data_annotation import find_entity_spans, read_checkpoint
+
+"""
+This module turns annotated invoices into spaCy v3 training corpora.
+
+The annotations are converted once into binary `DocBin` files, which `spacy train` and
+`ner_training.train_from_config` read directly, instead of re-tokenizing the raw text
+on every training run.
+
+Key functions:
+- make_doc(): Builds a Doc with entity spans for every occurrence of every annotated value
+- build_corpus(): Splits training data into train/dev DocBin files
+- build_corpus_from_checkpoint(): Builds the corpus straight from a data_annotation JSONL checkpoint
+"""
+
+def make_doc(nlp, text: str, entities: List[Tuple[int, int, str]]):
+    """
+    Tokenize a text and attach its entities.
+
+    Spans must start and end on token boundaries: a span that falls inside a token is
+    dropped rather than expanded, which would label the neighbouring characters too.
+    Overlapping spans are reduced to the longest ones. `build_corpus` reports how many
+    spans were dropped.
+
+    Parameters:
+    nlp (Language): A pipeline whose tokenizer is used, e.g. spacy.blank("fr").
+    text (str): The invoice text.
+    entities (list): (start, end, label) character spans.
+
+    Returns:
+    Doc: The tokenized text with its entities set.
+    """
+    doc = nlp.make_doc(text)
+    spans = []
+    for start, end, label in entities:
+        span = doc.char_span(start, end, label=label, alignment_mode="strict")
+        if span is not None:
+            spans.append(span)
+    doc.ents = filter_spans(spans)
+    return doc
+
+def build_corpus(training_data: Iterable[tuple], output_dir: str, lang: str = "fr",
+                 dev_fraction: float = 0.2, seed: int = 0) -> Tuple[str, str]:
+    """
+    Write training data to train.spacy and dev.spacy DocBin files.
+
+    Parameters:
+    training_data (iterable): (text, {"entities": [(start, end, label), ...]}) tuples, as returned
+                              by `data_annotation.prepare_training_data`.
+    output_dir (str): Where the two files are written.
+    lang (str, optional): The language of the tokenizer. Defaults to French.
+    dev_fraction (float, optional): The share of examples held out for evaluation.
+    seed (int, optional): The seed of the train/dev split, so corpora are reproducible.
+
+    Returns:
+    tuple: The paths of the train and dev files.
+    """
+    nlp = spacy.blank(lang)
+    rng = random.Random(seed)
+    train, dev = DocBin(), DocBin()
+    counts = {"train": 0, "dev": 0}
+    dropped = 0
+    for text, annotations in training_data:
+        doc = make_doc(nlp, text, annotations["entities"])
+        dropped += len(annotations["entities"]) - len(doc.ents)
+        split = "dev" if rng.random() < dev_fraction else "train"
+        (dev if split == "dev" else train).add(doc)
+        counts[split] += 1
+
+    os.makedirs(output_dir, exist_ok=True)
+    train_path = os.path.join(output_dir, "train.spacy")
+    dev_path = os.path.join(output_dir, "dev.spacy")
+    train.to_disk(train_path)
+    dev.to_disk(dev_path)
+    print(f"Corpus written to {output_dir}: {counts['train']} train and {counts['dev']} dev documents")
+    if dropped:
+        print(f"Dropped {dropped} entity spans not aligned with tokens or overlapping longer ones")
+    return train_path, dev_path
+
+def build_corpus_from_checkpoint(checkpoint_path: str, output_dir: str, **kwargs) -> Tuple[str, str]:
+    """
+    Build the corpus from a `data_annotation.batch_process` checkpoint, without the manual review step.
+
+    Parameters:
+    checkpoint_path (str): The JSONL checkpoint.
+    output_dir (str): Where the DocBin files are written.
+    **kwargs: Passed on to `build_corpus`.
+
+    Returns:
+    tuple: The paths of the train and dev files.
+    """
+    examples = (
+        (entry["text"], {"entities": find_entity_spans(entry["text"], entry["annotations"])})
+        for entry in read_checkpoint(checkpoint_path)
+        if isinstance(entry.get("annotations"), dict)
+    )
+    return build_corpus(examples, output_dir, **kwargs)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build spaCy DocBin corpora from an annotation checkpoint")
+    parser.add_argument("checkpoint", help="JSONL checkpoint written by data_annotation.batch_process")
+    parser.add_argument("output_dir")
+    parser.add_argument("--lang", default="fr")
+    parser.add_argument("--dev-fraction", type=float, default=0.2)
+    args = parser.parse_args()
+    build_corpus_from_checkpoint(args.checkpoint, args.output_dir, lang=args.lang, dev_fraction=args.dev_fraction)
@@ -1,8 +1,11 @@
 import google.generativeai as genai
 import os
 import json
+import re
+import threading
 import time
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 import tenacity
 
 """
@@ -10,27 +13,32 @@ This module provides functionality for annotating invoice data using Google's Ge
 
 The module includes functions for:
 1. Configuring the API and setting up the generative model
-2. Processing text data in batches to extract entities
+2. Processing text data in concurrent, rate-limited batches to extract entities, with a resumable JSONL checkpoint
 3. Reviewing and editing annotations
 4. Preparing the annotated data for training a Named Entity Recognition (NER) model
 
 Key functions:
 - configure_api(): Sets up the Google Generative AI model
-- generate_with_retry(): Generates content with retry logic
-- batch_process(): Processes texts in batches to extract entities
+- generate(): Generates content and parses the JSON response
+- batch_process(): Streams texts in concurrent batches to extract entities, appending results to a checkpoint
 - review_annotations(): Allows manual review and editing of annotations
 - prepare_training_data(): Prepares the final training data for NER
 - load_and_annotate_data(): Main function to load, annotate, and prepare training data
 
 The module uses error handling, rate limiting, and retry logic to ensure robust processing of large datasets.
+Failed batches are split and retried instead of dropped, and the model backend is pluggable
+(GeminiBackend, or FakeBackend for offline tests).
 """
 
+ANNOTATION_WORKERS = int(os.getenv("ANNOTATION_WORKERS", "4"))
+ANNOTATION_RATE = float(os.getenv("ANNOTATION_RATE", "1.0"))  # batch requests per second
+ANNOTATION_ATTEMPTS = int(os.getenv("ANNOTATION_ATTEMPTS", "3"))  # tries per request before a batch is split
+
 def configure_api():
     genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
     return genai.GenerativeModel('gemini-pro')
 
-@tenacity.retry(stop=tenacity.stop_after_attempt(3), wait=tenacity.wait_exponential(multiplier=1, min=4, max=10))
-def generate_with_retry(model, prompt):
+def generate(model, prompt):
     try:
         response = model.generate_content(prompt)
         return json.loads(response.text)
@@ -38,23 +46,178 @@ def generate_with_retry(model, prompt):
         print(f"Error generating content: {e}")
         raise
 
-def batch_process(model, texts: List[str], batch_size: int = 10) -> List[Dict[str, str]]:
-    all_annotations = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
+class GeminiBackend:
+    """Annotates batches of invoice texts with a Gemini model, one prompt per batch."""
+
+    def __init__(self, model=None):
+        self.model = model or configure_api()
+
+    def annotate_batch(self, texts: List[str]) -> List[Dict[str, str]]:
         prompt = "Process the following invoices and extract entities:\n\n"
-        prompt += "\n---\n".join(batch)
+        prompt += "\n---\n".join(texts)
         prompt += "\n\nRespond with a list of JSON objects, one for each invoice."
+        return generate(self.model, prompt)
+
+class FakeBackend:
+    """Offline backend for tests: annotates each text with the given function, or with nothing."""
+
+    def __init__(self, annotate: Optional[Callable[[str], Dict[str, str]]] = None, latency: float = 0.0):
+        self.annotate = annotate or (lambda text: {})
+        self.latency = latency
+
+    def annotate_batch(self, texts: List[str]) -> List[Dict[str, str]]:
+        time.sleep(self.latency)
+        return [self.annotate(text) for text in texts]
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second on average, bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def iter_texts(data_path: str, done: Set[int]) -> Iterator[Tuple[int, str]]:
+    # Stream the input one line at a time, skipping lines already in the checkpoint.
+    with open(data_path, 'r') as f:
+        for index, line in enumerate(f):
+            text = line.strip()
+            if text and index not in done:
+                yield index, text
+
+def read_checkpoint(checkpoint_path: str) -> Iterator[Dict]:
+    if not os.path.exists(checkpoint_path):
+        return
+    with open(checkpoint_path, 'r') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A partial last line, see `truncate_partial_line`; its batch is simply redone.
+                continue
+
+def truncate_partial_line(checkpoint_path: str):
+    # A run killed mid-write leaves a partial last line. Cut it off before appending, or the
+    # next record would be written onto it and both would be unreadable.
+    if not os.path.exists(checkpoint_path):
+        return
+    with open(checkpoint_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 65536)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            print(f"Discarding a partial line at the end of {checkpoint_path}")
+            f.truncate(position)
 
+def call_backend(backend, texts: List[str], bucket: TokenBucket) -> List[Dict[str, str]]:
+    # Retry transient errors with backoff. Every attempt takes a token from the bucket, so
+    # retries count towards the rate like any other request.
+    for attempt in tenacity.Retrying(stop=tenacity.stop_after_attempt(ANNOTATION_ATTEMPTS), reraise=True,
+                                     wait=tenacity.wait_exponential(multiplier=1, min=4, max=10)):
+        with attempt:
+            bucket.acquire()
+            return backend.annotate_batch(texts)
+
+def annotate_with_split(backend, batch: List[Tuple[int, str]], bucket: TokenBucket) -> Tuple[List[Tuple[int, str, Dict]], List[int]]:
+    # Annotate a batch; if it fails or returns the wrong number of results, split it in half
+    # and retry each half, down to single texts, so one bad invoice cannot sink its neighbours.
+    try:
+        annotations = call_backend(backend, [text for _, text in batch], bucket)
+        if not isinstance(annotations, list) or len(annotations) != len(batch):
+            raise ValueError(f"Expected {len(batch)} annotations, got {len(annotations) if isinstance(annotations, list) else type(annotations).__name__}")
+        return [(index, text, annotation) for (index, text), annotation in zip(batch, annotations)], []
+    except Exception as e:
+        if len(batch) == 1:
+            print(f"Failed to annotate line {batch[0][0]}: {e}")
+            return [], [batch[0][0]]
+        print(f"Batch of {len(batch)} starting at line {batch[0][0]} failed, splitting: {e}")
+        middle = len(batch) // 2
+        left, left_failed = annotate_with_split(backend, batch[:middle], bucket)
+        right, right_failed = annotate_with_split(backend, batch[middle:], bucket)
+        return left + right, left_failed + right_failed
+
+def batch_process(backend, data_path: str, checkpoint_path: str, batch_size: int = 10,
+                  workers: int = ANNOTATION_WORKERS, rate: float = ANNOTATION_RATE) -> Dict[str, int]:
+    """
+    Annotate every line of `data_path` concurrently, appending results to a JSONL checkpoint.
+
+    Lines already in the checkpoint are skipped, so an interrupted run resumes where it
+    stopped; a partial last line left by the interruption is truncated first. At most
+    `workers` batches are in flight, so memory stays bounded regardless of the input size,
+    and requests, retries included, are spaced by a token bucket of `rate` per second.
+    Lines that still fail on their own are reported and left out of the checkpoint, so the
+    next run retries them.
+
+    Any other error, such as a failed checkpoint write, stops the run: no more batches are
+    submitted, it is counted under "errors" and the first one is raised once the batches in
+    flight are done.
+    """
+    truncate_partial_line(checkpoint_path)
+    done = {entry["index"] for entry in read_checkpoint(checkpoint_path)}
+    bucket = TokenBucket(rate, capacity=workers)
+    write_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(workers)
+    stats = {"skipped": len(done), "annotated": 0, "failed": 0}
+    errors = []
+
+    def run(batch):
         try:
-            batch_annotations = generate_with_retry(model, prompt)
-            all_annotations.extend(batch_annotations)
+            results, failed = annotate_with_split(backend, batch, bucket)
+            with write_lock:
+                for index, text, annotation in results:
+                    checkpoint.write(json.dumps({"index": index, "text": text, "annotations": annotation}) + "\n")
+                checkpoint.flush()
+                stats["annotated"] += len(results)
+                stats["failed"] += len(failed)
         except Exception as e:
-            print(f"Failed to process batch starting at index {i}: {e}")
+            with write_lock:
+                errors.append(e)
+        finally:
+            in_flight.release()
 
-        time.sleep(1)  # Rate limiting
+    with open(checkpoint_path, 'a') as checkpoint, ThreadPoolExecutor(max_workers=workers) as executor:
+        batch = []
+        for item in iter_texts(data_path, done):
+            batch.append(item)
+            if len(batch) == batch_size:
+                in_flight.acquire()
+                if errors:
+                    break
+                executor.submit(run, batch)
+                batch = []
+        else:
+            if batch:
+                in_flight.acquire()
+                if not errors:
+                    executor.submit(run, batch)
 
-    return all_annotations
+    if errors:
+        stats["errors"] = len(errors)
+        print(f"Annotation stopped: {stats}")
+        raise errors[0]
+    print(f"Annotation finished: {stats}")
+    return stats
 
 def review_annotations(text: str, annotations: Dict[str, str]) -> Dict[str, str]:
     print(f"Text: {text}")
@@ -75,20 +238,41 @@ def review_annotations(text: str, annotations: Dict[str, str]) -> Dict[str, str]
         else:
             print("Invalid input. Please try again.")
 
+# A value must not continue a word, including through a "-", "/" or "." glued to it
+TOKEN_START = r"(?<!\w)(?<!\w[\-/.])"
+TOKEN_END = r"(?!\w)(?![\-/.]\w)"
+
+def find_entity_spans(text: str, annotations: Dict[str, str]) -> List[Tuple[int, int, str]]:
+    # Every whole-token occurrence of every annotated value, as (start, end, label), so "12"
+    # matches neither inside "2012" nor in "INV-12", "12/03" or "12.50". Where occurrences
+    # overlap, the longer value wins, so the spans are valid NER entities.
+    candidates = []
+    for label, value in annotations.items():
+        if not value:
+            continue
+        for match in re.finditer(rf"{TOKEN_START}{re.escape(str(value))}{TOKEN_END}", text):
+            candidates.append((match.start(), match.end(), label))
+    candidates.sort(key=lambda span: (span[0] - span[1], span[0]))
+    spans, taken = [], []
+    for start, end, label in candidates:
+        if all(end <= other_start or start >= other_end for other_start, other_end in taken):
+            spans.append((start, end, label))
+            taken.append((start, end))
+    return sorted(spans)
+
 def prepare_training_data(texts: List[str], annotations: List[Dict[str, str]]) -> List[tuple]:
     training_data = []
     for text, anno in zip(texts, annotations):
         reviewed_anno = review_annotations(text, anno)
         if reviewed_anno:
-            entities = [(text.index(v), text.index(v) + len(v), k) for k, v in reviewed_anno.items()]
-            training_data.append((text, {"entities": entities}))
+            training_data.append((text, {"entities": find_entity_spans(text, reviewed_anno)}))
     return training_data
 
-def load_and_annotate_data(data_path: str) -> List[tuple]:
-    model = configure_api()
-
-    with open(data_path, 'r') as f:
-        texts = [line.strip() for line in f]
+def load_and_annotate_data(data_path: str, checkpoint_path: Optional[str] = None, backend=None) -> List[tuple]:
+    checkpoint_path = checkpoint_path or data_path + ".annotations.jsonl"
+    batch_process(backend or GeminiBackend(), data_path, checkpoint_path)
 
-    raw_annotations = batch_process(model, texts)
-    return prepare_training_data(texts, raw_annotations)
+    entries = sorted(read_checkpoint(checkpoint_path), key=lambda entry: entry["index"])
+    texts = [entry["text"] for entry in entries]
+    annotations = [entry["annotations"] for entry in entries]
+    return prepare_training_data(texts, annotations)
@@ -0,0 +1,398 @@
+import os
+import re
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from API.Backend.table_structure import parse_line_items, parse_number
+
+"""
+This module structures invoice results locally, without a language model.
+
+It combines three sources of candidate values for each field of the `structure_invoice`
+schema used by `llm.call_llm`:
+1. The spaCy NER model written to disk by `ner_training.train_ner`, if it exists
+2. Regular expressions with date and amount parsers for the French, Spanish and English
+   wording the OCR languages cover
+3. The `donut_extraction` output of the page
+4. The first lines of the topmost paragraph, for the issuer's name
+
+Candidates that agree on the same normalized value reinforce each other, and every field
+gets a confidence between 0 and 1 so callers can send only the uncertain fields to the LLM.
+
+Key functions:
+- FieldExtractor.extract(): Structures one /upload_invoice result and returns per-field confidences
+- parse_date(): Parses dates in numeric or written form into ISO 8601
+- low_confidence_fields(): Lists the fields that still need the LLM
+"""
+
+NER_MODEL_DIR = os.getenv("NER_MODEL_DIR", "./ner_model")
+FIELD_CONFIDENCE_THRESHOLD = float(os.getenv("FIELD_CONFIDENCE_THRESHOLD", "0.8"))
+
+SCHEMA_FIELDS = ["company_name", "invoice_number", "date", "due_date", "total_amount", "currency", "billing_address"]
+REQUIRED_FIELDS = ["company_name", "invoice_number", "date", "total_amount"]
+
+# Base confidence of each source, before agreement between sources is taken into account.
+# No single source other than an exact match reaches FIELD_CONFIDENCE_THRESHOLD on its own:
+# a labelled regex hit needs a second source (NER, Donut, another regex or the header) to be trusted.
+SOURCE_CONFIDENCE = {"ner": 0.75, "donut": 0.7, "regex_exact": 0.85, "regex": 0.6, "regex_weak": 0.5, "header": 0.5}
+
+NER_LABEL_FIELDS = {
+    "INVOICE_NUMBER": "invoice_number",
+    "DATE": "date",
+    "TOTAL_AMOUNT": "total_amount",
+    "COMPANY_NAME": "company_name",
+    "ADDRESS": "billing_address",
+}
+
+# Substrings of Donut output keys, checked in order, and the field they map to.
+DONUT_KEY_FIELDS = [
+    ("due", "due_date"),
+    ("date", "date"),
+    ("invoice_n", "invoice_number"),
+    ("invoice_id", "invoice_number"),
+    ("number", "invoice_number"),
+    ("total", "total_amount"),
+    ("amount", "total_amount"),
+    ("currency", "currency"),
+    ("company", "company_name"),
+    ("seller", "company_name"),
+    ("vendor", "company_name"),
+    ("address", "billing_address"),
+]
+
+MONTHS = {
+    "jan": 1, "january": 1, "janv": 1, "janvier": 1, "enero": 1, "ene": 1,
+    "feb": 2, "february": 2, "févr": 2, "fevr": 2, "février": 2, "fevrier": 2, "febrero": 2,
+    "mar": 3, "march": 3, "mars": 3, "marzo": 3,
+    "apr": 4, "april": 4, "avr": 4, "avril": 4, "abril": 4, "abr": 4,
+    "may": 5, "mai": 5, "mayo": 5,
+    "jun": 6, "june": 6, "juin": 6, "junio": 6,
+    "jul": 7, "july": 7, "juil": 7, "juillet": 7, "julio": 7,
+    "aug": 8, "august": 8, "août": 8, "aout": 8, "agosto": 8, "ago": 8,
+    "sep": 9, "sept": 9, "september": 9, "septembre": 9, "septiembre": 9,
+    "oct": 10, "october": 10, "octobre": 10, "octubre": 10,
+    "nov": 11, "november": 11, "novembre": 11, "noviembre": 11,
+    "dec": 12, "december": 12, "déc": 12, "décembre": 12, "decembre": 12, "diciembre": 12, "dic": 12,
+}
+MONTH_PATTERN = "|".join(sorted((re.escape(name) for name in MONTHS), key=len, reverse=True))
+DATE_PATTERN = (
+    r"\d{4}-\d{1,2}-\d{1,2}"
+    r"|\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}"
+    rf"|\d{{1,2}}\s+(?:de\s+)?(?:{MONTH_PATTERN})\.?\s+(?:de\s+)?\d{{4}}"
+    rf"|(?:{MONTH_PATTERN})\.?\s+\d{{1,2}},?\s+\d{{4}}"
+)
+AMOUNT_PATTERN = r"-?(?:[$€£]\s*)?\d{1,3}(?:[\s.,]?\d{3})*(?:[.,]\d{1,2})?(?:\s*(?:[$€£]|EUR|USD|GBP))?"
+
+INVOICE_NUMBER_RE = re.compile(
+    r"(?:invoice|facture|factura)\s*(?:no\.?|n[°ºo]\.?|number|num(?:[ée]ro)?|#)?\s*[:#]?\s*([A-Z0-9][A-Z0-9\-/_.]{2,})",
+    re.IGNORECASE,
+)
+DATE_LABEL_RE = re.compile(
+    rf"(?:invoice date|date de facture|date de facturation|fecha de (?:la )?factura|fecha|date)\s*[:\-]?\s*({DATE_PATTERN})",
+    re.IGNORECASE,
+)
+DUE_DATE_RE = re.compile(
+    rf"(?:due date|payment due|date d'[ée]ch[ée]ance|[ée]ch[ée]ance|fecha de vencimiento|vencimiento)\s*[:\-]?\s*({DATE_PATTERN})",
+    re.IGNORECASE,
+)
+ANY_DATE_RE = re.compile(DATE_PATTERN, re.IGNORECASE)
+TOTAL_RE = re.compile(
+    rf"(?:total\s*(?:ttc|due|a pagar|à payer|amount)?|amount due|net [àa] payer|importe total)\s*[:\-]?\s*({AMOUNT_PATTERN})",
+    re.IGNORECASE,
+)
+CURRENCY_RE = re.compile(r"(€|\$|£|\bEUR\b|\bUSD\b|\bGBP\b)")
+CURRENCY_CODES = {"€": "EUR", "$": "USD", "£": "GBP", "EUR": "EUR", "USD": "USD", "GBP": "GBP"}
+COMPANY_RE = re.compile(
+    r"^(.{2,80}?\b(?:SARL|SAS|SASU|S\.A\.S?\.?|SA|S\.L\.?|SL|EURL|Ltd\.?|LLC|Inc\.?|GmbH)\b\.?)",
+    re.IGNORECASE | re.MULTILINE,
+)
+ADDRESS_RE = re.compile(r"^(.*\d+.*\b\d{5}\b.*)$", re.MULTILINE)
+# A four-digit year is as likely the start of a date as an invoice number.
+YEAR_RE = re.compile(r"(?:19|20)\d{2}")
+# Amounts written with cents or a currency, as grand totals are, rather than bare counts.
+FORMATTED_AMOUNT_RE = re.compile(r"[.,]\d{2}\b|[$€£]|EUR|USD|GBP")
+# Header lines that are labels, contact details or identifiers rather than the issuer's name.
+HEADER_SKIP_RE = re.compile(
+    r"\b(?:invoice|facture|factura|date|fecha|total|page|p[aá]gina|t[ée]l|tel[ée]fono|phone|fax|e-?mail"
+    r"|siret|siren|tva|vat|nif|cif|iban)\b|@|www\.|https?:",
+    re.IGNORECASE,
+)
+# Number of OCR lines at the top of the page searched for the issuer's name.
+HEADER_LINES = 3
+
+def parse_date(text: str) -> Optional[str]:
+    """
+    Parse a date written in numeric or written form.
+
+    Numeric dates are read day first, as on French and Spanish invoices, unless the
+    second number cannot be a month.
+
+    Parameters:
+    text (str): The date text, e.g. "12/03/2024", "2024-03-12", "12 mars 2024" or "March 12, 2024".
+
+    Returns:
+    str or None: The date in ISO 8601 format, or None if it cannot be parsed.
+    """
+    text = text.strip().lower()
+    try:
+        match = re.fullmatch(r"(\d{4})-(\d{1,2})-(\d{1,2})", text)
+        if match:
+            return date(int(match[1]), int(match[2]), int(match[3])).isoformat()
+        match = re.fullmatch(r"(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{2,4})", text)
+        if match:
+            day, month, year = int(match[1]), int(match[2]), int(match[3])
+            if month > 12:
+                day, month = month, day
+            if year < 100:
+                year += 2000
+            return date(year, month, day).isoformat()
+        match = re.fullmatch(rf"(\d{{1,2}})\s+(?:de\s+)?({MONTH_PATTERN})\.?\s+(?:de\s+)?(\d{{4}})", text)
+        if match:
+            return date(int(match[3]), MONTHS[match[2]], int(match[1])).isoformat()
+        match = re.fullmatch(rf"({MONTH_PATTERN})\.?\s+(\d{{1,2}}),?\s+(\d{{4}})", text)
+        if match:
+            return date(int(match[3]), MONTHS[match[1]], int(match[2])).isoformat()
+    except ValueError:
+        return None
+    return None
+
+def looks_like_name(line: str) -> bool:
+    """
+    Tell whether a header line can be a company name rather than a label, an address or a number.
+
+    Parameters:
+    line (str): One OCR line.
+
+    Returns:
+    bool: True if the line is mostly letters and is not a known label or contact detail.
+    """
+    letters = sum(char.isalpha() for char in line)
+    digits = sum(char.isdigit() for char in line)
+    return 2 <= letters and digits * 4 <= letters and len(line) <= 80 and not HEADER_SKIP_RE.search(line)
+
+def normalize(field: str, value) -> Optional[object]:
+    """
+    Normalize a candidate value so that equal values from different sources compare equal.
+
+    Parameters:
+    field (str): The schema field.
+    value: The raw value.
+
+    Returns:
+    The normalized value, or None if it is not valid for the field.
+    """
+    if value is None:
+        return None
+    if field in ("date", "due_date"):
+        return parse_date(str(value))
+    if field == "total_amount":
+        return value if isinstance(value, (int, float)) else parse_number(str(value))
+    if field == "currency":
+        return CURRENCY_CODES.get(str(value).strip().upper(), CURRENCY_CODES.get(str(value).strip()))
+    value = " ".join(str(value).split()).strip(" :#")
+    return value or None
+
+def low_confidence_fields(confidences: Dict[str, float], threshold: float = FIELD_CONFIDENCE_THRESHOLD) -> List[str]:
+    """
+    List the fields that should be sent to the LLM.
+
+    Required fields below the threshold are always included. Optional fields are only included
+    when a value was found but is uncertain; optional fields absent from the invoice are not.
+
+    Parameters:
+    confidences (dict): Per-field confidences from `FieldExtractor.extract`.
+    threshold (float, optional): The minimum confidence for a field to be trusted.
+
+    Returns:
+    list: The uncertain field names.
+    """
+    return [
+        field for field in SCHEMA_FIELDS
+        if confidences.get(field, 0.0) < threshold and (field in REQUIRED_FIELDS or confidences.get(field, 0.0) > 0)
+    ]
+
+class FieldExtractor:
+    """
+    Structure invoice results locally from NER, regex and Donut candidates.
+
+    The spaCy model is loaded on first use from `model_dir`; without it the extractor
+    still runs on regex and Donut candidates alone.
+    """
+
+    def __init__(self, model_dir: str = NER_MODEL_DIR):
+        self.model_dir = model_dir
+        self._nlp = None
+        self._nlp_loaded = False
+
+    @property
+    def nlp(self):
+        if not self._nlp_loaded:
+            self._nlp_loaded = True
+            if os.path.isdir(self.model_dir):
+                import spacy
+
+                # Only NER (and the tok2vec it listens to) is needed; the other components cost most of the time.
+                self._nlp = spacy.load(self.model_dir, disable=["parser", "lemmatizer", "morphologizer", "attribute_ruler", "senter"])
+            else:
+                print(f"No NER model found in {self.model_dir}, using regex and Donut candidates only")
+        return self._nlp
+
+    def invoice_text(self, result: Dict) -> str:
+        """
+        Join the paragraph and table texts of a result into one text, one region per line.
+
+        Parameters:
+        result (dict): An /upload_invoice result.
+
+        Returns:
+        str: The invoice text.
+        """
+        lines = []
+        for key in ("paragraphs", "tables"):
+            for entries in result.get(key, {}).values():
+                line = " ".join(entry["text"] for entry in entries)
+                if line:
+                    lines.append(line)
+        return "\n".join(lines)
+
+    def header_lines(self, result: Dict) -> List[str]:
+        """
+        Return the first OCR lines of the topmost paragraph of the page, where invoices print the issuer.
+
+        Parameters:
+        result (dict): An /upload_invoice result, or one of its pages.
+
+        Returns:
+        list: Up to HEADER_LINES lines, empty when the result has no paragraphs.
+        """
+        paragraphs = result.get("paragraphs", {})
+        regions = result.get("regions")
+        if regions is None and result.get("pages"):
+            regions = result["pages"][0].get("regions")
+        # Region numbers follow detection order; the boxes give the reading order.
+        numbers = [region["number"] for region in sorted(regions or [], key=lambda region: (region["box"][1], region["box"][0]))
+                   if region["label"] == "Paragraph"]
+        for number in numbers or list(paragraphs):
+            entries = paragraphs.get(number) or paragraphs.get(str(number))
+            if entries:
+                return [entry["text"].strip() for entry in entries[:HEADER_LINES]]
+        return []
+
+    def header_candidates(self, result: Dict) -> List[Tuple[str, object, str]]:
+        for line in self.header_lines(result):
+            if looks_like_name(line):
+                # Keep only the name when the line goes on after the legal form, as the regex does.
+                company = COMPANY_RE.search(line)
+                return [("company_name", company[1] if company else line, "header")]
+        return []
+
+    def ner_candidates(self, text: str) -> List[Tuple[str, object, str]]:
+        if self.nlp is None or not text:
+            return []
+        doc = self.nlp(text)
+        return [(NER_LABEL_FIELDS[ent.label_], ent.text, "ner") for ent in doc.ents if ent.label_ in NER_LABEL_FIELDS]
+
+    def regex_candidates(self, text: str) -> List[Tuple[str, object, str]]:
+        candidates = []
+        for match in INVOICE_NUMBER_RE.finditer(text):
+            # Require a digit so that words following "invoice" are not taken for numbers, and skip invoice dates.
+            if not re.search(r"\d", match[1]) or parse_date(match[1]):
+                continue
+            candidates.append(("invoice_number", match[1], "regex_weak" if YEAR_RE.fullmatch(match[1]) else "regex"))
+        for match in DUE_DATE_RE.finditer(text):
+            candidates.append(("due_date", match[1], "regex"))
+        due_dates = {match[1] for match in DUE_DATE_RE.finditer(text)}
+        for match in DATE_LABEL_RE.finditer(text):
+            if match[1] not in due_dates:
+                candidates.append(("date", match[1], "regex"))
+        first_date = ANY_DATE_RE.search(text)
+        if first_date:
+            candidates.append(("date", first_date[0], "regex_weak"))
+        totals = []
+        for match in TOTAL_RE.finditer(text):
+            # A bare number, or one followed by more numbers on the line ("Total 12 items 100"), is
+            # more likely a count or a column of the table than the amount.
+            rest = text[match.end():].split("\n", 1)[0]
+            formatted = FORMATTED_AMOUNT_RE.search(match[1]) and not re.search(r"\d", rest)
+            totals.append((match[1], "regex" if formatted else "regex_weak"))
+        if totals:
+            # The last total on an invoice is normally the grand total, after subtotals and taxes.
+            strong = [total for total in totals if total[1] == "regex"]
+            candidates.append(("total_amount", *(strong or totals)[-1]))
+        currencies = {CURRENCY_CODES[match[1]] for match in CURRENCY_RE.finditer(text)}
+        if len(currencies) == 1:
+            candidates.append(("currency", currencies.pop(), "regex_exact"))
+        company = COMPANY_RE.search(text)
+        if company:
+            # A legal form (SARL, S.L., Ltd...) is a labelled match like the others.
+            candidates.append(("company_name", company[1], "regex"))
+        address = ADDRESS_RE.search(text)
+        if address:
+            candidates.append(("billing_address", address[1], "regex_weak"))
+        return candidates
+
+    def donut_candidates(self, donut_result) -> List[Tuple[str, object, str]]:
+        candidates = []
+
+        def walk(value, key=""):
+            if isinstance(value, dict):
+                for child_key, child in value.items():
+                    walk(child, child_key.lower())
+            elif isinstance(value, list):
+                for child in value:
+                    walk(child, key)
+            elif value not in (None, ""):
+                for fragment, field in DONUT_KEY_FIELDS:
+                    if fragment in key:
+                        candidates.append((field, value, "donut"))
+                        break
+
+        walk(donut_result or {})
+        return candidates
+
+    def extract(self, result: Dict) -> Tuple[Dict, Dict[str, float]]:
+        """
+        Structure an /upload_invoice result into the `structure_invoice` schema.
+
+        Parameters:
+        result (dict): An /upload_invoice result, or one of its pages.
+
+        Returns:
+        tuple: A tuple containing:
+            - data (dict): The schema fields, None where no candidate was found, and "line_items"
+              parsed from the table grids.
+            - confidences (dict): A confidence between 0 and 1 for every schema field.
+
+        Note:
+        Candidates agreeing on a value combine as independent evidence: the confidence is
+        1 - prod(1 - c) over the sources that produced it. The best value per field wins.
+        """
+        text = self.invoice_text(result)
+        candidates = (self.ner_candidates(text) + self.regex_candidates(text) + self.header_candidates(result)
+                      + self.donut_candidates(result.get("donut_extraction")))
+
+        evidence = {}
+        for field, raw_value, source in candidates:
+            value = normalize(field, raw_value)
+            if value is None:
+                continue
+            sources = evidence.setdefault(field, {}).setdefault(value, {})
+            sources[source] = max(sources.get(source, 0.0), SOURCE_CONFIDENCE[source])
+
+        data, confidences = {}, {}
+        for field in SCHEMA_FIELDS:
+            best_value, best_confidence = None, 0.0
+            for value, sources in evidence.get(field, {}).items():
+                doubt = 1.0
+                for confidence in sources.values():
+                    doubt *= 1.0 - confidence
+                if 1.0 - doubt > best_confidence:
+                    best_value, best_confidence = value, 1.0 - doubt
+            data[field] = best_value
+            confidences[field] = round(best_confidence, 3)
+
+        data["line_items"] = [item for grid in result.get("table_grids", {}).values() for item in parse_line_items(grid)]
+        line_total = sum(item.get("total", 0.0) for item in data["line_items"])
+        if data["total_amount"] is not None and data["line_items"] and abs(line_total - data["total_amount"]) < 0.01:
+            # Line items adding up to the total confirm it.
+            confidences["total_amount"] = max(confidences["total_amount"], 0.95)
+        return data, confidences
@@ -1,15 +1,22 @@
 from data_annotation import load_and_annotate_data
-from ner_training import train_ner
+from corpus import build_corpus
+from ner_training import write_config, train_from_config
 
 def main():
     data_path = "path_to_your_training_data"
+    corpus_dir = "./ner_corpus"
+    config_path = "./ner_config.cfg"
     output_dir = "./ner_model"
 
     # Load and annotate data
     training_data = load_and_annotate_data(data_path)
 
-    # Train NER model
-    train_ner(training_data, output_dir)
+    # Convert the annotations to DocBin files once
+    train_path, dev_path = build_corpus(training_data, corpus_dir)
+
+    # Train NER model from the config
+    write_config(config_path)
+    train_from_config(config_path, train_path, dev_path, output_dir)
 
 if __name__ == "__main__":
     main()
@@ -1,52 +1,98 @@
-import spacy
-from spacy.tokens import DocBin
-from spacy.util import minibatch, compounding
-import random
+import os
+import shutil
+import tempfile
+from corpus import build_corpus
 
-def train_ner(train_data, output_dir, n_iter=50):
+def write_config(config_path, lang="fr", optimize="efficiency"):
     """
-    Train a Named Entity Recognition (NER) model using spaCy.
+    Generate a spaCy v3 NER training config, unless one already exists.
 
-    This function loads a pre-trained French language model, adds or gets the NER pipeline,
-    and trains it on the provided data. The training process uses minibatching and compounding
-    batch sizes for efficiency. The trained model is then saved to disk.
+    The generated file is a normal spaCy config: edit it to tune the architecture,
+    batch sizes or training schedule, and later runs will use it as is.
 
     Parameters:
-    train_data (list): A list of tuples, where each tuple contains (text, annotations) pairs.
-    output_dir (str): The directory path where the trained model will be saved.
-    n_iter (int, optional): The number of training iterations. Defaults to 50.
+    config_path (str): Where the config is written.
+    lang (str, optional): The pipeline language. Defaults to French.
+    optimize (str, optional): "efficiency" for a small CNN model, "accuracy" for a larger one.
+
+    Returns:
+    str: The config path.
+    """
+    if not os.path.exists(config_path):
+        from spacy.cli.init_config import init_config
+
+        config = init_config(lang=lang, pipeline=["ner"], optimize=optimize)
+        config.to_disk(config_path)
+        print(f"Wrote training config to {config_path}")
+    return config_path
+
+def train_from_config(config_path, train_path, dev_path, output_dir, overrides=None):
+    """
+    Train a Named Entity Recognition (NER) model from a spaCy v3 config and DocBin corpora.
+
+    Parameters:
+    config_path (str): The training config, see `write_config`.
+    train_path (str): The train.spacy file from `corpus.build_corpus`.
+    dev_path (str): The dev.spacy file from `corpus.build_corpus`.
+    output_dir (str): The directory the best model is saved to.
+    overrides (dict, optional): Extra config overrides, e.g. {"training.max_epochs": 30}.
 
-    The function prints the losses for each iteration during training and a completion message
-    when finished.
+    Returns:
+    str: The output directory.
 
     Note:
-    - The function uses a French language model ("fr_core_news_md").
-    - It adds labels for INVOICE_NUMBER, DATE, TOTAL_AMOUNT, COMPANY_NAME, and ADDRESS.
-    - The training process uses a dropout of 0.35 and shuffles the training data in each iteration.
+    spaCy writes model-best and model-last to a training directory next to `output_dir`;
+    model-best is then copied to `output_dir`, where `field_extractor.FieldExtractor` loads it.
     """
-    nlp = spacy.load("fr_core_news_md")
-    if "ner" not in nlp.pipe_names:
-        ner = nlp.add_pipe("ner", last=True)
-    else:
-        ner = nlp.get_pipe("ner")
-
-    for label in LABELS:
-        ner.add_label(label)
-
-    other_pipes = [pipe for pipe in nlp.pipe_names if pipe != "ner"]
-    with nlp.disable_pipes(*other_pipes):
-        optimizer = nlp.resume_training()
-        for itn in range(n_iter):
-            random.shuffle(train_data)
-            losses = {}
-            batches = minibatch(train_data, size=compounding(4.0, 32.0, 1.001))
-            for batch in batches:
-                texts, annotations = zip(*batch)
-                nlp.update(texts, annotations, sgd=optimizer, drop=0.35, losses=losses)
-            print(f"Losses at iteration {itn}: {losses}")
-
-    nlp.to_disk(output_dir)
+    from spacy.cli.train import train
+
+    training_dir = output_dir.rstrip("/\\") + "_training"
+    train(config_path, training_dir, overrides={"paths.train": train_path, "paths.dev": dev_path, **(overrides or {})})
+
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    shutil.copytree(os.path.join(training_dir, "model-best"), output_dir)
     print("NER model training completed and saved.")
+    return output_dir
+
+def train_ner(train_data, output_dir, n_iter=50, config_path=None):
+    """
+    Train a Named Entity Recognition (NER) model using spaCy v3.
+
+    This builds DocBin corpora from the training data, generates a config if none is given,
+    and trains with `spacy train` for at most `n_iter` epochs. The best model on the dev
+    split is saved to `output_dir`.
+
+    Parameters:
+    train_data (list): A list of tuples, where each tuple contains (text, annotations) pairs.
+    output_dir (str): The directory path where the trained model will be saved.
+    n_iter (int, optional): The maximum number of training epochs. Defaults to 50.
+    config_path (str, optional): A training config to use instead of a generated one.
+
+    Note:
+    - The generated config is for a French pipeline with a single "ner" component.
+    - The labels (INVOICE_NUMBER, DATE, TOTAL_AMOUNT, COMPANY_NAME and ADDRESS) are read from the corpus.
+    """
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        train_path, dev_path = build_corpus(train_data, corpus_dir)
+        config_path = config_path or write_config(os.path.join(corpus_dir, "config.cfg"))
+        return train_from_config(config_path, train_path, dev_path, output_dir, {"training.max_epochs": n_iter})
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the invoice NER model from DocBin corpora")
+    parser.add_argument("corpus_dir", help="Directory with train.spacy and dev.spacy from corpus.py")
+    parser.add_argument("--config", default="ner_config.cfg", help="Training config, generated if missing")
+    parser.add_argument("--output", default="./ner_model")
+    parser.add_argument("--max-epochs", type=int, default=50)
+    args = parser.parse_args()
 
-# Constants
-LABELS = ["INVOICE_NUMBER", "DATE", "TOTAL_AMOUNT", "COMPANY_NAME", "ADDRESS"]
+    write_config(args.config)
+    train_from_config(
+        args.config,
+        os.path.join(args.corpus_dir, "train.spacy"),
+        os.path.join(args.corpus_dir, "dev.spacy"),
+        args.output,
+        {"training.max_epochs": args.max_epochs},
+    )
@@ -1,5 +1,11 @@
+import csv
+import io
+import json
+import os
+import tempfile
 import pandas as pd
 from io import BytesIO
+from API.Backend.table_structure import parse_number
 
 # Create Excel from dictionary
 def create_excel_from_dict(data):
@@ -26,3 +32,170 @@ def create_excel_from_dict(data):
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
+
+# Columns of the consolidated exports
+INVOICE_COLUMNS = ["invoice_number", "company_name", "date", "due_date", "total_amount", "currency", "billing_address"]
+LINE_ITEM_COLUMNS = ["description", "quantity", "unit_price", "total"]
+# Flat exports (CSV, Parquet) repeat the invoice columns on every line item row
+FLAT_COLUMNS = INVOICE_COLUMNS + [f"line_{column}" for column in LINE_ITEM_COLUMNS]
+EXPORT_CHUNK_SIZE = 1024 * 1024
+PARQUET_ROW_GROUP_SIZE = 10000
+
+def _cell(value):
+    # Nested values are not valid cells; keep them readable as JSON
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+# Yield one flat row per line item, or a single row for invoices without line items
+def iter_flat_rows(invoices):
+    for invoice in invoices:
+        base = [_cell(invoice.get(column)) for column in INVOICE_COLUMNS]
+        line_items = invoice.get("line_items") or [{}]
+        for item in line_items:
+            yield base + [_cell(item.get(column)) for column in LINE_ITEM_COLUMNS]
+
+# Rows per xlsx worksheet, header included; xlsxwriter refuses (returns -1 for) rows past it
+XLSX_MAX_ROWS = 1048576
+
+# A worksheet that continues on a new sheet ("Line Items (2)", ...) with the same header
+# once it is full, so large exports are split instead of silently losing rows
+class _RollingSheet:
+    def __init__(self, workbook, name, header):
+        self.workbook = workbook
+        self.name = name
+        self.header = header
+        self.sheets = 0
+        self.rows = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self.sheets += 1
+        title = self.name if self.sheets == 1 else f"{self.name} ({self.sheets})"
+        self.sheet = self.workbook.add_worksheet(title)
+        self.sheet.write_row(0, 0, self.header)
+        self.row = 1
+
+    def write(self, values):
+        if self.row >= XLSX_MAX_ROWS:
+            self._new_sheet()
+        if self.sheet.write_row(self.row, 0, values) == -1:
+            raise ValueError(f"Row {self.row} of sheet {self.sheet.name} could not be written")
+        self.row += 1
+        self.rows += 1
+
+# Write invoices to an xlsx file as a stream: rows are flushed to disk as they are written
+# (xlsxwriter constant_memory mode), so memory stays flat however many invoices there are.
+# Sheets past XLSX_MAX_ROWS rows continue on numbered sheets.
+# `output` is a filename or a binary file object.
+def export_excel(invoices, output):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    details = _RollingSheet(workbook, "Invoice Details", INVOICE_COLUMNS)
+    line_items = _RollingSheet(workbook, "Line Items", ["invoice_number"] + LINE_ITEM_COLUMNS)
+
+    for invoice in invoices:
+        details.write([_cell(invoice.get(column)) for column in INVOICE_COLUMNS])
+        for item in invoice.get("line_items") or []:
+            line_items.write([_cell(invoice.get("invoice_number"))] + [_cell(item.get(column)) for column in LINE_ITEM_COLUMNS])
+    workbook.close()
+    return details.rows, line_items.rows
+
+# Yield the flat CSV export chunk by chunk, e.g. for a streaming HTTP response
+def iter_csv_chunks(invoices, chunk_size=EXPORT_CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FLAT_COLUMNS)
+    for row in iter_flat_rows(invoices):
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def export_csv(invoices, output):
+    for chunk in iter_csv_chunks(invoices):
+        output.write(chunk)
+
+# Flat columns typed as numbers in Parquet. Amounts from the LLM are often formatted strings
+# ("1 234,56 €"); values that still cannot be parsed are kept as text in a "<column>_raw" column.
+NUMERIC_COLUMNS = ("total_amount", "line_quantity", "line_unit_price", "line_total")
+
+# Write the flat export to Parquet one row group at a time, so only PARQUET_ROW_GROUP_SIZE
+# rows are held in memory. `output` is a filename or a binary file object.
+def export_parquet(invoices, output, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [(column, pa.float64() if column in NUMERIC_COLUMNS else pa.string()) for column in FLAT_COLUMNS]
+        + [(f"{column}_raw", pa.string()) for column in NUMERIC_COLUMNS]
+    )
+
+    def to_batch(rows):
+        columns = dict(zip(FLAT_COLUMNS, zip(*rows)))
+        arrays = []
+        for column in FLAT_COLUMNS:
+            if column in NUMERIC_COLUMNS:
+                arrays.append(pa.array([_to_float(value) for value in columns[column]], type=pa.float64()))
+            else:
+                arrays.append(pa.array([None if value is None else str(value) for value in columns[column]], type=pa.string()))
+        for column in NUMERIC_COLUMNS:
+            raw = [None if value in (None, "") or _to_float(value) is not None else str(value) for value in columns[column]]
+            arrays.append(pa.array(raw, type=pa.string()))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    with pq.ParquetWriter(output, schema) as writer:
+        rows = []
+        for row in iter_flat_rows(invoices):
+            rows.append(row)
+            if len(rows) == row_group_size:
+                writer.write_batch(to_batch(rows))
+                rows = []
+        if rows:
+            writer.write_batch(to_batch(rows))
+
+def _to_float(value):
+    if value in (None, "") or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return parse_number(str(value))
+
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", export_excel),
+    "csv": ("text/csv", export_csv),
+    "parquet": ("application/vnd.apache.parquet", export_parquet),
+}
+
+# Export to a file path in the format given by its extension (.xlsx, .csv or .parquet)
+def export_invoices(invoices, path):
+    export_format = os.path.splitext(path)[1].lstrip(".").lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    if export_format == "csv":
+        with open(path, "wb") as f:
+            export_csv(invoices, f)
+    else:
+        EXPORT_FORMATS[export_format][1](invoices, path)
+
+# Yield an export as bytes chunks for a streaming HTTP response. CSV is produced directly;
+# xlsx and Parquet need their footer written last, so they are spooled to a temporary file
+# (kept in memory only while small) and streamed from there.
+def stream_export(invoices, export_format="xlsx", chunk_size=EXPORT_CHUNK_SIZE):
+    if export_format == "csv":
+        yield from iter_csv_chunks(invoices, chunk_size)
+        return
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+        EXPORT_FORMATS[export_format][1](invoices, spool)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
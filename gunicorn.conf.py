@@ -0,0 +1,44 @@
+# Multi-worker serving: gunicorn -c gunicorn.conf.py API.Backend.fast_api.api:app
+#
+# With WEB_PRELOAD=1 the app is imported and the shared models (YOLO, Donut and
+# the EasyOCR readers) are loaded once in the master. The workers are forked
+# afterwards and map the same weight pages copy-on-write, so every extra worker
+# only costs its own private memory. Run `python -m API.Backend.serving <master pid>`
+# to see the RSS and PSS of the master and each worker.
+import os
+from API.Backend.config import WEB_WORKERS, WEB_PRELOAD, PIPELINE_TIMEOUT
+from API.Backend.serving import worker_thread_budget, limit_native_threads, configure_worker_threads, freeze_heap
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = WEB_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = WEB_PRELOAD
+timeout = int(PIPELINE_TIMEOUT) + 30
+graceful_timeout = 30
+
+# Each worker gets an equal share of the CPUs the container may use (affinity
+# and cgroup quota), divided again by its PIPELINE_WORKERS concurrent requests,
+# so the workers never run more native threads than there are CPUs. The
+# environment must be set before torch is imported by the preloaded app.
+worker_threads = worker_thread_budget(WEB_WORKERS)
+limit_native_threads(worker_threads)
+
+
+def when_ready(server):
+    if not WEB_PRELOAD:
+        return
+    from API.Backend.fast_api.api import app
+
+    # Only load weights here: running inference in the master would start
+    # OpenMP thread pools that the forked workers cannot use. Loading (and
+    # fusing YOLO) runs single-threaded for the same reason; each worker sets
+    # its own budget in post_fork.
+    configure_worker_threads(1)
+    if not app.state.models.preload():
+        server.log.warning("Some shared models failed to load, see the model status in /readyz")
+    freeze_heap()
+    server.log.info(f"Preloaded models, forking {WEB_WORKERS} workers with {worker_threads} threads each")
+
+
+def post_fork(server, worker):
+    configure_worker_threads(worker_threads)
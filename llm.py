@@ -1,73 +1,75 @@
-import json
 import streamlit as st
-import openai
+from llm_client import structure_invoices
+from API.Backend.table_structure import grid_to_csv, summary_rows
+from NLP.field_extractor import FieldExtractor, low_confidence_fields
 
-# Set API key for OpenAI
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+# Local extractor tried before every LLM call
+field_extractor = FieldExtractor()
 
 def call_llm(invoice_text):
-    try:
-        client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": f"Extract and structure the following invoice data: {invoice_text}"}],
-            functions=[
-                {
-                    "name": "structure_invoice",
-                    "description": "Extract and structure invoice data into a standardized format",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "company_name": {"type": "string", "description": "The name of the company issuing the invoice"},
-                            "invoice_number": {"type": "string", "description": "The unique identifier for the invoice"},
-                            "date": {"type": "string", "description": "The date of the invoice (ISO 8601 format preferred)"},
-                            "due_date": {"type": "string", "description": "The due date for payment (ISO 8601 format preferred)"},
-                            "total_amount": {"type": "number", "description": "The total amount due on the invoice"},
-                            "currency": {"type": "string", "description": "The currency used in the invoice (e.g., USD, EUR)"},
-                            "billing_address": {"type": "string", "description": "The billing address on the invoice"},
-                            "line_items": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "description": {"type": "string"},
-                                        "quantity": {"type": "number"},
-                                        "unit_price": {"type": "number"},
-                                        "total": {"type": "number"}
-                                    }
-                                },
-                                "description": "An array of items listed on the invoice"
-                            }
-                        },
-                        "required": ["company_name", "invoice_number", "date", "total_amount"]
-                    }
-                }
-            ],
-            function_call={"name": "structure_invoice"}
-        )
-
-        print("Full API Response:", response)
+    return call_llm_many([invoice_text])[0]
 
-        if response.choices and response.choices[0].message.function_call:
-            try:
-                result = json.loads(response.choices[0].message.function_call.arguments)
-                print("LLM Result Type:", type(result))
-                print("LLM Result Content:", result)
-                return result
-            except json.JSONDecodeError as e:
-                print(f"JSON parsing error: {e}")
-                print("The response was not in valid JSON format. Here's the raw text:")
-                print(response.choices[0].message.function_call.arguments)
-                return None
-        else:
-            print("No function call in the response")
-            return None
-
-    except openai.OpenAIError as e:
-        print(f"OpenAI API error: {e}")
-        return None
+# Goes through the shared async client: the texts are sent concurrently over pooled
+# connections, with retries and backoff, and a disk cache keyed by the prompt, so the
+# same OCR text is only ever sent once. One result per text, None where it failed.
+def call_llm_many(invoice_texts):
+    if not invoice_texts:
+        return []
+    try:
+        return structure_invoices(invoice_texts, api_key=st.secrets["OPENAI_API_KEY"])
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         import traceback
         traceback.print_exc()
-        return None
+        return [None] * len(invoice_texts)
+
+# Build a compact prompt from an /upload_invoice result: paragraphs as plain lines and
+# tables as CSV from their reconstructed grids instead of unordered OCR fragments.
+# Without line items, only the table rows that are not line items are kept: totals,
+# taxes and dates are often printed in the table rather than in a paragraph.
+def build_invoice_text(result, include_line_items=True):
+    sections = []
+    for number, entries in result.get("paragraphs", {}).items():
+        text = " ".join(entry["text"] for entry in entries)
+        if text:
+            sections.append(text)
+    grids = result.get("table_grids", {})
+    for number, entries in result.get("tables", {}).items():
+        grid = grids.get(number) or grids.get(str(number))
+        if grid and grid["cells"]:
+            if not include_line_items:
+                grid = {"cells": summary_rows(grid)}
+            if grid["cells"]:
+                sections.append(f"Table {number} (CSV):\n{grid_to_csv(grid).strip()}")
+        elif include_line_items:
+            sections.append(" ".join(entry["text"] for entry in entries))
+    return "\n".join(sections)
+
+# Structure an /upload_invoice result locally and only ask the LLM for the fields the local
+# extractor is not confident about. The line item rows of the tables are left out of the
+# prompt when the line items were already parsed from their grids.
+def structure_invoice(result):
+    return structure_invoice_batch([result])[0]
+
+# Structure several /upload_invoice results, e.g. the invoices of a batch upload: every
+# invoice the local extractor is unsure about is sent to the LLM in one concurrent call.
+def structure_invoice_batch(results):
+    extracted = [field_extractor.extract(result) for result in results]
+    pending = []
+    for index, (data, confidences) in enumerate(extracted):
+        uncertain = low_confidence_fields(confidences)
+        if uncertain:
+            print(f"Asking the LLM for low-confidence fields of invoice {index + 1}: {uncertain}")
+            pending.append((index, uncertain))
+
+    texts = [build_invoice_text(results[index], include_line_items=not extracted[index][0]["line_items"]) for index, _ in pending]
+    for (index, uncertain), structured in zip(pending, call_llm_many(texts)):
+        data = extracted[index][0]
+        if structured is None:
+            continue
+        for field in uncertain:
+            if structured.get(field) is not None:
+                data[field] = structured[field]
+        if not data["line_items"]:
+            data["line_items"] = structured.get("line_items", [])
+    return [data for data, _ in extracted]
@@ -0,0 +1,505 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+"""
+Asynchronous, batched and cached client for structuring invoices with an LLM.
+
+- One pooled HTTP client is shared by every request of a StructuringClient
+- Requests run concurrently, bounded by a semaphore
+- Rate limits, timeouts and server errors are retried with exponential backoff,
+  honouring the server's retry-after-ms and Retry-After headers
+- Responses are cached on disk by a hash of the model, schema and prompt, so re-running
+  the same OCR text costs nothing
+- The backend is pluggable: point OpenAIBackend at any OpenAI-compatible base_url,
+  such as the stub server below, to measure throughput offline
+
+Usage:
+    python llm_client.py stub-server --port 8081 --latency 0.5
+    python llm_client.py bench --base-url http://127.0.0.1:8081/v1 --requests 200 --concurrency 16
+"""
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL")  # unset uses the OpenAI API
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # seconds per request
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")  # empty disables the cache
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+LLM_CACHE_RESCAN_INTERVAL = float(os.getenv("LLM_CACHE_RESCAN_INTERVAL", "60"))  # seconds between disk size rescans
+
+PROMPT_TEMPLATE = "Extract and structure the following invoice data: {invoice_text}"
+
+STRUCTURE_INVOICE_FUNCTION = {
+    "name": "structure_invoice",
+    "description": "Extract and structure invoice data into a standardized format",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "company_name": {"type": "string", "description": "The name of the company issuing the invoice"},
+            "invoice_number": {"type": "string", "description": "The unique identifier for the invoice"},
+            "date": {"type": "string", "description": "The date of the invoice (ISO 8601 format preferred)"},
+            "due_date": {"type": "string", "description": "The due date for payment (ISO 8601 format preferred)"},
+            "total_amount": {"type": "number", "description": "The total amount due on the invoice"},
+            "currency": {"type": "string", "description": "The currency used in the invoice (e.g., USD, EUR)"},
+            "billing_address": {"type": "string", "description": "The billing address on the invoice"},
+            "line_items": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "description": {"type": "string"},
+                        "quantity": {"type": "number"},
+                        "unit_price": {"type": "number"},
+                        "total": {"type": "number"}
+                    }
+                },
+                "description": "An array of items listed on the invoice"
+            }
+        },
+        "required": ["company_name", "invoice_number", "date", "total_amount"]
+    }
+}
+
+class RetryableError(Exception):
+    """
+    A backend failure worth retrying, such as a rate limit or a timeout.
+
+    Attributes:
+        retry_after (float or None): Seconds the server asked to wait, if it said.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class OpenAIBackend:
+    """
+    Call an OpenAI-compatible chat completions API with the structure_invoice function.
+
+    The AsyncOpenAI client and its connection pool are created on first use and reused by
+    every later request. Retries are left to StructuringClient, so the SDK's own are disabled.
+    """
+
+    def __init__(self, api_key=None, model=LLM_MODEL, base_url=LLM_BASE_URL,
+                 max_connections=LLM_MAX_CONNECTIONS, timeout=LLM_TIMEOUT):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY") or "unused"
+        self.model = model
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client = None
+
+    @property
+    def cache_namespace(self):
+        return f"{self.model}|{self.base_url or 'openai'}"
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            import openai
+
+            self._client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,
+                timeout=self.timeout,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                    timeout=self.timeout,
+                ),
+            )
+        return self._client
+
+    async def complete(self, prompt):
+        """
+        Send one prompt and parse the function call arguments.
+
+        Args:
+            prompt (str): The user message.
+
+        Returns:
+            dict or None: The structured invoice, or None if the model did not call the function
+                          or returned invalid JSON.
+
+        Raises:
+            RetryableError: On rate limits, timeouts, connection and server errors.
+        """
+        import openai
+
+        try:
+            response = await self._get_client().chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                functions=[STRUCTURE_INVOICE_FUNCTION],
+                function_call={"name": "structure_invoice"},
+            )
+        except openai.RateLimitError as e:
+            raise RetryableError(str(e), _retry_after(e.response))
+        except (openai.APITimeoutError, openai.APIConnectionError) as e:
+            raise RetryableError(str(e))
+        except openai.InternalServerError as e:
+            raise RetryableError(str(e), _retry_after(e.response))
+
+        if not response.choices or not response.choices[0].message.function_call:
+            print("No function call in the response")
+            return None
+        try:
+            return json.loads(response.choices[0].message.function_call.arguments)
+        except json.JSONDecodeError as e:
+            print(f"JSON parsing error: {e}")
+            return None
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+def _retry_after(response):
+    # OpenAI sends retry-after-ms, more precise than the standard Retry-After, which is
+    # either seconds or an HTTP date.
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+    try:
+        return float(headers.get("retry-after-ms")) / 1000
+    except (TypeError, ValueError):
+        pass
+    value = headers.get("retry-after")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class DiskCache:
+    """
+    A directory of JSON responses keyed by the SHA-256 of the request.
+
+    Files are written to a temporary name and renamed, so concurrent writers and readers
+    never see partial entries. Entries older than `ttl` seconds are misses, and the least
+    recently used files past `max_bytes` are evicted. A hit refreshes the file's mtime, and
+    the size index is rebuilt from a directory scan every `rescan_interval` seconds so
+    entries written by other processes count towards the cap.
+    """
+
+    def __init__(self, directory=LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL,
+                 rescan_interval=LLM_CACHE_RESCAN_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> size, least recently used first
+        self._bytes = 0
+        self._scanned_at = 0.0
+        self.evictions = 0
+
+    def key(self, namespace, prompt):
+        payload = json.dumps([namespace, STRUCTURE_INVOICE_FUNCTION, prompt], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _load_index(self):
+        entries = []
+        if os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith(".json"):
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue  # removed by another process during the scan
+                    entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        with self._lock:
+            self._index = index
+            self._bytes = sum(index.values())
+            self._scanned_at = time.time()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                if time.time() - os.fstat(f.fileno()).st_mtime > self.ttl:
+                    raise FileNotFoundError
+                value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            with self._lock:
+                self._drop(key)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if time.time() - self._scanned_at > self.rescan_interval:
+            self._load_index()
+        path = self._path(key)
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+                size = f.tell()
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            # A failed write only costs the cache entry, never the response itself.
+            print(f"Error writing LLM cache entry {key}: {e}")
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            return
+        with self._lock:
+            if key in self._index:
+                self._bytes -= self._index.pop(key)
+            self._index[key] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._index:
+                self._drop(next(iter(self._index)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        if key in self._index:
+            self._bytes -= self._index.pop(key)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+class StructuringClient:
+    """
+    Structure many invoice texts concurrently through a backend, with retries and a disk cache.
+
+    Example:
+        >>> async with StructuringClient(OpenAIBackend()) as client:
+        ...     results = await client.structure_many(texts)
+    """
+
+    def __init__(self, backend=None, concurrency=LLM_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                 cache_dir=LLM_CACHE_DIR):
+        self.backend = backend or OpenAIBackend()
+        self.max_retries = max_retries
+        self.cache = DiskCache(cache_dir) if cache_dir else None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {"requests": 0, "cache_hits": 0, "retries": 0, "failures": 0}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.backend.aclose()
+
+    async def structure(self, invoice_text):
+        """
+        Structure one invoice text.
+
+        Args:
+            invoice_text (str): The OCR text, e.g. from `llm.build_invoice_text`.
+
+        Returns:
+            dict or None: The structured invoice, or None if every attempt failed.
+        """
+        prompt = PROMPT_TEMPLATE.format(invoice_text=invoice_text)
+        key = self.cache.key(self.backend.cache_namespace, prompt) if self.cache else None
+        if key:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                return cached
+
+        result = await self._complete_with_retry(prompt)
+        if key and result is not None:
+            await asyncio.to_thread(self.cache.put, key, result)
+        return result
+
+    async def structure_many(self, invoice_texts):
+        """
+        Structure several invoice texts concurrently.
+
+        Args:
+            invoice_texts (list): OCR texts.
+
+        Returns:
+            list: One result per text, in input order, None for texts that failed.
+        """
+        return await asyncio.gather(*(self.structure(text) for text in invoice_texts))
+
+    async def _complete_with_retry(self, prompt):
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    self.stats["requests"] += 1
+                    return await self.backend.complete(prompt)
+            except RetryableError as e:
+                if attempt == self.max_retries:
+                    print(f"LLM request failed after {attempt + 1} attempts: {e}")
+                    break
+                # Full jitter around an exponential backoff, but never sooner than the server asked.
+                delay = random.uniform(0, min(30.0, 2 ** attempt))
+                if e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+            except Exception as e:
+                print(f"LLM request failed: {e}")
+                break
+        self.stats["failures"] += 1
+        return None
+
+class BackgroundLoop:
+    """
+    An event loop on a daemon thread, so synchronous code can share one async client and its pool.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="llm-client", daemon=True).start()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+_default_client = None
+_default_loop = None
+_default_lock = threading.Lock()
+
+def get_default_client(api_key=None):
+    """
+    Get or create the process-wide client used by the synchronous helpers.
+
+    Args:
+        api_key (str, optional): The OpenAI API key, used the first time only.
+
+    Returns:
+        tuple: The StructuringClient and the BackgroundLoop it runs on.
+    """
+    global _default_client, _default_loop
+    with _default_lock:
+        if _default_client is None:
+            _default_loop = BackgroundLoop()
+
+            async def create():
+                # The semaphore must be created on the loop it is used from.
+                return StructuringClient(OpenAIBackend(api_key=api_key))
+
+            _default_client = _default_loop.run(create())
+    return _default_client, _default_loop
+
+def structure_invoices(invoice_texts, api_key=None):
+    """
+    Synchronously structure several invoice texts with the shared client.
+
+    Args:
+        invoice_texts (list): OCR texts.
+        api_key (str, optional): The OpenAI API key.
+
+    Returns:
+        list: One result per text, None for texts that failed.
+    """
+    client, loop = get_default_client(api_key)
+    return loop.run(client.structure_many(invoice_texts))
+
+def create_stub_app(latency=0.5, rate_limit_every=0):
+    """
+    Build an OpenAI-compatible stub server that answers every request with a fixed invoice.
+
+    Args:
+        latency (float, optional): Seconds each response is delayed, to mimic the real API.
+        rate_limit_every (int, optional): Answer every n-th request with 429 to exercise the retries, 0 never.
+
+    Returns:
+        FastAPI: The stub application.
+    """
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+    counter = {"requests": 0}
+    invoice = {"company_name": "Stub SARL", "invoice_number": "STUB-1", "date": "2024-01-01",
+               "total_amount": 0, "currency": "EUR", "line_items": []}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: dict):
+        counter["requests"] += 1
+        if rate_limit_every and counter["requests"] % rate_limit_every == 0:
+            return JSONResponse(status_code=429, headers={"Retry-After": "0.1"},
+                                content={"error": {"message": "Rate limited", "type": "rate_limit"}})
+        await asyncio.sleep(latency)
+        return {
+            "id": f"stub-{counter['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": None,
+                            "function_call": {"name": "structure_invoice", "arguments": json.dumps(invoice)}},
+                "finish_reason": "function_call",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+async def run_bench(base_url, requests, concurrency):
+    # Unique prompts and no cache, so every request reaches the backend.
+    texts = [f"Invoice {i} {random.random()}" for i in range(requests)]
+    async with StructuringClient(OpenAIBackend(base_url=base_url), concurrency=concurrency, cache_dir=None) as client:
+        start = time.perf_counter()
+        results = await client.structure_many(texts)
+        elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput": round(requests / elapsed, 2),
+        "succeeded": sum(result is not None for result in results),
+        **client.stats,
+    }, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM structuring client tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stub_parser = subparsers.add_parser("stub-server", help="Serve an OpenAI-compatible stub")
+    stub_parser.add_argument("--port", type=int, default=8081)
+    stub_parser.add_argument("--latency", type=float, default=0.5)
+    stub_parser.add_argument("--rate-limit-every", type=int, default=0)
+    bench_parser = subparsers.add_parser("bench", help="Measure structuring throughput against a backend")
+    bench_parser.add_argument("--base-url", default="http://127.0.0.1:8081/v1")
+    bench_parser.add_argument("--requests", type=int, default=100)
+    bench_parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY)
+    args = parser.parse_args()
+
+    if args.command == "stub-server":
+        import uvicorn
+
+        uvicorn.run(create_stub_app(args.latency, args.rate_limit_every), port=args.port)
+    else:
+        asyncio.run(run_bench(args.base_url, args.requests, args.concurrency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import json
+import pytest
+import NLP.data_annotation as data_annotation
+from NLP.data_annotation import FakeBackend, batch_process, find_entity_spans, read_checkpoint, truncate_partial_line
+
+def test_find_entity_spans_matches_whole_tokens_only():
+    text = "Invoice INV-12 from 2012, qty 12, 12/03, 12.50 and 12."
+    assert find_entity_spans(text, {"QUANTITY": "12"}) == [(30, 32, "QUANTITY"), (51, 53, "QUANTITY")]
+
+def test_find_entity_spans_matches_values_with_separators():
+    text = "Facture INV-12 du 12/03/2024"
+    assert find_entity_spans(text, {"INVOICE_NUMBER": "INV-12", "DATE": "12/03/2024"}) == [
+        (8, 14, "INVOICE_NUMBER"),
+        (18, 28, "DATE"),
+    ]
+
+def test_find_entity_spans_prefers_longer_overlapping_values():
+    text = "ACME Services SARL, ACME"
+    spans = find_entity_spans(text, {"COMPANY_NAME": "ACME Services SARL", "BRAND": "ACME"})
+    assert spans == [(0, 18, "COMPANY_NAME"), (20, 24, "BRAND")]
+
+def test_find_entity_spans_skips_empty_values():
+    assert find_entity_spans("Total 100", {"TOTAL_AMOUNT": "", "DATE": None}) == []
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = tmp_path / "invoices.txt"
+    path.write_text("".join(f"Invoice {i}\n" for i in range(7)))
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def single_attempt(monkeypatch):
+    # Failures are split at once instead of waiting for the retry backoff.
+    monkeypatch.setattr(data_annotation, "ANNOTATION_ATTEMPTS", 1)
+
+def annotate(text):
+    return {"INVOICE_NUMBER": text.split()[-1]}
+
+def run(backend, data_path, checkpoint_path, **kwargs):
+    return batch_process(backend, data_path, str(checkpoint_path), batch_size=3, workers=2, rate=1000, **kwargs)
+
+def test_batch_process_annotates_every_line(data_path, tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    assert run(FakeBackend(annotate), data_path, checkpoint) == {"skipped": 0, "annotated": 7, "failed": 0}
+    entries = sorted(read_checkpoint(str(checkpoint)), key=lambda entry: entry["index"])
+    assert [entry["annotations"]["INVOICE_NUMBER"] for entry in entries] == [str(i) for i in range(7)]
+
+def test_batch_process_resumes_after_a_partial_line(data_path, tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    done = [json.dumps({"index": i, "text": f"Invoice {i}", "annotations": annotate(f"Invoice {i}")}) for i in range(3)]
+    checkpoint.write_text("\n".join(done) + '\n{"index": 3, "te')
+
+    assert run(FakeBackend(annotate), data_path, checkpoint) == {"skipped": 3, "annotated": 4, "failed": 0}
+    lines = checkpoint.read_text().splitlines()
+    assert len(lines) == 7
+    assert sorted(json.loads(line)["index"] for line in lines) == list(range(7))
+
+def test_batch_process_splits_failed_batches(data_path, tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+
+    def annotate_or_fail(text):
+        if text == "Invoice 4":
+            raise ValueError("unreadable invoice")
+        return annotate(text)
+
+    assert run(FakeBackend(annotate_or_fail), data_path, checkpoint) == {"skipped": 0, "annotated": 6, "failed": 1}
+    assert 4 not in {entry["index"] for entry in read_checkpoint(str(checkpoint))}
+
+    # The failed line is retried on the next run.
+    assert run(FakeBackend(annotate), data_path, checkpoint) == {"skipped": 6, "annotated": 1, "failed": 0}
+
+def test_batch_process_raises_checkpoint_errors(data_path, tmp_path):
+    # Annotations that cannot be written stop the run instead of being reported as success.
+    with pytest.raises(TypeError):
+        run(FakeBackend(lambda text: {"INVOICE_NUMBER": object()}), data_path, tmp_path / "checkpoint.jsonl")
+
+@pytest.mark.parametrize("contents, expected", [
+    (b'{"index": 0}\n{"index": 1}\n{"ind', b'{"index": 0}\n{"index": 1}\n'),
+    (b'{"index": 0}\n', b'{"index": 0}\n'),
+    (b'{"ind', b""),
+    (b"", b""),
+])
+def test_truncate_partial_line(tmp_path, contents, expected):
+    path = tmp_path / "checkpoint.jsonl"
+    path.write_bytes(contents)
+    truncate_partial_line(str(path))
+    assert path.read_bytes() == expected
+
+def test_truncate_partial_line_without_checkpoint(tmp_path):
+    truncate_partial_line(str(tmp_path / "missing.jsonl"))
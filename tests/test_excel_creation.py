@@ -0,0 +1,55 @@
+import csv
+import io
+import openpyxl
+import pyarrow.parquet as pq
+import excel_creation
+from excel_creation import export_csv, export_excel, stream_export
+
+INVOICES = [
+    {"invoice_number": "FA-1", "company_name": "ACME SARL", "total_amount": "1 234,56", "currency": "EUR",
+     "line_items": [{"description": "Conseil", "quantity": 2, "unit_price": "12,5", "total": "25,00"},
+                    {"description": "Remise", "quantity": 1, "unit_price": "offerte", "total": 0}]},
+    {"invoice_number": "FA-2", "company_name": "Globex", "total_amount": 99.9, "line_items": []},
+]
+
+def test_export_csv_repeats_invoice_columns_per_line_item():
+    output = io.BytesIO()
+    export_csv(INVOICES, output)
+    rows = list(csv.DictReader(io.StringIO(output.getvalue().decode("utf-8"))))
+    assert [(row["invoice_number"], row["line_description"]) for row in rows] == [
+        ("FA-1", "Conseil"), ("FA-1", "Remise"), ("FA-2", ""),
+    ]
+    assert rows[0]["total_amount"] == "1 234,56"
+
+def test_export_excel_writes_both_sheets():
+    output = io.BytesIO()
+    assert export_excel(INVOICES, output) == (2, 2)
+    workbook = openpyxl.load_workbook(output)
+    assert workbook.sheetnames == ["Invoice Details", "Line Items"]
+    details = list(workbook["Invoice Details"].values)
+    assert details[0] == tuple(excel_creation.INVOICE_COLUMNS)
+    assert [row[0] for row in details[1:]] == ["FA-1", "FA-2"]
+    items = list(workbook["Line Items"].values)
+    assert [row[:2] for row in items[1:]] == [("FA-1", "Conseil"), ("FA-1", "Remise")]
+
+def test_export_excel_rolls_over_full_sheets(monkeypatch):
+    monkeypatch.setattr(excel_creation, "XLSX_MAX_ROWS", 3)
+    invoices = [{"invoice_number": f"FA-{i}", "line_items": [{"description": "x"}] * 2} for i in range(3)]
+    output = io.BytesIO()
+    assert export_excel(invoices, output) == (3, 6)
+    workbook = openpyxl.load_workbook(output)
+    assert sorted(workbook.sheetnames) == ["Invoice Details", "Invoice Details (2)",
+                                           "Line Items", "Line Items (2)", "Line Items (3)"]
+    for name in ("Line Items", "Line Items (2)", "Line Items (3)"):
+        rows = list(workbook[name].values)
+        assert rows[0][0] == "invoice_number"
+        assert len(rows) == 3
+    assert list(workbook["Invoice Details (2)"].values)[1][0] == "FA-2"
+
+def test_export_parquet_parses_formatted_amounts_and_keeps_the_rest():
+    table = pq.read_table(io.BytesIO(b"".join(stream_export(INVOICES, "parquet")))).to_pylist()
+    assert [row["total_amount"] for row in table] == [1234.56, 1234.56, 99.9]
+    assert [row["line_unit_price"] for row in table] == [12.5, None, None]
+    assert [row["line_unit_price_raw"] for row in table] == [None, "offerte", None]
+    assert [row["line_total"] for row in table] == [25.0, 0.0, None]
+    assert all(row["total_amount_raw"] is None for row in table)
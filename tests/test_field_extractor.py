@@ -0,0 +1,87 @@
+import pytest
+from NLP.field_extractor import FIELD_CONFIDENCE_THRESHOLD, FieldExtractor, low_confidence_fields, parse_date
+
+def page(*paragraphs, donut=None):
+    # An /upload_invoice page with one paragraph region per text, stacked from the top of the page.
+    return {
+        "paragraphs": {number: [{"text": line} for line in lines] for number, lines in enumerate(paragraphs, 1)},
+        "tables": {},
+        "table_grids": {},
+        "donut_extraction": donut or {},
+        "regions": [{"number": number, "label": "Paragraph", "box": [0, 100 * number, 500, 100 * number + 80]}
+                    for number in range(1, len(paragraphs) + 1)],
+    }
+
+@pytest.fixture
+def extractor(tmp_path):
+    return FieldExtractor(model_dir=str(tmp_path / "no_model"))
+
+@pytest.mark.parametrize("text, expected", [
+    ("12/03/2024", "2024-03-12"),
+    ("03/25/2024", "2024-03-25"),
+    ("12.03.24", "2024-03-12"),
+    ("2024-03-12", "2024-03-12"),
+    ("12 mars 2024", "2024-03-12"),
+    ("5 de enero de 2024", "2024-01-05"),
+    ("March 12, 2024", "2024-03-12"),
+    ("31/02/2024", None),
+    ("Total", None),
+])
+def test_parse_date(text, expected):
+    assert parse_date(text) == expected
+
+def test_regex_candidates_labelled_fields(extractor):
+    text = "Facture N° FA-2024-0042\nDate de facture : 12/03/2024\nDate d'échéance : 12/04/2024\nTotal TTC : 1 234,56 €"
+    candidates = extractor.regex_candidates(text)
+    assert ("invoice_number", "FA-2024-0042", "regex") in candidates
+    assert ("date", "12/03/2024", "regex") in candidates
+    assert ("due_date", "12/04/2024", "regex") in candidates
+    assert ("date", "12/04/2024", "regex") not in candidates
+    assert ("total_amount", "1 234,56 €", "regex") in candidates
+    assert ("currency", "EUR", "regex_exact") in candidates
+
+def test_regex_candidates_year_is_weak_invoice_number(extractor):
+    assert extractor.regex_candidates("Invoice number: 2024") == [("invoice_number", "2024", "regex_weak")]
+
+def test_regex_candidates_skips_invoice_dates(extractor):
+    fields = [field for field, _, _ in extractor.regex_candidates("Factura 12/03/2024")]
+    assert "invoice_number" not in fields
+
+def test_regex_candidates_count_after_total_is_weak(extractor):
+    candidates = extractor.regex_candidates("Total TTC 12 items 100")
+    assert [candidate for candidate in candidates if candidate[0] == "total_amount"] == [("total_amount", "12", "regex_weak")]
+
+def test_regex_candidates_prefers_last_formatted_total(extractor):
+    candidates = extractor.regex_candidates("Total HT 100,00 €\nTotal 3 items 2\nTotal TTC 120,00 €")
+    assert [candidate for candidate in candidates if candidate[0] == "total_amount"] == [("total_amount", "120,00 €", "regex")]
+
+def test_extract_single_regex_hit_is_not_trusted(extractor):
+    data, confidences = extractor.extract(page(["Invoice number: INV-0042"]))
+    assert data["invoice_number"] == "INV-0042"
+    assert confidences["invoice_number"] < FIELD_CONFIDENCE_THRESHOLD
+    assert "invoice_number" in low_confidence_fields(confidences)
+
+def test_extract_corroborated_fields_are_trusted(extractor):
+    result = page(
+        ["ACME SARL", "12 rue de la Paix 75002 Paris"],
+        ["Facture N° FA-0042", "Date : 12/03/2024"],
+        ["Total TTC : 120,00 €"],
+        donut={"invoice_number": "FA-0042", "total": "120,00"},
+    )
+    data, confidences = extractor.extract(result)
+    assert data["company_name"] == "ACME SARL"
+    assert data["invoice_number"] == "FA-0042"
+    assert data["date"] == "2024-03-12"
+    assert data["total_amount"] == 120.0
+    assert data["currency"] == "EUR"
+    assert low_confidence_fields(confidences) == ["billing_address"]
+
+def test_extract_header_company_without_legal_form(extractor):
+    data, confidences = extractor.extract(page(["FACTURE", "Boulangerie Martin"], ["Total TTC : 8,40 €"]))
+    assert data["company_name"] == "Boulangerie Martin"
+    assert 0 < confidences["company_name"] < FIELD_CONFIDENCE_THRESHOLD
+
+def test_extract_count_is_not_taken_for_total(extractor):
+    data, confidences = extractor.extract(page(["Total TTC 12 items 100"]))
+    assert confidences["total_amount"] < FIELD_CONFIDENCE_THRESHOLD
+    assert "total_amount" in low_confidence_fields(confidences)
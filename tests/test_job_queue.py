@@ -0,0 +1,110 @@
+import io
+import os
+import time
+import pytest
+from fastapi import HTTPException
+from API.Backend.job_queue import JobQueue, JobWorker
+
+@pytest.fixture
+def job_queue(tmp_path):
+    return JobQueue(db_path=str(tmp_path / "jobs.db"), spool_dir=str(tmp_path / "spool"),
+                    max_attempts=2, retry_delay=0, lease_seconds=60)
+
+def submit(job_queue, contents=b"%PDF-1.4", filename="invoice.pdf"):
+    return job_queue.submit(io.BytesIO(contents), filename)
+
+def expire_lease(job_queue, job_id):
+    # Age the job past its lease as if its worker had stopped renewing it.
+    with job_queue._connect() as conn:
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - 2 * job_queue.lease_seconds, job_id))
+
+def test_claim_takes_the_oldest_ready_job(job_queue):
+    first, second = submit(job_queue), submit(job_queue)
+    job = job_queue.claim("worker-1")
+    assert job["id"] == first
+    assert job["attempts"] == 1 and job["worker"] == "worker-1"
+    assert job_queue.get(first)["status"] == "running"
+    assert job_queue.claim("worker-2")["id"] == second
+    assert job_queue.claim("worker-3") is None
+
+def test_complete_stores_the_result_and_removes_the_payload(job_queue):
+    job_id = submit(job_queue)
+    job = job_queue.claim("worker-1")
+    assert job_queue.heartbeat(job)
+    assert job_queue.complete(job, {"pages": []})
+    assert job_queue.get(job_id, with_result=True)["result"] == {"pages": []}
+    assert not os.path.exists(job["payload_path"])
+
+def test_fail_requeues_until_max_attempts(job_queue):
+    job_id = submit(job_queue)
+    assert job_queue.fail(job_queue.claim("worker-1"), "boom") == "queued"
+    job = job_queue.claim("worker-1")
+    assert job["attempts"] == 2
+    assert job_queue.fail(job, "boom") == "failed"
+    assert job_queue.get(job_id)["status"] == "failed"
+    assert not os.path.exists(job["payload_path"])
+
+def test_permanent_failure_is_not_retried(job_queue):
+    job_id = submit(job_queue)
+    assert job_queue.fail(job_queue.claim("worker-1"), "No pages found in upload", permanent=True) == "failed"
+    assert job_queue.get(job_id)["attempts"] == 1
+
+def test_requeue_stale_only_takes_expired_leases(job_queue):
+    stale, live = submit(job_queue), submit(job_queue)
+    job_queue.claim("worker-1")
+    job_queue.claim("worker-2")
+    expire_lease(job_queue, stale)
+    assert job_queue.requeue_stale() == 1
+    assert job_queue.get(stale)["status"] == "queued"
+    assert job_queue.get(live)["status"] == "running"
+
+def test_heartbeat_keeps_the_lease(job_queue):
+    job_id = submit(job_queue)
+    job = job_queue.claim("worker-1")
+    expire_lease(job_queue, job_id)
+    assert job_queue.heartbeat(job)
+    assert job_queue.requeue_stale() == 0
+
+def test_attempt_that_lost_its_lease_cannot_finish(job_queue):
+    job_id = submit(job_queue)
+    old = job_queue.claim("worker-1")
+    expire_lease(job_queue, job_id)
+    job_queue.requeue_stale()
+    new = job_queue.claim("worker-2")
+
+    assert not job_queue.heartbeat(old)
+    assert not job_queue.complete(old, {"stale": True})
+    assert job_queue.fail(old, "late failure") is None
+    assert job_queue.get(job_id)["status"] == "running"
+    assert os.path.exists(new["payload_path"])
+
+    assert job_queue.complete(new, {"stale": False})
+    assert job_queue.get(job_id, with_result=True)["result"] == {"stale": False}
+
+def test_same_worker_name_cannot_finish_an_older_attempt(job_queue):
+    job_id = submit(job_queue)
+    old = job_queue.claim("worker-1")
+    expire_lease(job_queue, job_id)
+    job_queue.requeue_stale()
+    job_queue.claim("worker-1")
+    assert not job_queue.complete(old, {"stale": True})
+
+def test_worker_fails_client_errors_permanently(job_queue):
+    job_id = submit(job_queue)
+
+    def handler(contents, filename):
+        raise HTTPException(status_code=400, detail="No pages found in upload")
+
+    JobWorker(job_queue, handler)._execute(job_queue.claim("worker-1"))
+    job = job_queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "No pages found in upload"
+
+def test_worker_retries_other_errors(job_queue):
+    job_id = submit(job_queue)
+
+    def handler(contents, filename):
+        raise RuntimeError("model crashed")
+
+    JobWorker(job_queue, handler)._execute(job_queue.claim("worker-1"))
+    assert job_queue.get(job_id)["status"] == "queued"
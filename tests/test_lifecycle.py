@@ -0,0 +1,49 @@
+import pytest
+from API.Backend.lifecycle import ModelManager, ModelNotReady
+
+def flaky_loader(failures):
+    calls = {"count": 0}
+
+    def load():
+        calls["count"] += 1
+        if calls["count"] <= failures:
+            raise OSError("download interrupted")
+        return "model"
+
+    return load, calls
+
+def test_start_reloads_a_model_that_failed_in_preload():
+    models = ModelManager(timeout=5)
+    loader, calls = flaky_loader(failures=1)
+    models.register("yolo", loader)
+    assert not models.preload()
+    assert models.status()["yolo"]["state"] == "failed"
+
+    # A forked worker inherits the failed slot; its own start loads it again.
+    models.start()
+    assert models.get("yolo") == "model"
+    assert models.ready()
+    assert calls["count"] == 2
+
+def test_get_retries_failed_models_after_the_interval():
+    models = ModelManager(timeout=5, retry_interval=3600)
+    loader, calls = flaky_loader(failures=1)
+    models.register("donut", loader)
+    models.load_all()
+    with pytest.raises(ModelNotReady):
+        models.get("donut")
+    assert calls["count"] == 1
+
+    models.retry_interval = 0
+    assert models.get("donut") == "model"
+    assert calls["count"] == 2
+
+def test_loaded_models_are_not_reloaded():
+    models = ModelManager(timeout=5)
+    loader, calls = flaky_loader(failures=0)
+    models.register("ocr", loader)
+    assert models.load_all()
+    models.start()
+    models.retry_failed()
+    assert models.get("ocr") == "model"
+    assert calls["count"] == 1
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+from email.utils import formatdate
+import pytest
+import llm_client
+from llm_client import DiskCache, RetryableError, StructuringClient, _retry_after
+
+class Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+class FakeBackend:
+    # Raises the queued errors in order, then answers every prompt.
+    cache_namespace = "fake"
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.prompts = []
+
+    async def complete(self, prompt):
+        self.prompts.append(prompt)
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"invoice_number": prompt[-4:]}
+
+    async def aclose(self):
+        pass
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Record backoff delays instead of waiting, with no jitter.
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(llm_client.asyncio, "sleep", sleep)
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    return delays
+
+def structure(client, *texts):
+    async def run():
+        async with client:
+            return await client.structure_many(list(texts))
+    return asyncio.run(run())
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after-ms": "1500", "retry-after": "9"}, 1.5),
+    ({"retry-after": "2"}, 2.0),
+    ({"retry-after-ms": "soon", "retry-after": "0.5"}, 0.5),
+    ({"retry-after": formatdate(0, usegmt=True)}, 0.0),
+    ({"retry-after": "tomorrow"}, None),
+    ({}, None),
+])
+def test_retry_after(headers, expected):
+    assert _retry_after(Response(headers)) == expected
+
+def test_retry_after_http_date_in_the_future():
+    assert 50 < _retry_after(Response({"retry-after": formatdate(time.time() + 60, usegmt=True)})) <= 60
+
+def test_retry_after_without_response():
+    assert _retry_after(None) is None
+
+def test_retries_with_exponential_backoff(sleeps):
+    backend = FakeBackend([RetryableError("rate limited"), RetryableError("timeout"), RetryableError("busy")])
+    client = StructuringClient(backend, max_retries=3, cache_dir=None)
+    assert structure(client, "FA-0001") == [{"invoice_number": "0001"}]
+    assert sleeps == [1, 2, 4]
+    assert client.stats == {"requests": 4, "cache_hits": 0, "retries": 3, "failures": 0}
+
+def test_retry_waits_at_least_what_the_server_asked(sleeps):
+    client = StructuringClient(FakeBackend([RetryableError("rate limited", retry_after=7.5)]), cache_dir=None)
+    structure(client, "FA-0001")
+    assert sleeps == [7.5]
+
+def test_gives_up_after_max_retries(sleeps):
+    backend = FakeBackend([RetryableError("rate limited")] * 3)
+    client = StructuringClient(backend, max_retries=2, cache_dir=None)
+    assert structure(client, "FA-0001") == [None]
+    assert len(backend.prompts) == 3
+    assert client.stats["failures"] == 1
+
+def test_other_errors_are_not_retried(sleeps):
+    backend = FakeBackend([ValueError("bad request")])
+    client = StructuringClient(backend, cache_dir=None)
+    assert structure(client, "FA-0001") == [None]
+    assert len(backend.prompts) == 1 and sleeps == []
+
+def test_cache_hits_skip_the_backend(tmp_path):
+    backend = FakeBackend()
+    first = StructuringClient(backend, cache_dir=str(tmp_path))
+    assert structure(first, "FA-0001", "FA-0002") == [{"invoice_number": "0001"}, {"invoice_number": "0002"}]
+
+    second = StructuringClient(backend, cache_dir=str(tmp_path))
+    assert structure(second, "FA-0002", "FA-0003") == [{"invoice_number": "0002"}, {"invoice_number": "0003"}]
+    assert second.stats["cache_hits"] == 1
+    assert len(backend.prompts) == 3
+
+def test_failed_results_are_not_cached(tmp_path, sleeps):
+    backend = FakeBackend([RetryableError("busy")])
+    structure(StructuringClient(backend, max_retries=0, cache_dir=str(tmp_path)), "FA-0001")
+    client = StructuringClient(backend, cache_dir=str(tmp_path))
+    assert structure(client, "FA-0001") == [{"invoice_number": "0001"}]
+    assert client.stats["cache_hits"] == 0
+
+def test_disk_cache_expires_entries(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60)
+    cache.put("ab01", {"total": 1})
+    assert cache.get("ab01") == {"total": 1}
+    old = time.time() - 120
+    os.utime(cache._path("ab01"), (old, old))
+    assert cache.get("ab01") is None
+    assert not os.path.exists(cache._path("ab01"))
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    value = {"text": "x" * 100}
+    cache = DiskCache(str(tmp_path), max_bytes=350)
+    for key in ("aa01", "bb02", "cc03"):
+        cache.put(key, value)
+    cache.get("aa01")
+    cache.put("dd04", value)
+    assert cache.get("bb02") is None
+    assert all(cache.get(key) == value for key in ("aa01", "cc03", "dd04"))
+    assert cache.evictions == 1
+
+def test_disk_cache_counts_entries_from_earlier_runs(tmp_path):
+    value = {"text": "x" * 100}
+    DiskCache(str(tmp_path)).put("aa01", value)
+    DiskCache(str(tmp_path)).put("bb02", value)
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    cache.put("cc03", value)
+    assert cache.get("aa01") is None
+    assert cache.get("bb02") == value
+
+def test_disk_cache_put_removes_temp_file_on_failure(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.put("ab01", {"total": object()})
+    assert cache.get("ab01") is None
+    assert os.listdir(tmp_path / "ab") == []
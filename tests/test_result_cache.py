@@ -0,0 +1,22 @@
+import hashlib
+from API.Backend import donut_extraction, model, result_cache
+from API.Backend.result_cache import cache_key, cache_key_from_digest, model_versions
+
+def test_cache_key_from_digest_can_be_computed_again():
+    digest = hashlib.sha256(b"%PDF-1.4")
+    assert cache_key_from_digest(digest) == cache_key_from_digest(digest) == cache_key(b"%PDF-1.4")
+
+def test_model_versions_use_the_loaded_backends(monkeypatch):
+    monkeypatch.setattr(result_cache, "YOLO_BACKEND", "onnx")
+    monkeypatch.setattr(result_cache, "DONUT_BACKEND", "int8")
+    monkeypatch.setattr(model, "_loaded_backend", None)
+    monkeypatch.setattr(donut_extraction, "_loaded_backend", None)
+    configured = model_versions()
+    assert ":onnx|" in configured and ":int8|" in configured
+
+    # Both loaders fell back to PyTorch.
+    monkeypatch.setattr(model, "_loaded_backend", "torch")
+    monkeypatch.setattr(donut_extraction, "_loaded_backend", "torch")
+    loaded = model_versions()
+    assert ":torch|" in loaded and ":onnx|" not in loaded and ":int8|" not in loaded
+    assert cache_key(b"%PDF-1.4", loaded) != cache_key(b"%PDF-1.4", configured)
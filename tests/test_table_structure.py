@@ -0,0 +1,68 @@
+import pytest
+from API.Backend.table_structure import build_table_grid, grid_to_csv, parse_line_items, parse_number, summary_rows
+
+def entry(text, x1, y1, x2, y2):
+    return {"text": text, "confidence": 0.9, "box": [x1, y1, x2, y2]}
+
+INVOICE_GRID = {"cells": [
+    ["Commande 42", "", "", ""],
+    ["Désignation", "Qté", "Prix unitaire", "Montant"],
+    ["Conseil", "2", "450,00", "900,00"],
+    ["Déplacement", "1", "120,00", "120,00"],
+    ["Total HT", "", "", "1 020,00"],
+    ["TVA 20%", "", "", "204,00"],
+    ["Total TTC", "", "", "1 224,00"],
+]}
+
+@pytest.mark.parametrize("text, expected", [
+    ("2", 2.0),
+    ("12,50 €", 12.5),
+    ("$1,234.50", 1234.5),
+    ("1.234,50 €", 1234.5),
+    ("1 234,56", 1234.56),
+    ("1,234", 1234.0),
+    ("1.234.567", 1234567.0),
+    ("-5", -5.0),
+    ("1.5.", None),
+    ("1.2.3", None),
+    ("1,234,56", None),
+    ("2024-03", None),
+    ("Total", None),
+])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
+
+def test_build_table_grid_rows_and_columns():
+    grid = build_table_grid([
+        entry("Description", 10, 0, 90, 10),
+        entry("Total", 200, 0, 240, 10),
+        entry("Widget", 10, 20, 60, 30),
+        entry("blue", 65, 21, 95, 31),
+        entry("9.50", 200, 20, 230, 30),
+    ])
+    assert grid == {"rows": 2, "columns": 2, "cells": [["Description", "Total"], ["Widget blue", "9.50"]]}
+
+def test_build_table_grid_without_boxes():
+    assert build_table_grid([{"text": "Total", "confidence": 0.9}]) == {"rows": 0, "columns": 0, "cells": []}
+
+def test_parse_line_items_skips_summary_rows():
+    assert parse_line_items(INVOICE_GRID) == [
+        {"description": "Conseil", "quantity": 2.0, "unit_price": 450.0, "total": 900.0},
+        {"description": "Déplacement", "quantity": 1.0, "unit_price": 120.0, "total": 120.0},
+    ]
+
+def test_summary_rows_keep_totals_and_taxes():
+    assert summary_rows(INVOICE_GRID) == [
+        ["Commande 42", "", "", ""],
+        ["Total HT", "", "", "1 020,00"],
+        ["TVA 20%", "", "", "204,00"],
+        ["Total TTC", "", "", "1 224,00"],
+    ]
+
+def test_summary_rows_without_header():
+    grid = {"cells": [["Total TTC", "120,00"], ["", ""]]}
+    assert parse_line_items(grid) == []
+    assert summary_rows(grid) == [["Total TTC", "120,00"]]
+
+def test_grid_to_csv_quotes_cells():
+    assert grid_to_csv({"cells": [["Item", "Price"], ["Bolts, M6", "1,50"]]}) == 'Item,Price\n"Bolts, M6","1,50"\n'